@@ -0,0 +1,89 @@
+"""
+In-memory audio decoding for voice transcription.
+
+Recordings arrive as raw bytes (the request body or a multipart file
+part) and are decoded straight to 16 kHz mono float32 PCM with
+faster-whisper's PyAV decoder, which reads anything FFmpeg does,
+including the webm/opus that browsers' MediaRecorder produces. Nothing
+is written to disk, and Whisper gets the decoded samples instead of a
+file it would decode a second time. Every upload path is capped at
+MAX_AUDIO_BYTES while the body streams in.
+"""
+from fastapi import HTTPException, Request
+from typing import AsyncIterator, Optional
+import io
+import os
+
+# Whisper models take 16 kHz mono input
+SAMPLE_RATE = 16000
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(25 * 1024 * 1024)))
+# Room for multipart boundaries and part headers, or the JSON around base64 audio
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Audio larger than {limit} bytes")
+
+
+async def limited_stream(request: Request, limit: int) -> AsyncIterator[bytes]:
+    """The request body as it streams in; 413 once it passes `limit` bytes"""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise _too_large(limit)
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise _too_large(limit)
+        yield chunk
+
+
+async def read_audio_body(request: Request, limit: int = MAX_AUDIO_BYTES) -> bytes:
+    """The raw request body, read as it streams in; 413 past `limit` bytes"""
+    body = bytearray()
+    async for chunk in limited_stream(request, limit):
+        body.extend(chunk)
+    return bytes(body)
+
+
+async def read_audio_form(request: Request, limit: int = MAX_AUDIO_BYTES) -> Optional[bytes]:
+    """The `audio` (or `file`) part of a multipart body, None if there is none; 413 past `limit` bytes.
+
+    The body is parsed from the limited stream, so an oversized upload is
+    refused as it arrives instead of being spooled whole first.
+    """
+    from starlette.formparsers import MultiPartException, MultiPartParser
+    stream = limited_stream(request, limit + MULTIPART_OVERHEAD)
+    try:
+        form = await MultiPartParser(request.headers, stream, max_files=1, max_fields=10).parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    try:
+        upload = form.get("audio") or form.get("file")
+        if upload is None or isinstance(upload, str):
+            return None
+        data = await upload.read()
+    finally:
+        await form.close()
+    if len(data) > limit:
+        raise _too_large(limit)
+    return data
+
+
+async def read_audio_json(request: Request, limit: int = MAX_AUDIO_BYTES) -> bytes:
+    """The JSON body of a (deprecated) base64 upload, bounded by the size its audio may encode to"""
+    return await read_audio_body(request, (limit + 2) // 3 * 4 + MULTIPART_OVERHEAD)
+
+
+def decode_audio_bytes(data: bytes):
+    """Decode an in-memory audio file (wav, webm/opus, ogg, mp3, m4a...) to a float32 array at SAMPLE_RATE"""
+    if not data:
+        raise HTTPException(status_code=400, detail="No audio data received")
+    try:
+        from faster_whisper import decode_audio
+    except ImportError:
+        raise HTTPException(status_code=503, detail="Faster-Whisper not installed. Install with: pip install faster-whisper")
+    try:
+        return decode_audio(io.BytesIO(data), sampling_rate=SAMPLE_RATE)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode audio: {e}")
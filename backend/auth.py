@@ -1,6 +1,12 @@
 """
 Authentication module for DentalGPT using Google OAuth
+
+get_current_user caches the users row for USER_CACHE_TTL seconds, so every
+write to users goes through this module (get_or_create_user, update_user)
+and drops the cached row. Changes made directly in the database are seen
+once the entry expires.
 """
+from datetime import datetime
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
@@ -8,15 +14,21 @@ from typing import Optional
 import os
 import requests
 from dotenv import load_dotenv
-import psycopg2
-from psycopg2.extras import RealDictCursor
 
 load_dotenv()
 
+import psycopg2
+from psycopg2.extras import RealDictCursor
+from cache import cache_delete, cache_get, cache_set, cache_ttl, make_key
+
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-change-in-production")
 JWT_ALGORITHM = "HS256"
+# Cached as JSON, which turns these into strings
+USER_DATETIME_COLUMNS = ("created_at", "updated_at")
+# Columns update_user may change
+USER_SETTINGS_COLUMNS = ("whisper_model",)
 
 security = HTTPBearer()
 
@@ -112,11 +124,46 @@ def get_or_create_user(google_user_info: dict) -> dict:
             user = cur.fetchone()
         
         conn.commit()
+        invalidate_user(user["id"])
         return dict(user)
     finally:
         cur.close()
         conn.close()
 
+def update_user(user_id: int, **settings) -> Optional[dict]:
+    """Set USER_SETTINGS_COLUMNS on a user; returns the public fields, or None if there is no such user"""
+    unknown = set(settings) - set(USER_SETTINGS_COLUMNS)
+    if unknown:
+        raise ValueError(f"Not a user setting: {', '.join(sorted(unknown))}")
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=RealDictCursor)
+    try:
+        assignments = ", ".join(f"{column} = %s" for column in settings)
+        cur.execute(
+            f"""UPDATE users SET {assignments}, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+                RETURNING id, email, name, picture_url, whisper_model""",
+            (*settings.values(), user_id)
+        )
+        user = cur.fetchone()
+        conn.commit()
+        invalidate_user(user_id)
+        return dict(user) if user else None
+    finally:
+        cur.close()
+        conn.close()
+
+def invalidate_user(user_id: int):
+    """Drop the cached users row; call after every write to users"""
+    cache_delete(make_key("user", user_id))
+
+def _user_from_cache(user: dict) -> dict:
+    # Same types as a fresh database read
+    for column in USER_DATETIME_COLUMNS:
+        if isinstance(user.get(column), str):
+            user[column] = datetime.fromisoformat(user[column])
+    return user
+
 def create_jwt_token(user_id: int) -> str:
     """Create JWT token for user"""
     payload = {"user_id": user_id}
@@ -137,6 +184,14 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     payload = verify_jwt_token(token)
     user_id = payload.get("user_id")
     
+    # Every authenticated request needs the user row; share it across workers briefly
+    cache_key = make_key("user", user_id)
+    ttl = cache_ttl("user")
+    if ttl > 0:
+        cached_user = cache_get("user", cache_key)
+        if cached_user is not None:
+            return _user_from_cache(cached_user)
+    
     conn = get_db_connection()
     cur = conn.cursor(cursor_factory=RealDictCursor)
     
@@ -145,7 +200,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user = cur.fetchone()
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
-        return dict(user)
+        user = dict(user)
+        cache_set("user", cache_key, user, ttl)
+        return user
     finally:
         cur.close()
         conn.close()
@@ -0,0 +1,199 @@
+"""
+Shared cache for DentalGPT.
+
+Query embeddings, generated answers and authenticated users are cached
+through one backend chosen by CACHE_URL:
+
+- unset / "memory://": an in-process LRU. Fine for a single worker.
+- "redis://host:6379/0": Redis, shared by every worker on the host (and
+  across hosts). Needs the optional `redis` package.
+
+Values are stored as JSON, so cached rows come back as plain dicts/lists
+(datetimes as ISO strings). The cache is best effort: backend errors are
+logged and treated as misses.
+
+Answer caching is off unless ANSWER_CACHE_TTL is set: answer keys and
+values are built from prompts that embed patient records and chat
+history, so enabling it puts patient data (PHI) in the cache backend,
+i.e. in Redis when CACHE_URL points there. Only enable it where that
+store is covered like the database (access control, encryption, retention).
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+import json
+import logging
+import os
+import threading
+import time
+
+from metrics import Counter, registry
+from singleflight import digest
+
+logger = logging.getLogger("dentalgpt.cache")
+
+# Settings are read when used, not at import: this module is imported before
+# main.py has loaded .env, and a CACHE_URL frozen then would be silently ignored
+CACHE_TTL_DEFAULTS = {
+    "embedding": 86400,
+    "answer": 0,  # opt-in: answers carry patient data
+    "user": 60,
+}
+
+
+def cache_url() -> str:
+    return os.getenv("CACHE_URL", "memory://")
+
+
+def is_shared_url(url: str) -> bool:
+    return url.startswith(("redis://", "rediss://", "unix://"))
+
+
+def cache_ttl(namespace: str) -> int:
+    """Seconds to keep a namespace's entries, from <NAMESPACE>_CACHE_TTL; 0 disables caching for it"""
+    return int(os.getenv(f"{namespace.upper()}_CACHE_TTL", str(CACHE_TTL_DEFAULTS.get(namespace, 0))))
+
+CACHE_REQUESTS = registry.register(Counter(
+    "dentalgpt_cache_requests_total",
+    "Shared cache lookups by namespace and outcome"
+))
+
+
+class MemoryCache:
+    """Thread-safe LRU with per-entry expiry, local to one process"""
+
+    shared = False
+
+    def __init__(self, max_entries: Optional[int] = None):
+        self.max_entries = max_entries or int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, payload)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: str, payload: str, ttl: int):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, payload)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def reset_after_fork(self):
+        # The parent's lock may have been held by another thread at fork time
+        self._lock = threading.Lock()
+
+
+class RedisCache:
+    """Redis-backed cache shared by every worker process"""
+
+    shared = True
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL points at Redis but the redis package is not installed. Install with: pip install redis")
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._client.get(key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, payload: str, ttl: int):
+        self._client.set(key, payload, ex=ttl)
+
+    def delete(self, key: str):
+        self._client.delete(key)
+
+    def reset_after_fork(self):
+        # redis-py connection pools detect the pid change and reconnect on their own
+        pass
+
+
+def cache_from_env(url: Optional[str] = None):
+    url = url or cache_url()
+    if is_shared_url(url):
+        return RedisCache(url)
+    return MemoryCache()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """The process-wide cache backend, created on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = cache_from_env()
+                except Exception as e:
+                    logger.error("Cache backend unavailable, using in-process cache: %s", e)
+                    _cache = MemoryCache()
+    return _cache
+
+
+def reset_after_fork():
+    global _cache_lock
+    _cache_lock = threading.Lock()
+    if _cache is not None:
+        _cache.reset_after_fork()
+
+
+def make_key(namespace: str, *parts) -> str:
+    return f"{os.getenv('CACHE_KEY_PREFIX', 'dentalgpt:')}{namespace}:{digest(*parts)}"
+
+
+def cache_get(namespace: str, key: str) -> Any:
+    try:
+        payload = get_cache().get(key)
+    except Exception as e:
+        logger.warning("Cache read failed: %s", e)
+        CACHE_REQUESTS.inc(cache=namespace, outcome="error")
+        return None
+    CACHE_REQUESTS.inc(cache=namespace, outcome="hit" if payload is not None else "miss")
+    return json.loads(payload) if payload is not None else None
+
+
+def cache_set(namespace: str, key: str, value: Any, ttl: int):
+    if ttl <= 0 or value is None:
+        return
+    try:
+        get_cache().set(key, json.dumps(value, default=str), ttl)
+    except Exception as e:
+        logger.warning("Cache write failed: %s", e)
+        CACHE_REQUESTS.inc(cache=namespace, outcome="error")
+
+
+def cache_delete(key: str):
+    try:
+        get_cache().delete(key)
+    except Exception as e:
+        logger.warning("Cache delete failed: %s", e)
+
+
+def get_or_compute(namespace: str, parts: tuple, ttl: int, compute: Callable[[], Any]) -> Any:
+    """Return the cached value for (namespace, *parts), computing and storing it on a miss"""
+    if ttl <= 0:
+        return compute()
+    key = make_key(namespace, *parts)
+    value = cache_get(namespace, key)
+    if value is not None:
+        return value
+    value = compute()
+    cache_set(namespace, key, value, ttl)
+    return value
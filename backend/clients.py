@@ -0,0 +1,104 @@
+"""
+Lazily created provider clients for DentalGPT.
+
+Provider SDKs (Pinecone, Gemini, GLM) are imported and their clients built
+on first use instead of at import time, so the API boots in milliseconds
+even when a provider is slow or down. Each client remembers its last
+failure and fails fast until a retry is due; /ready reports their state.
+"""
+from fastapi import HTTPException
+from typing import Any, Callable, Optional
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("dentalgpt.clients")
+
+RETRY_INTERVAL = float(os.getenv("CLIENT_RETRY_INTERVAL", "10"))
+
+
+class LazyClient:
+    """A shared client built by `factory` the first time it is needed"""
+
+    def __init__(self, name: str, factory: Callable[[], Any], enabled: bool = True,
+                 retry_interval: float = RETRY_INTERVAL):
+        self.name = name
+        self.factory = factory
+        self.enabled = enabled  # False when the provider is not configured at all
+        self.retry_interval = retry_interval
+        self._client = None
+        self._error: Optional[str] = None
+        self._failed_at: Optional[float] = None
+        self._init_ms: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._client is not None
+
+    def _retry_due(self) -> bool:
+        return self._failed_at is None or time.monotonic() - self._failed_at >= self.retry_interval
+
+    def available(self) -> bool:
+        """Configured, and either built or due for another attempt"""
+        return self.enabled and (self.ready or self._retry_due())
+
+    def get(self):
+        """Return the client, building it on first use.
+
+        Raises HTTPException(503) if the provider is not configured or the
+        last attempt failed less than retry_interval seconds ago.
+        """
+        if self._client is not None:
+            return self._client
+        if not self.enabled:
+            raise HTTPException(status_code=503, detail=f"{self.name} is not configured")
+        with self._lock:
+            if self._client is not None:
+                return self._client
+            if not self._retry_due():
+                raise HTTPException(status_code=503, detail=f"{self.name} unavailable: {self._error}")
+            start = time.perf_counter()
+            try:
+                client = self.factory()
+            except Exception as e:
+                self._error = str(e)
+                self._failed_at = time.monotonic()
+                logger.warning("%s initialization failed: %s", self.name, e)
+                raise HTTPException(status_code=503, detail=f"{self.name} unavailable: {e}")
+            self._init_ms = round((time.perf_counter() - start) * 1000, 1)
+            self._client = client
+            self._error = None
+            self._failed_at = None
+            logger.info("%s initialized in %.1f ms", self.name, self._init_ms)
+            return client
+
+    def try_init(self) -> bool:
+        """Build the client if possible; used by the startup warm-up and /ready"""
+        if not self.enabled:
+            return False
+        try:
+            self.get()
+            return True
+        except HTTPException:
+            return False
+
+    def reset_after_fork(self):
+        """Drop the parent's client; its sockets and threads don't survive a fork"""
+        self._client = None
+        self._error = None
+        self._failed_at = None
+        self._init_ms = None
+        self._lock = threading.Lock()
+
+    def state(self) -> dict:
+        if not self.enabled:
+            status = "disabled"
+        elif self.ready:
+            status = "ready"
+        elif self._error is not None:
+            status = "failed"
+        else:
+            status = "pending"
+        return {"state": status, "error": self._error, "init_ms": self._init_ms}
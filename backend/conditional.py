@@ -0,0 +1,43 @@
+"""
+Conditional GET support: weak ETags and 304 Not Modified.
+
+Listing endpoints first compute a version of their result (row count plus
+the newest updated_at or id) with one small indexed query. If the client's
+If-None-Match already names that version they answer 304 without fetching
+a single row; otherwise the ETag goes out with the full response.
+"""
+from fastapi import Response
+from typing import Optional
+
+from singleflight import digest
+
+# Clients may keep the body but must revalidate it before every use
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts) -> str:
+    return f'W/"{digest(*parts)[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of `etag` against an If-None-Match header"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
@@ -0,0 +1,188 @@
+"""
+DICOM decoding for DentalGPT.
+
+Uploaded .dcm/.dicom X-rays are decoded once: the pixel data goes through
+the modality LUT and a window/level (the file's own VOI window, or a
+percentile window when it has none) and becomes two cached derivatives
+in document_derivatives:
+
+- "preview": an 8-bit PNG, at most DICOM_PREVIEW_MAX_SIZE px, for viewing
+- "vision": a JPEG, at most MAX_VISION_IMAGE_SIZE px, sent to vision models
+
+Technical tags (modality, geometry, exposure, window) go to dicom_tags;
+patient identifiers are not copied out of the file. Needs the optional
+`pydicom` and `numpy` packages; compressed transfer syntaxes also need a
+pixel data handler such as `pylibjpeg`.
+"""
+from datetime import date
+from fastapi import HTTPException
+from typing import Optional
+import io
+import json
+import os
+
+from rag_utils import MAX_VISION_IMAGE_SIZE
+
+DICOM_EXTENSIONS = (".dcm", ".dicom")
+DICOM_PREVIEW_MAX_SIZE = int(os.getenv("DICOM_PREVIEW_MAX_SIZE", "2048"))
+VISION_JPEG_QUALITY = 90
+
+DERIVATIVE_TYPES = {"preview": "image/png", "vision": "image/jpeg"}
+
+# Copied to dicom_tags.tags; nothing here identifies the patient
+TECHNICAL_TAGS = (
+    "Modality", "BodyPartExamined", "StudyDate", "SeriesDescription", "ViewPosition",
+    "Manufacturer", "ManufacturerModelName", "Rows", "Columns", "NumberOfFrames",
+    "BitsStored", "PhotometricInterpretation", "PixelSpacing", "ImagerPixelSpacing",
+    "KVP", "ExposureTime", "XRayTubeCurrent", "RescaleSlope", "RescaleIntercept",
+    "WindowCenter", "WindowWidth",
+)
+
+
+class DicomImage:
+    """A decoded DICOM file: its derivatives and extracted tags"""
+
+    def __init__(self, preview_png: bytes, vision_jpeg: bytes, width: int, height: int,
+                 window_center: float, window_width: float, tags: dict):
+        self.preview_png = preview_png
+        self.vision_jpeg = vision_jpeg
+        self.width = width
+        self.height = height
+        self.window_center = window_center
+        self.window_width = window_width
+        self.tags = tags
+
+
+def looks_like_dicom(data: bytes) -> bool:
+    """DICOM Part 10 files carry "DICM" after a 128-byte preamble"""
+    return data[128:132] == b"DICM"
+
+
+def _tag_value(value):
+    """Convert a pydicom element value to something JSON can hold"""
+    if isinstance(value, (list, tuple)) or type(value).__name__ == "MultiValue":
+        return [_tag_value(v) for v in value]
+    # pydicom's DSfloat/IS subclass float/int; store plain numbers
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, float):
+        return float(value)
+    return str(value)
+
+
+def _first_number(value) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (list, tuple)) or type(value).__name__ == "MultiValue":
+        value = value[0] if len(value) else None
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _study_date(value) -> Optional[date]:
+    value = str(value or "")
+    if len(value) != 8 or not value.isdigit():
+        return None
+    try:
+        return date(int(value[:4]), int(value[4:6]), int(value[6:]))
+    except ValueError:
+        return None
+
+
+def decode_dicom(data: bytes, window_center: Optional[float] = None,
+                 window_width: Optional[float] = None) -> DicomImage:
+    """Decode DICOM bytes into windowed PNG/JPEG derivatives and technical tags.
+
+    window_center/window_width override the file's own window. Raises
+    HTTPException(415) when pydicom/numpy are missing and
+    HTTPException(400) when the file can't be decoded.
+    """
+    try:
+        import numpy as np
+        import pydicom
+    except ImportError:
+        raise HTTPException(
+            status_code=415,
+            detail="DICOM support is not installed. Install with: pip install pydicom numpy"
+        )
+    try:
+        from pydicom.pixels import apply_modality_lut  # pydicom >= 3
+    except ImportError:
+        from pydicom.pixel_data_handlers.util import apply_modality_lut
+    from PIL import Image
+
+    try:
+        ds = pydicom.dcmread(io.BytesIO(data), force=True)
+        pixels = ds.pixel_array
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Could not decode DICOM pixel data: {e}")
+
+    frames = int(_first_number(ds.get("NumberOfFrames")) or 1)
+    if frames > 1:
+        pixels = pixels[frames // 2]  # a multi-frame file is summarized by its middle frame
+    photometric = str(ds.get("PhotometricInterpretation", "MONOCHROME2"))
+
+    if photometric in ("MONOCHROME1", "MONOCHROME2"):
+        values = apply_modality_lut(pixels, ds).astype(np.float32)
+        if window_center is None or window_width is None:
+            file_center = _first_number(ds.get("WindowCenter"))
+            file_width = _first_number(ds.get("WindowWidth"))
+            if file_center is not None and file_width:
+                window_center, window_width = file_center, file_width
+            else:
+                low, high = (float(v) for v in np.percentile(values, (0.5, 99.5)))
+                window_center, window_width = (low + high) / 2, max(high - low, 1.0)
+        low = window_center - window_width / 2
+        scaled = np.clip((values - low) / window_width, 0.0, 1.0) * 255.0
+        if photometric == "MONOCHROME1":  # bright means low attenuation; flip to the usual look
+            scaled = 255.0 - scaled
+        image = Image.fromarray(scaled.astype(np.uint8), mode="L")
+    else:
+        # Colour data (RGB, or YBR already converted by the pixel handler)
+        if pixels.dtype != np.uint8:
+            peak = float(pixels.max()) or 1.0
+            pixels = (pixels.astype(np.float32) * (255.0 / peak)).astype(np.uint8)
+        image = Image.fromarray(pixels).convert("RGB")
+        window_center = window_width = None
+
+    width, height = image.size
+    preview = image.copy()
+    preview.thumbnail((DICOM_PREVIEW_MAX_SIZE, DICOM_PREVIEW_MAX_SIZE), Image.Resampling.LANCZOS)
+    png = io.BytesIO()
+    preview.save(png, format="PNG", optimize=True)
+
+    vision = image.copy()
+    vision.thumbnail((MAX_VISION_IMAGE_SIZE, MAX_VISION_IMAGE_SIZE), Image.Resampling.LANCZOS)
+    jpeg = io.BytesIO()
+    vision.convert("RGB").save(jpeg, format="JPEG", quality=VISION_JPEG_QUALITY, optimize=True)
+
+    tags = {name: _tag_value(ds.get(name)) for name in TECHNICAL_TAGS if ds.get(name) not in (None, "")}
+    transfer_syntax = getattr(getattr(ds, "file_meta", None), "TransferSyntaxUID", None)
+    if transfer_syntax is not None:
+        tags["TransferSyntaxUID"] = str(transfer_syntax)
+    return DicomImage(png.getvalue(), jpeg.getvalue(), width, height,
+                      window_center, window_width, tags)
+
+
+def save_dicom(cur, document_id: int, image: DicomImage):
+    """Store a decoded file's derivatives and tags (idempotent)"""
+    for kind, payload in (("preview", image.preview_png), ("vision", image.vision_jpeg)):
+        cur.execute(
+            """INSERT INTO document_derivatives (document_id, kind, content_type, file_size, file_data)
+               VALUES (%s, %s, %s, %s, %s)
+               ON CONFLICT (document_id, kind) DO NOTHING""",
+            (document_id, kind, DERIVATIVE_TYPES[kind], len(payload), payload)
+        )
+    cur.execute(
+        """INSERT INTO dicom_tags (document_id, modality, body_part, study_date, width, height,
+                                   window_center, window_width, tags)
+           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+           ON CONFLICT (document_id) DO NOTHING""",
+        (document_id, image.tags.get("Modality"), image.tags.get("BodyPartExamined"),
+         _study_date(image.tags.get("StudyDate")), image.width, image.height,
+         image.window_center, image.window_width, json.dumps(image.tags))
+    )
@@ -1,28 +1,77 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 from typing import List, Optional
 import os
 from dotenv import load_dotenv
-import ollama
 import requests
-from pinecone import Pinecone, ServerlessSpec
-import google.generativeai as genai
 import psycopg2
 from psycopg2.extras import RealDictCursor
 import json
+import logging
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import tempfile
 import io
 import base64
-from auth import verify_google_token, get_or_create_user, create_jwt_token, get_current_user
 
-app = FastAPI(title="DentalGPT API", version="1.0.0")
-
-# Load environment variables from project root `.env`
-# (so you don't have to export them manually before running the backend)
+# Load environment variables from project root `.env` (so you don't have to
+# export them manually before running the backend). This comes before the
+# local imports below, several of which read their settings at import time.
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
 
+from auth import verify_google_token, get_or_create_user, create_jwt_token, get_current_user, update_user
+from provider_router import ProviderRouter, ProviderLimiter
+from clients import LazyClient
+from warmup import ModelWarmer
+from query_log import QueryLogWriter
+from ollama_pool import OllamaPool
+from singleflight import SingleFlight, normalize_text, digest
+from metrics import MetricsMiddleware, registry as metrics_registry, stage_timer
+from logging_config import setup_logging, RequestIdMiddleware, reset_after_fork as reset_logging_after_fork
+from cache import (
+    cache_get, cache_set, cache_ttl, cache_url, get_or_compute, is_shared_url, make_key,
+    reset_after_fork as reset_cache_after_fork
+)
+from rag_utils import (
+    CLOSING_RESPONSE, build_chat_history, build_chat_prompt, build_context, build_patient_context,
+    build_query_prompt, chunk_text, is_conversation_ending, resize_image_for_vision, wants_previous_image
+)
+from pagination import clamp_limit, decode_cursor, encode_cursor, escape_like
+from responses import CompressionMiddleware, FastJSONResponse, dumps_json, json_response
+from conditional import etag_headers, etag_matches, make_etag, not_modified
+from documents import (
+    content_disposition, content_type_for, image_extension, iter_db_bytes, iter_file_bytes, parse_range
+)
+from dicom import DERIVATIVE_TYPES, DICOM_EXTENSIONS, decode_dicom, looks_like_dicom, save_dicom
+from audio import MAX_AUDIO_BYTES, decode_audio_bytes, read_audio_body, read_audio_form, read_audio_json
+from transcription import TranscriptionJobs, is_long, transcribe_long, reset_after_fork as reset_transcription_after_fork
+from whisper_models import WhisperModelRegistry
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build provider clients in the background: the server accepts requests
+    # (and answers /health) immediately, and an outage only shows up in /ready
+    warmup = asyncio.create_task(run_in_threadpool(initialize_clients))
+    model_warmer.start()
+    await run_in_threadpool(query_logger.start)  # preallocates the first block of query ids
+    yield
+    model_warmer.stop()
+    warmup.cancel()
+    await run_in_threadpool(query_logger.stop)
+
+app = FastAPI(title="DentalGPT API", version="1.0.0", lifespan=lifespan, default_response_class=FastJSONResponse)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+
+setup_logging()
+logger = logging.getLogger("dentalgpt.api")
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -40,50 +89,136 @@ OLLAMA_VISION_MODEL = os.getenv("OLLAMA_VISION_MODEL", "llava")  # Vision model
 
 # Initialize Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if GEMINI_API_KEY:
+GEMINI_LLM_MODEL = "gemini-2.5-flash"  # Latest fast model (2025) - NO models/ prefix
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"  # Embeddings NEED models/ prefix
+if not GEMINI_API_KEY:
+    logger.warning("GEMINI_API_KEY not found in environment variables")
+
+
+def _configure_gemini():
+    import google.generativeai as genai
     genai.configure(api_key=GEMINI_API_KEY)
-    GEMINI_LLM_MODEL = "gemini-2.5-flash"  # Latest fast model (2025) - NO models/ prefix
-    GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"  # Embeddings NEED models/ prefix
-else:
-    print("Warning: GEMINI_API_KEY not found in environment variables")
+    return genai
+
+
+gemini_sdk = LazyClient("gemini", _configure_gemini, enabled=bool(GEMINI_API_KEY))
 
 # Initialize GLM (Zhipu AI)
 GLM_API_KEY = os.getenv("GLM_API_KEY")
 GLM_LLM_MODEL = os.getenv("GLM_LLM_MODEL", "glm-4")  # GLM-4 or GLM-4-Plus
 GLM_EMBEDDING_MODEL = os.getenv("GLM_EMBEDDING_MODEL", "embedding-2")  # Try: embedding-2, text_embedding, or text-embedding
-glm_client = None
-if GLM_API_KEY:
+if not GLM_API_KEY:
+    logger.warning("GLM_API_KEY not found in environment variables")
+
+
+def _create_glm_client():
     try:
         from zhipuai import ZhipuAI
-        glm_client = ZhipuAI(api_key=GLM_API_KEY)
-        print("GLM API key configured")
     except ImportError:
-        print("Warning: zhipuai package not installed. Install with: pip install zhipuai")
-else:
-    print("Warning: GLM_API_KEY not found in environment variables")
-
-# Configure Ollama client
-try:
-    import ollama
-    # Set the base URL for Ollama client if needed
-    if hasattr(ollama, 'Client'):
-        ollama_client = ollama.Client(host=OLLAMA_BASE_URL)
-    else:
-        # For older versions, set environment variable
-        os.environ['OLLAMA_HOST'] = OLLAMA_BASE_URL
-except Exception as e:
-    print(f"Warning: Could not configure Ollama client: {e}")
+        raise RuntimeError("zhipuai package not installed. Install with: pip install zhipuai")
+    return ZhipuAI(api_key=GLM_API_KEY)
+
+
+glm_sdk = LazyClient("glm", _create_glm_client, enabled=bool(GLM_API_KEY))
+
+# Configure Ollama hosts (OLLAMA_BASE_URLS="http://box1:11434,http://box2:11434"
+# spreads load across several servers; OLLAMA_BASE_URL alone still works)
+ollama_pool = OllamaPool.from_env()
 
 
 # ============================================================================
 # AI MODEL HELPER FUNCTIONS
 # ============================================================================
 
+provider_router = ProviderRouter()
+provider_router.register("ollama", ollama_pool.has_healthy_host)
+provider_router.register("gemini", gemini_sdk.available)
+provider_router.register("glm", glm_sdk.available)
+
+# Every provider a request may name; metric labels are limited to these
+PROVIDERS = ("ollama", "gemini", "glm")
+
+# GLM vision support is best-effort, so vision fallback only considers these
+VISION_PROVIDERS = ["ollama", "gemini"]
+
+# Caps concurrent generations per provider for bulk endpoints (PROVIDER_CONCURRENCY)
+provider_limiter = ProviderLimiter()
+
+GEMINI_EMBED_BATCH = 100  # embed_content accepts at most 100 texts per request
+EMBED_FANOUT = int(os.getenv("EMBED_FANOUT", "8"))  # parallel single-text embeddings for providers without a batch API
+
+
+def provider_label(model_provider: Optional[str]) -> str:
+    """Metric label for a request's model_provider: one of PROVIDERS, otherwise 'unknown'"""
+    return model_provider if model_provider in PROVIDERS else "unknown"
+
+
+def provider_model(model_provider: str, operation: str) -> str:
+    """Model name a provider uses for an operation ("embed", "generate" or "vision")"""
+    if model_provider == "gemini":
+        return GEMINI_EMBEDDING_MODEL if operation == "embed" else GEMINI_LLM_MODEL
+    if operation == "embed":
+        # GLM embeddings go through Ollama as well
+        return OLLAMA_EMBEDDING_MODEL
+    if model_provider == "glm":
+        return GLM_LLM_MODEL
+    return OLLAMA_VISION_MODEL if operation == "vision" else OLLAMA_LLM_MODEL
+
+
 def get_embedding(text: str, model_provider: str = "ollama") -> List[float]:
-    """Generate embedding using the specified model provider."""
+    """Generate embedding using the specified model provider.
+
+    Embeddings never fall back to another provider: vectors from a different
+    model would not match the Pinecone index. The circuit breaker still makes
+    a dead provider fail fast instead of waiting out its timeout.
+    """
+    return provider_router.call(
+        model_provider, "embed",
+        lambda provider: _embed_with_provider(text, provider)
+    )
+
+
+def get_embeddings(texts: List[str], model_provider: str = "ollama") -> List[List[float]]:
+    """Embed many texts at once, in the same order.
+
+    Gemini takes them in batched requests. Ollama (and GLM, which embeds
+    through Ollama) has no batch call in our client, so the texts are spread
+    over the host pool in parallel instead.
+    """
+    return provider_router.call(
+        model_provider, "embed",
+        lambda provider: _embed_batch_with_provider(texts, provider)
+    )
+
+
+def _embed_batch_with_provider(texts: List[str], model_provider: str) -> List[List[float]]:
+    if not texts:
+        return []
+    if model_provider == "gemini":
+        if not GEMINI_API_KEY:
+            raise HTTPException(status_code=500, detail="Gemini API key not configured")
+        genai = gemini_sdk.get()
+        embeddings = []
+        try:
+            for start in range(0, len(texts), GEMINI_EMBED_BATCH):
+                result = genai.embed_content(
+                    model=GEMINI_EMBEDDING_MODEL,
+                    content=texts[start:start + GEMINI_EMBED_BATCH],
+                    task_type="retrieval_document"
+                )
+                embeddings.extend(result['embedding'])
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Gemini embedding error: {str(e)}")
+        return embeddings
+    with ThreadPoolExecutor(max_workers=min(len(texts), EMBED_FANOUT)) as executor:
+        return list(executor.map(lambda text: _embed_with_provider(text, model_provider), texts))
+
+
+def _embed_with_provider(text: str, model_provider: str) -> List[float]:
     if model_provider == "gemini":
         if not GEMINI_API_KEY:
             raise HTTPException(status_code=500, detail="Gemini API key not configured")
+        genai = gemini_sdk.get()
         try:
             result = genai.embed_content(
                 model=GEMINI_EMBEDDING_MODEL,
@@ -99,15 +234,16 @@ def get_embedding(text: str, model_provider: str = "ollama") -> List[float]:
         # If you have a valid GLM embedding model, uncomment the code below
         try:
             # Try using Ollama embeddings as fallback for GLM
-            embedding_response = ollama.embeddings(
+            embedding_response = ollama_pool.embeddings(
                 model=OLLAMA_EMBEDDING_MODEL,
                 prompt=text
             )
             return embedding_response['embedding']
         except Exception as e:
             # If Ollama also fails, try GLM embeddings API (if available)
-            if GLM_API_KEY and glm_client:
+            if glm_sdk.available():
                 try:
+                    glm_client = glm_sdk.get()
                     # Try common embedding model names
                     for model_name in ["embedding-2", "text_embedding", "text-embedding"]:
                         try:
@@ -124,7 +260,7 @@ def get_embedding(text: str, model_provider: str = "ollama") -> List[float]:
             raise HTTPException(status_code=500, detail=f"Embedding error: {str(e)}. Using Ollama embeddings as fallback for GLM.")
     else:  # ollama
         try:
-            embedding_response = ollama.embeddings(
+            embedding_response = ollama_pool.embeddings(
                 model=OLLAMA_EMBEDDING_MODEL,
                 prompt=text
             )
@@ -133,16 +269,39 @@ def get_embedding(text: str, model_provider: str = "ollama") -> List[float]:
             raise HTTPException(status_code=500, detail=f"Ollama embedding error: {str(e)}")
 
 
-def generate_llm_response(prompt: str, model_provider: str = "ollama", image_data: Optional[str] = None) -> str:
-    """Generate LLM response using the specified model provider. Supports vision if image_data is provided."""
+def generate_llm_response(prompt: str, model_provider: str = "ollama", image_bytes: Optional[bytes] = None,
+                          allow_fallback: bool = False) -> tuple:
+    """Generate LLM response using the specified model provider. Supports vision if image_bytes is provided.
+
+    Returns (answer, provider that answered). The requested provider is
+    tried first; only with allow_fallback, and only if it fails or its
+    circuit is open, does the prompt go to another provider.
+    """
+    if image_bytes:
+        # Raw DICOM (e.g. from older clients) can't be read by PIL or the vision models
+        if looks_like_dicom(image_bytes):
+            image_bytes = decode_dicom(image_bytes).vision_jpeg
+        return provider_router.call_with_provider(
+            model_provider, "vision",
+            lambda provider: _generate_with_provider(prompt, provider, image_bytes),
+            allow_fallback=allow_fallback,
+            eligible=VISION_PROVIDERS
+        )
+    return provider_router.call_with_provider(
+        model_provider, "generate",
+        lambda provider: _generate_with_provider(prompt, provider),
+        allow_fallback=allow_fallback
+    )
+
+
+def _generate_with_provider(prompt: str, model_provider: str, image_bytes: Optional[bytes] = None) -> str:
     if model_provider == "gemini":
         if not GEMINI_API_KEY:
             raise HTTPException(status_code=500, detail="Gemini API key not configured")
+        genai = gemini_sdk.get()
         try:
             model = genai.GenerativeModel(GEMINI_LLM_MODEL)
-            if image_data:
-                # Decode base64 image
-                image_bytes = base64.b64decode(image_data)
+            if image_bytes:
                 from PIL import Image
                 import io  # Explicit import to avoid scoping issues
                 image = Image.open(io.BytesIO(image_bytes))
@@ -153,10 +312,13 @@ def generate_llm_response(prompt: str, model_provider: str = "ollama", image_dat
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Gemini generation error: {str(e)}")
     elif model_provider == "glm":
-        if not GLM_API_KEY or not glm_client:
+        if not GLM_API_KEY:
             raise HTTPException(status_code=500, detail="GLM API key not configured")
+        glm_client = glm_sdk.get()
         try:
-            if image_data:
+            if image_bytes:
+                # The GLM API only takes images as base64 data URLs
+                image_data = base64.b64encode(image_bytes).decode("utf-8")
                 # GLM-4 supports vision via messages format
                 # Note: GLM vision API may require a different format
                 # Try OpenAI-compatible format first
@@ -175,11 +337,11 @@ def generate_llm_response(prompt: str, model_provider: str = "ollama", image_dat
                     )
                 except Exception as vision_error:
                     # Fallback to simpler format if OpenAI format doesn't work
-                    print(f"[DEBUG] GLM vision format error, trying fallback: {str(vision_error)}")
+                    logger.debug("GLM vision format error, trying fallback: %s", vision_error)
                     response = glm_client.chat.completions.create(
                         model=GLM_LLM_MODEL,
                         messages=[
-                            {"role": "user", "content": f"{prompt}\n\n[Image attached: {len(image_data)} bytes]"}
+                            {"role": "user", "content": f"{prompt}\n\n[Image attached: {len(image_bytes)} bytes]"}
                         ]
                     )
             else:
@@ -195,58 +357,32 @@ def generate_llm_response(prompt: str, model_provider: str = "ollama", image_dat
                 raise HTTPException(status_code=500, detail="GLM generation error: Invalid response format")
         except ImportError:
             raise HTTPException(status_code=500, detail="zhipuai package not installed. Install with: pip install zhipuai")
+        except HTTPException:
+            raise
         except Exception as e:
-            error_str = str(e)
-            # Check if it's a quota/balance error (429 or 1113)
-            if "429" in error_str or "1113" in error_str or "余额不足" in error_str or "insufficient" in error_str.lower():
-                # Fall back to Ollama when GLM quota is exhausted
-                print(f"[WARNING] GLM quota exhausted, falling back to Ollama: {error_str}")
-                try:
-                    response = ollama.generate(
-                        model=OLLAMA_LLM_MODEL,
-                        prompt=prompt
-                    )
-                    return response['response']
-                except Exception as ollama_error:
-                    raise HTTPException(
-                        status_code=500, 
-                        detail=f"GLM quota exhausted and Ollama fallback failed. Please recharge your GLM account or switch to Ollama model. Ollama error: {str(ollama_error)}"
-                    )
+            # Quota errors (429/1113) trip the GLM circuit breaker immediately;
+            # callers that allow fallback are routed to another provider.
             raise HTTPException(status_code=500, detail=f"GLM generation error: {str(e)}")
     else:  # ollama
         try:
-            if image_data:
+            if image_bytes:
                 # Use vision model for image analysis
-                image_bytes = base64.b64decode(image_data)
-                
-                # Optimize image size to prevent memory issues
+                # Optimize image size to prevent memory issues (max 1024px on longest side)
                 try:
-                    from PIL import Image
-                    import io
-                    # Open and resize image if too large (max 1024px on longest side)
-                    img = Image.open(io.BytesIO(image_bytes))
-                    max_size = 1024
-                    if max(img.size) > max_size:
-                        img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
-                        # Convert back to bytes
-                        output = io.BytesIO()
-                        img_format = img.format or 'JPEG'
-                        img.save(output, format=img_format, quality=85, optimize=True)
-                        image_bytes = output.getvalue()
-                        print(f"[DEBUG] Image resized to {img.size} to reduce memory usage")
+                    image_bytes = resize_image_for_vision(image_bytes)
                 except ImportError:
-                    print("[WARNING] PIL/Pillow not installed, using original image size")
+                    logger.warning("PIL/Pillow not installed, using original image size")
                 except Exception as img_error:
-                    print(f"[WARNING] Image optimization failed, using original: {str(img_error)}")
+                    logger.warning("Image optimization failed, using original: %s", img_error)
                 
                 try:
-                    print(f"[DEBUG] Calling Ollama vision model with image size: {len(image_bytes)} bytes")
-                    response = ollama.generate(
+                    logger.debug("Calling Ollama vision model with image size: %d bytes", len(image_bytes))
+                    response = ollama_pool.generate(
                         model=OLLAMA_VISION_MODEL,
                         prompt=prompt,
                         images=[image_bytes]
                     )
-                    print(f"[DEBUG] Ollama vision response received")
+                    logger.debug("Ollama vision response received")
                 except Exception as vision_error:
                     error_msg = str(vision_error)
                     if "not found" in error_msg.lower() or "404" in error_msg:
@@ -261,7 +397,7 @@ def generate_llm_response(prompt: str, model_provider: str = "ollama", image_dat
                         )
                     raise
             else:
-                response = ollama.generate(
+                response = ollama_pool.generate(
                     model=OLLAMA_LLM_MODEL,
                     prompt=prompt
                 )
@@ -271,7 +407,7 @@ def generate_llm_response(prompt: str, model_provider: str = "ollama", image_dat
         except Exception as e:
             error_msg = str(e)
             if "not found" in error_msg.lower() or "404" in error_msg:
-                model_name = OLLAMA_VISION_MODEL if image_data else OLLAMA_LLM_MODEL
+                model_name = OLLAMA_VISION_MODEL if image_bytes else OLLAMA_LLM_MODEL
                 raise HTTPException(
                     status_code=404,
                     detail=f"Model '{model_name}' not found. Please install it by running: 'ollama pull {model_name}'"
@@ -284,44 +420,195 @@ def generate_llm_response(prompt: str, model_provider: str = "ollama", image_dat
             raise HTTPException(status_code=500, detail=f"Ollama generation error: {str(e)}")
 
 
+# Whisper models of each size/compute type are loaded on first use and
+# shared by all transcriptions, within WHISPER_MEMORY_BUDGET_MB (see whisper_models.py)
+whisper_models = WhisperModelRegistry()
+
+
+def transcribe_pcm(audio, model_key: Optional[tuple] = None) -> tuple:
+    """Transcribe decoded 16 kHz float32 samples with a shared Whisper model"""
+    model = whisper_models.get(*(model_key or whisper_models.default))
+    segments, info = model.transcribe(audio, beam_size=5)
+    text = " ".join([segment.text for segment in segments])
+    return text.strip(), info.language
+
+
 def transcribe_audio_gemini(audio_data: bytes) -> tuple:
     """Transcribe audio using Gemini (if configured as primary)."""
     if not GEMINI_API_KEY:
         raise HTTPException(status_code=500, detail="Gemini API key not configured")
     # Note: Gemini doesn't have native audio transcription,
     # so we fall back to Whisper even when using Gemini for LLM
-    from faster_whisper import WhisperModel
-    import tempfile
+    return transcribe_pcm(decode_audio_bytes(audio_data))
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-        tmp_file.write(audio_data)
-        tmp_file_path = tmp_file.name
 
-    try:
-        model = WhisperModel("base", device="cpu", compute_type="int8")
-        segments, info = model.transcribe(tmp_file_path, beam_size=5)
-        text = " ".join([segment.text for segment in segments])
-        return text.strip(), info.language
-    finally:
-        if os.path.exists(tmp_file_path):
-            os.unlink(tmp_file_path)
+def transcribe_recording(audio, on_progress=None, model_key: Optional[tuple] = None) -> dict:
+    """Whisper transcription of decoded samples: one pass for short dictation,
+    parallel silence-split chunks for long recordings (see transcription.py)"""
+    model_key = model_key or whisper_models.default
+    if on_progress is None and not is_long(audio):
+        text, language = transcribe_pcm(audio, model_key)
+        return {"text": text, "language": language, "model": model_key[0]}
+    result = transcribe_long(whisper_models.get(*model_key), audio, on_progress=on_progress)
+    result["model"] = model_key[0]
+    return result
+
+
+transcription_jobs = TranscriptionJobs()
 
 # Initialize Pinecone
-pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
 index_name = os.getenv("PINECONE_INDEX_NAME", "dental-gpt")
+# Optional data-plane host (e.g. https://dental-gpt-xxxx.svc.pinecone.io); skips
+# the describe_index lookup and lets benchmarks point at a local stand-in
+PINECONE_INDEX_HOST = os.getenv("PINECONE_INDEX_HOST")
+
+
+def _create_pinecone_index():
+    from pinecone import Pinecone, ServerlessSpec
+    pc = Pinecone(api_key=os.getenv("PINECONE_API_KEY"))
+    if PINECONE_INDEX_HOST:
+        return pc.Index(index_name, host=PINECONE_INDEX_HOST)
+    # Get or create index
+    try:
+        return pc.Index(index_name)
+    except Exception:
+        # Create index if it doesn't exist (768 dimensions for nomic-embed-text)
+        pc.create_index(
+            name=index_name,
+            dimension=768,
+            metric="cosine",
+            spec=ServerlessSpec(cloud="aws", region="us-east-1")
+        )
+        return pc.Index(index_name)
+
+
+pinecone_index = LazyClient("pinecone", _create_pinecone_index)
+
+# Built by the lifespan hook's background warm-up, or by the first request that needs them
+LAZY_CLIENTS = [pinecone_index, gemini_sdk, glm_sdk]
+
+
+def initialize_clients():
+    for client in LAZY_CLIENTS:
+        client.try_init()
+    ollama_pool.check_all()
+
+
+def _warm_whisper():
+    import numpy as np
+    # Only the default model; other sizes load when first requested
+    model = whisper_models.get(*whisper_models.default)
+    # One second of silence runs the decoder once, not just the weight load
+    segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), beam_size=1)
+    list(segments)
+    return {"model": whisper_models.default[0], "compute_type": whisper_models.default[1]}
+
+
+# Preload models at startup and keep them resident (see warmup.py)
+model_warmer = ModelWarmer()
+model_warmer.register("llm", lambda: ollama_pool.warm(OLLAMA_LLM_MODEL))
+model_warmer.register("embedding", lambda: ollama_pool.warm(OLLAMA_EMBEDDING_MODEL, embedding=True))
+model_warmer.register("vision", lambda: ollama_pool.warm(OLLAMA_VISION_MODEL))
+model_warmer.register("whisper", _warm_whisper, repeat=False)
+
 
-# Get or create index
-try:
-    index = pc.Index(index_name)
-except Exception:
-    # Create index if it doesn't exist (768 dimensions for nomic-embed-text)
-    pc.create_index(
-        name=index_name,
-        dimension=768,
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region="us-east-1")
+def query_index(**kwargs):
+    return pinecone_index.get().query(**kwargs)
+
+# Identical in-flight embeddings, retrievals and generations share one call
+request_coalescer = SingleFlight()
+
+
+def _coalescing_metrics() -> List[str]:
+    lines = [
+        "# HELP dentalgpt_singleflight_calls_total Pipeline calls executed or coalesced onto an in-flight duplicate",
+        "# TYPE dentalgpt_singleflight_calls_total counter",
+    ]
+    for operation, counts in request_coalescer.stats()["operations"].items():
+        for outcome, value in counts.items():
+            lines.append(f'dentalgpt_singleflight_calls_total{{operation="{operation}",outcome="{outcome}"}} {value}')
+    return lines
+
+
+metrics_registry.add_collector(_coalescing_metrics)
+
+def cached_embedding(text: str, model_provider: str) -> List[float]:
+    """get_embedding through the shared cache (see cache.py)"""
+    return get_or_compute(
+        "embedding", (model_provider, provider_model(model_provider, "embed"), normalize_text(text)),
+        cache_ttl("embedding"), lambda: get_embedding(text, model_provider)
+    )
+
+def cached_answer(prompt: str, model_provider: str, image_bytes: Optional[bytes] = None,
+                  allow_fallback: bool = False) -> tuple:
+    """generate_llm_response through the shared cache, keyed on the exact prompt and image"""
+    operation = "vision" if image_bytes else "generate"
+    answer, answered_by = get_or_compute(
+        "answer", (model_provider, provider_model(model_provider, operation), normalize_text(prompt), image_bytes, allow_fallback),
+        cache_ttl("answer"), lambda: generate_llm_response(prompt, model_provider, image_bytes, allow_fallback=allow_fallback)
+    )
+    return answer, answered_by  # cached as a JSON list
+
+def cached_embeddings(texts: List[str], model_provider: str) -> List[List[float]]:
+    """get_embeddings through the shared cache: only uncached, distinct texts are embedded"""
+    model = provider_model(model_provider, "embed")
+    keys = [make_key("embedding", model_provider, model, normalize_text(text)) for text in texts]
+    ttl = cache_ttl("embedding")
+    results = [cache_get("embedding", key) if ttl > 0 else None for key in keys]
+    missing = {}
+    for i, embedding in enumerate(results):
+        if embedding is None:
+            missing.setdefault(keys[i], []).append(i)
+    if missing:
+        fresh = get_embeddings([texts[indices[0]] for indices in missing.values()], model_provider)
+        for (key, indices), embedding in zip(missing.items(), fresh):
+            cache_set("embedding", key, embedding, ttl)
+            for i in indices:
+                results[i] = embedding
+    return results
+
+async def embed_query(text: str, model_provider: str) -> List[float]:
+    """Coalesced, cached get_embedding, run off the event loop"""
+    key = ("embed", model_provider, normalize_text(text))
+    return await request_coalescer.do(key, cached_embedding, text, model_provider)
+
+async def retrieve_context(text: str, query_embedding: List[float], model_provider: str, top_k: int = 5):
+    """Coalesced Pinecone search. The vector is derived from (provider, text), so they form the key."""
+    key = ("retrieve", model_provider, normalize_text(text), top_k)
+    return await request_coalescer.do(
+        key, query_index, vector=query_embedding, top_k=top_k, include_metadata=True
+    )
+
+async def generate_answer(prompt: str, model_provider: str, image_bytes: Optional[bytes] = None,
+                          allow_fallback: bool = False) -> tuple:
+    """Coalesced, cached generate_llm_response, run off the event loop. Returns (answer, provider)."""
+    key = ("generate", model_provider, digest(normalize_text(prompt), image_bytes), allow_fallback)
+    return await request_coalescer.do(
+        key, cached_answer, prompt, model_provider, image_bytes, allow_fallback=allow_fallback
     )
-    index = pc.Index(index_name)
+
+
+def _reset_after_fork():
+    """Runs in each forked worker (e.g. gunicorn --preload): drop the clients, locks
+    and threads inherited from the parent. Each worker's lifespan hook rebuilds them."""
+    reset_logging_after_fork()
+    metrics_registry.reset_after_fork()
+    reset_cache_after_fork()
+    for client in LAZY_CLIENTS:
+        client.reset_after_fork()
+    whisper_models.reset_after_fork()
+    ollama_pool.reset_after_fork()
+    provider_router.reset_after_fork()
+    provider_limiter.reset_after_fork()
+    request_coalescer.reset_after_fork()
+    model_warmer.reset_after_fork()
+    query_logger.reset_after_fork()
+    transcription_jobs.reset_after_fork()
+    reset_transcription_after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
 
 # Database connection
 def get_db_connection():
@@ -330,19 +617,33 @@ def get_db_connection():
         port=os.getenv("RDS_PORT", "5432"),
         database=os.getenv("RDS_DATABASE", "dentalgpt"),
         user=os.getenv("RDS_USER", "postgres"),  # Default PostgreSQL user
-        password=os.getenv("RDS_PASSWORD", "")
+        password=os.getenv("RDS_PASSWORD", ""),
+        connect_timeout=int(os.getenv("RDS_CONNECT_TIMEOUT", "10"))
     )
 
+# dental_queries rows are written behind the response, in bulk (see query_log.py)
+query_logger = QueryLogWriter(get_db_connection)
+
 # Pydantic models
 class QueryRequest(BaseModel):
     query: str
     patient_id: Optional[str] = None
     model_provider: Optional[str] = "ollama"  # "ollama", "gemini", or "glm"
+    allow_fallback: Optional[bool] = False  # Opt-in: another provider may answer if this one fails
+
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "500"))
+
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    patient_id: Optional[str] = None
+    model_provider: Optional[str] = "ollama"  # "ollama", "gemini", or "glm"
+    allow_fallback: Optional[bool] = False
 
 class QueryResponse(BaseModel):
     answer: str
     sources: List[dict]
-    query_id: int
+    provider: Optional[str] = None  # the provider that answered (None for canned replies); differs from model_provider only after a fallback
+    query_id: Optional[int] = None  # null only while the database is unreachable; the row is still logged
 
 class IngestRequest(BaseModel):
     text: str
@@ -359,14 +660,19 @@ class ChatMessageRequest(BaseModel):
     query: str
     patient_id: Optional[str] = None
     model_provider: Optional[str] = "ollama"  # "ollama", "gemini", or "glm"
-    image_data: Optional[str] = None  # Base64 encoded image for vision analysis
+    allow_fallback: Optional[bool] = False  # Opt-in: another provider may answer if this one fails
+    image_id: Optional[int] = None  # document_id returned by /api/upload-image
+    image_data: Optional[str] = None  # Deprecated: base64 image; prefer image_id or the multipart endpoint
 
 class ChatUpdateRequest(BaseModel):
     title: Optional[str] = None
     is_favorite: Optional[bool] = None
 
+class UserSettingsRequest(BaseModel):
+    whisper_model: Optional[str] = None  # model size or tier; None clears it
+
 class VoiceTranscribeRequest(BaseModel):
-    audio_data: str  # Base64 encoded audio
+    audio_data: str  # Deprecated: base64 encoded audio; send the raw bytes instead
 
 class PatientCreateRequest(BaseModel):
     id: str  # Unique patient ID
@@ -430,18 +736,83 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
         "id": current_user["id"],
         "email": current_user["email"],
         "name": current_user["name"],
-        "picture_url": current_user.get("picture_url")
+        "picture_url": current_user.get("picture_url"),
+        "whisper_model": current_user.get("whisper_model")
     }
 
+@app.patch("/api/auth/me")
+async def update_user_settings(request: UserSettingsRequest, current_user: dict = Depends(get_current_user)):
+    """Update the current user's settings. whisper_model: a model size or tier
+    ("dictation", "clinical") used for their transcriptions; null for the server default"""
+    if request.whisper_model is not None:
+        whisper_models.resolve(request.whisper_model)
+    try:
+        # Drops get_current_user's cached row as well
+        user = await run_in_threadpool(update_user, current_user["id"], whisper_model=request.whisper_model)
+    except Exception as e:
+        logger.exception("update_user_settings failed")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
+
 @app.get("/health")
 async def health_check():
+    """Liveness: the process is up. Never touches a dependency."""
     return {"status": "healthy"}
 
+def _readiness_checks() -> dict:
+    checks = {}
+    try:
+        conn = get_db_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        finally:
+            conn.close()
+        checks["database"] = {"state": "ready", "error": None}
+    except Exception as e:
+        checks["database"] = {"state": "failed", "error": str(e)}
+    for client in LAZY_CLIENTS:
+        client.try_init()
+        checks[client.name] = client.state()
+    # Hosts start out healthy so calls are tried at once; only a passed check counts here
+    if ollama_pool.has_verified_host():
+        ollama_state = "ready"
+    else:
+        ollama_state = "failed" if ollama_pool.checked() else "pending"
+    checks["ollama"] = {"state": ollama_state, "hosts": ollama_pool.status()}
+    checks["whisper"] = whisper_models.status()
+    return checks
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: the database, the vector index and at least one LLM provider are reachable,
+    and the first model warm-up pass has finished"""
+    checks = await run_in_threadpool(_readiness_checks)
+    ready = (
+        checks["database"]["state"] == "ready"
+        and checks["pinecone"]["state"] == "ready"
+        and any(checks[name]["state"] == "ready" for name in ("ollama", "gemini", "glm"))
+        and model_warmer.complete
+    )
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "dependencies": checks,
+                 "warmup": model_warmer.status()}
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/debug")
 async def debug_info():
     """Debug endpoint to check environment variables and connections."""
     debug_info = {
         "ollama_base_url": OLLAMA_BASE_URL,
+        "ollama_hosts": ollama_pool.status(),
         "ollama_llm_model": OLLAMA_LLM_MODEL,
         "ollama_embedding_model": OLLAMA_EMBEDDING_MODEL,
         "gemini_api_key_set": bool(GEMINI_API_KEY),
@@ -451,6 +822,8 @@ async def debug_info():
         "pinecone_index_name": os.getenv("PINECONE_INDEX_NAME", "dental-gpt"),
         "rds_host": os.getenv("RDS_HOST", "localhost"),
         "rds_database": os.getenv("RDS_DATABASE", "dentalgpt"),
+        "providers": provider_router.snapshot(),
+        "request_coalescing": request_coalescer.stats(),
     }
     
     # Test database connection
@@ -463,7 +836,7 @@ async def debug_info():
     
     # Test Pinecone connection
     try:
-        index_stats = index.describe_index_stats()
+        index_stats = pinecone_index.get().describe_index_stats()
         debug_info["pinecone_connection"] = "OK"
     except Exception as e:
         debug_info["pinecone_connection"] = f"ERROR: {str(e)}"
@@ -472,14 +845,19 @@ async def debug_info():
 
 # Chat management endpoints
 @app.get("/api/chats")
-async def get_user_chats(patient_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
-    """Get all chats for the current user, optionally filtered by patient_id"""
+async def get_user_chats(response: Response, patient_id: Optional[str] = None,
+                         if_none_match: Optional[str] = Header(None),
+                         current_user: dict = Depends(get_current_user)):
+    """Get all chats for the current user, optionally filtered by patient_id.
+
+    Sends a weak ETag; a matching If-None-Match gets 304 without listing the chats.
+    """
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         
         if patient_id:
-            # Verify patient belongs to user
+            # Verify patient belongs to user before the version query, so a 304 reveals nothing
             cur.execute(
                 "SELECT user_id FROM patients WHERE id = %s",
                 (patient_id,)
@@ -487,7 +865,23 @@ async def get_user_chats(patient_id: Optional[str] = None, current_user: dict =
             patient = cur.fetchone()
             if not patient or patient["user_id"] != current_user["id"]:
                 raise HTTPException(status_code=403, detail="Patient not found or access denied")
-            
+        
+        # Every change to a chat or its messages bumps chats.updated_at; the count catches deletes
+        cur.execute(
+            """SELECT COUNT(*) AS chat_count, MAX(updated_at) AS last_updated
+               FROM chats
+               WHERE user_id = %s AND (%s::varchar IS NULL OR patient_id = %s)""",
+            (current_user["id"], patient_id, patient_id)
+        )
+        version = cur.fetchone()
+        etag = make_etag("chats", current_user["id"], patient_id, version["chat_count"], version["last_updated"])
+        if etag_matches(if_none_match, etag):
+            cur.close()
+            conn.close()
+            return not_modified(etag)
+        response.headers.update(etag_headers(etag))
+        
+        if patient_id:
             cur.execute(
                 """SELECT c.id, c.title, c.patient_id, c.created_at, c.updated_at, c.is_favorite,
                           COUNT(cm.id) as message_count
@@ -546,15 +940,12 @@ async def create_chat(request: ChatCreateRequest, current_user: dict = Depends(g
         conn.commit()
         cur.close()
         conn.close()
-        print(f"[DEBUG] Created chat with patient_id: {chat.get('patient_id')}")
+        logger.debug("Created chat %s with patient_id: %s", chat.get("id"), chat.get("patient_id"))
         return dict(chat)
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in create_chat: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("create_chat failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.patch("/api/chats/{chat_id}")
@@ -636,76 +1027,100 @@ async def delete_chat(chat_id: int, current_user: dict = Depends(get_current_use
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/chats/{chat_id}/messages")
-async def get_chat_messages(chat_id: int, current_user: dict = Depends(get_current_user)):
-    """Get all messages for a specific chat"""
+async def get_chat_messages(chat_id: int, if_none_match: Optional[str] = Header(None),
+                            current_user: dict = Depends(get_current_user)):
+    """Get all messages for a specific chat.
+
+    Sends a weak ETag; a matching If-None-Match gets 304 without reading the messages.
+    """
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        # Verify chat belongs to user
+        # Verify chat belongs to user, and read its version: messages are only ever appended
         cur.execute(
-            "SELECT user_id FROM chats WHERE id = %s",
+            """SELECT user_id, updated_at,
+                      (SELECT MAX(id) FROM chat_messages WHERE chat_id = chats.id) AS last_message_id
+               FROM chats WHERE id = %s""",
             (chat_id,)
         )
         chat = cur.fetchone()
         if not chat or chat["user_id"] != current_user["id"]:
             raise HTTPException(status_code=403, detail="Chat not found or access denied")
+        etag = make_etag("messages", chat_id, chat["updated_at"], chat["last_message_id"])
+        if etag_matches(if_none_match, etag):
+            cur.close()
+            conn.close()
+            return not_modified(etag)
         
         cur.execute(
-            """SELECT id, message_type, content, sources, image, created_at
-               FROM chat_messages
-               WHERE chat_id = %s
-               ORDER BY created_at ASC""",
+            """SELECT m.id, m.message_type, m.content, m.sources, m.image, m.image_id, m.created_at,
+                      p.file_name AS image_file_name
+               FROM chat_messages m
+               LEFT JOIN patient_documents p ON p.id = m.image_id
+               WHERE m.chat_id = %s
+               ORDER BY m.created_at ASC""",
             (chat_id,)
         )
-        messages = cur.fetchall()
+        messages = []
+        for row in cur.fetchall():
+            message = dict(row)
+            file_name = message.pop("image_file_name")
+            message["image_url"] = document_image_url(message["image_id"], file_name) if message["image_id"] else None
+            messages.append(message)
         cur.close()
         conn.close()
-        return {"messages": [dict(row) for row in messages]}
+        return json_response({"messages": messages}, headers=etag_headers(etag))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def is_conversation_ending(query: str) -> bool:
-    """Check if the query sounds like the end of a conversation"""
-    query_lower = query.lower().strip()
-    
-    # List of phrases that indicate conversation ending
-    ending_phrases = [
-        "ok thanks", "ok thank you", "okay thanks", "okay thank you",
-        "thanks", "thank you", "thx", "ty",
-        "that's all", "thats all", "that is all",
-        "nothing else", "nothing more",
-        "no more questions", "no more",
-        "that's it", "thats it", "that is it",
-        "all done", "done", "finished",
-        "no further questions", "no other questions",
-        "got it", "understood", "i understand",
-        "perfect", "great thanks", "great thank you",
-        "appreciate it", "appreciate",
-        "sounds good", "sounds great"
-    ]
-    
-    # Check if query matches any ending phrase (exact match or starts with it)
-    for phrase in ending_phrases:
-        if query_lower == phrase or query_lower.startswith(phrase + " ") or query_lower.endswith(" " + phrase):
-            return True
-    
-    # Check if query is very short and contains thanks/ok
-    if len(query_lower.split()) <= 3:
-        if any(word in query_lower for word in ["ok", "okay", "thanks", "thank", "thx", "ty"]):
-            return True
-    
-    return False
 
-@app.post("/api/chats/{chat_id}/messages")
-async def add_chat_message(chat_id: int, request: ChatMessageRequest, current_user: dict = Depends(get_current_user)):
-    """Add a message to a chat and get AI response"""
+def document_image_url(document_id: int, file_name: Optional[str]) -> str:
+    """Where a browser can show an uploaded image: the decoded PNG for DICOM, the file itself otherwise"""
+    if file_name and os.path.splitext(file_name)[1].lower() in DICOM_EXTENSIONS:
+        return f"/api/documents/{document_id}/preview"
+    return f"/api/documents/{document_id}/download"
+
+
+# The vision-ready JPEG for decoded DICOM, otherwise the uploaded bytes
+LOAD_IMAGE_SQL = """
+    SELECT COALESCE(d.file_data, p.file_data) AS file_data
+    FROM patient_documents p
+    LEFT JOIN document_derivatives d ON d.document_id = p.id AND d.kind = 'vision'
+    WHERE p.id = %s AND p.user_id = %s
+"""
+
+
+def _fetch_image(cur, image_id: int, user_id: int) -> bytes:
+    cur.execute(LOAD_IMAGE_SQL, (image_id, user_id))
+    row = cur.fetchone()
+    if not row or row["file_data"] is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return bytes(row["file_data"])
+
+
+def _load_image(image_id: int, user_id: int) -> bytes:
+    """Bytes of an uploaded image owned by user_id"""
+    conn = get_db_connection()
     try:
-        model_provider = request.model_provider or "ollama"
-        print(f"[DEBUG] Using model provider: {model_provider}")
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        image_bytes = _fetch_image(cur, image_id, user_id)
+        cur.close()
+        return image_bytes
+    finally:
+        conn.close()
 
-        conn = get_db_connection()
+
+def _load_chat_turn(chat_id: int, user_id: int, image_id: Optional[int] = None) -> tuple:
+    """Read phase of a chat turn: ownership check, patient row, recent history
+    and, if image_id is given, the image's bytes.
+
+    Returns (patient_info, recent_messages, image_bytes). The connection is
+    closed before any embedding or generation starts.
+    """
+    conn = get_db_connection()
+    try:
         cur = conn.cursor(cursor_factory=RealDictCursor)
 
         # Verify chat belongs to user and get patient_id
@@ -714,312 +1129,362 @@ async def add_chat_message(chat_id: int, request: ChatMessageRequest, current_us
             (chat_id,)
         )
         chat = cur.fetchone()
-        if not chat or chat["user_id"] != current_user["id"]:
+        if not chat or chat["user_id"] != user_id:
             raise HTTPException(status_code=403, detail="Chat not found or access denied")
-        
+
         # Get patient information if chat is linked to a patient
         patient_info = None
         if chat.get("patient_id"):
-            print(f"[DEBUG] Chat is linked to patient_id: {chat['patient_id']}")
+            logger.debug("Chat is linked to patient_id: %s", chat["patient_id"])
             cur.execute(
                 """SELECT id, name, email, phone, date_of_birth, gender, address, 
                    medical_history, dental_history, allergies, medications, summary
                    FROM patients WHERE id = %s AND user_id = %s""",
-                (chat["patient_id"], current_user["id"])
+                (chat["patient_id"], user_id)
             )
             patient = cur.fetchone()
             if patient:
                 patient_info = dict(patient)
-                print(f"[DEBUG] Loaded patient info for: {patient_info.get('name')}")
+                logger.debug("Loaded patient info for patient_id: %s", patient_info.get("id"))
             else:
-                print(f"[DEBUG] Patient not found for patient_id: {chat['patient_id']}")
+                logger.debug("Patient not found for patient_id: %s", chat["patient_id"])
         else:
-            print(f"[DEBUG] Chat is not linked to any patient")
+            logger.debug("Chat is not linked to any patient")
 
-        # Check if this is a conversation-ending message
-        if is_conversation_ending(request.query):
-            # Save user message with image if provided
-            cur.execute(
-                """INSERT INTO chat_messages (chat_id, message_type, content, image)
-                   VALUES (%s, 'user', %s, %s)
-                   RETURNING id""",
-                (chat_id, request.query, request.image_data)
-            )
-            user_result = cur.fetchone()
-            if not user_result:
-                raise Exception("Failed to save user message")
-            user_message_id = user_result['id']
+        # Get recent chat message history for context (including images)
+        cur.execute(
+            """SELECT message_type, content, image, image_id, created_at
+               FROM chat_messages
+               WHERE chat_id = %s
+               ORDER BY created_at DESC
+               LIMIT 10""",
+            (chat_id,)
+        )
+        recent_messages = cur.fetchall()
+        image_bytes = _fetch_image(cur, image_id, user_id) if image_id is not None else None
+        cur.close()
+        return patient_info, recent_messages, image_bytes
+    finally:
+        conn.close()
 
-            # Return a friendly closing response
-            closing_response = "You're welcome! Is there anything else you'd like to know?"
-            
-            # Save AI message
-            cur.execute(
-                """INSERT INTO chat_messages (chat_id, message_type, content)
-                   VALUES (%s, 'ai', %s)
-                   RETURNING id""",
-                (chat_id, closing_response)
-            )
-            ai_result = cur.fetchone()
-            if not ai_result:
-                raise Exception("Failed to save AI message")
-            ai_message_id = ai_result['id']
 
-            # Update chat timestamp
-            cur.execute(
-                "UPDATE chats SET updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-                (chat_id,)
+# One round trip per chat turn. Data-modifying CTEs all see the snapshot from
+# before the statement, so "no user message yet" means this is the first one.
+# An image sent with the message itself is stored as a patient document and
+# referenced by image_id, like one uploaded beforehand.
+SAVE_CHAT_TURN_SQL = """
+    WITH doc AS (
+        INSERT INTO patient_documents (patient_id, user_id, document_type, file_name, file_size, file_data)
+        SELECT patient_id, user_id, 'xray', %(file_name)s, %(file_size)s, %(file_data)s
+        FROM chats
+        WHERE id = %(chat_id)s AND %(has_upload)s
+        RETURNING id
+    ), user_msg AS (
+        INSERT INTO chat_messages (chat_id, message_type, content, image_id)
+        VALUES (%(chat_id)s, 'user', %(query)s, COALESCE(%(image_id)s, (SELECT id FROM doc)))
+        RETURNING id, image_id
+    ), ai_msg AS (
+        INSERT INTO chat_messages (chat_id, message_type, content, sources)
+        SELECT %(chat_id)s, 'ai', %(answer)s, %(sources)s::jsonb FROM user_msg
+        RETURNING id
+    ), chat_update AS (
+        UPDATE chats
+        SET updated_at = CURRENT_TIMESTAMP,
+            title = CASE
+                WHEN %(update_title)s AND NOT EXISTS (
+                    SELECT 1 FROM chat_messages WHERE chat_id = %(chat_id)s AND message_type = 'user'
+                ) THEN %(title)s
+                ELSE title
+            END
+        WHERE id = %(chat_id)s
+    )
+    SELECT (SELECT id FROM user_msg) AS user_message_id, (SELECT id FROM ai_msg) AS ai_message_id,
+           (SELECT image_id FROM user_msg) AS image_id
+"""
+
+
+def _save_chat_turn(chat_id: int, query: str, answer: str, sources: Optional[list] = None,
+                    update_title: bool = True, image_id: Optional[int] = None,
+                    upload: Optional[tuple] = None) -> tuple:
+    """Write phase of a chat turn: both messages, the chat timestamp, (for the
+    first message) the chat title and any newly sent image, in a single statement.
+
+    upload is (file_name, image_bytes) for an image sent with the message.
+    Returns (user_message_id, ai_message_id, image_id).
+    """
+    file_name, file_data = upload if upload else (None, None)
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(SAVE_CHAT_TURN_SQL, {
+            "chat_id": chat_id,
+            "query": query,
+            "image_id": image_id,
+            "has_upload": file_data is not None,
+            "file_name": file_name,
+            "file_size": len(file_data) if file_data is not None else None,
+            "file_data": file_data,
+            "answer": answer,
+            "sources": json.dumps(sources) if sources is not None else None,
+            "update_title": update_title,
+            "title": query[:30] + "..." if len(query) > 30 else query,
+        })
+        result = cur.fetchone()
+        if not result or result['user_message_id'] is None:
+            raise Exception("Failed to save user message")
+        if result['ai_message_id'] is None:
+            raise Exception("Failed to save AI message")
+        conn.commit()
+        cur.close()
+        return result['user_message_id'], result['ai_message_id'], result['image_id']
+    finally:
+        conn.close()
+
+
+async def _answer_chat_turn(chat_id: int, current_user: dict, query: str, model_provider: Optional[str],
+                            allow_fallback: bool, image_id: Optional[int] = None,
+                            upload: Optional[tuple] = None):
+    """Answer one chat message and persist the turn.
+
+    Runs in three phases so no database connection is held while the model
+    works: a short read (chat, patient, history, referenced image),
+    connection-free embedding, retrieval and generation, then a short write.
+    The image stays bytes throughout; upload is (file_name, image_bytes) for
+    an image sent with the message rather than uploaded beforehand.
+    """
+    try:
+        model_provider = model_provider or "ollama"
+        logger.debug("Using model provider: %s", model_provider)
+
+        with stage_timer("chat_message", "db_read"):
+            patient_info, recent_messages, image_bytes = await run_in_threadpool(
+                _load_chat_turn, chat_id, current_user["id"], image_id
             )
+        if upload:
+            image_bytes = upload[1]
 
-            conn.commit()
-            cur.close()
-            conn.close()
+        # Check if this is a conversation-ending message
+        if is_conversation_ending(query):
+            # Return a friendly closing response
+            closing_response = CLOSING_RESPONSE
+            with stage_timer("chat_message", "persist"):
+                user_message_id, ai_message_id, saved_image_id = await run_in_threadpool(
+                    _save_chat_turn, chat_id, query, closing_response,
+                    update_title=False, image_id=image_id, upload=upload
+                )
 
             return {
-                "user_message": {"id": user_message_id, "content": request.query, "type": "user", "image": request.image_data},
+                "user_message": {"id": user_message_id, "content": query, "type": "user", "image_id": saved_image_id},
                 "ai_message": {"id": ai_message_id, "content": closing_response, "type": "ai", "sources": []}
             }
 
         # Generate embedding using the selected model provider
-        query_embedding = get_embedding(request.query, model_provider)
-        print(f"[DEBUG] Got embedding, dimension: {len(query_embedding)}")
+        with stage_timer("chat_message", "embedding", provider_label(model_provider), provider_model(model_provider, "embed")):
+            query_embedding = await embed_query(query, model_provider)
+        logger.debug("Got embedding, dimension: %d", len(query_embedding))
 
         # Search Pinecone for relevant context
-        search_results = index.query(
-            vector=query_embedding,
-            top_k=5,
-            include_metadata=True
-        )
-        print(f"[DEBUG] Pinecone query returned {len(search_results.matches)} matches")
+        with stage_timer("chat_message", "retrieval", provider_label(model_provider)):
+            search_results = await retrieve_context(query, query_embedding, model_provider)
+        logger.debug("Pinecone query returned %d matches", len(search_results.matches))
 
         # Build context from retrieved documents
-        context_chunks = []
-        sources = []
-        for match in search_results.matches:
-            chunk_text = match.metadata.get('text', '')
-            context_chunks.append(chunk_text)
-            sources.append({
-                "text": chunk_text[:200] + "..." if len(chunk_text) > 200 else chunk_text,
-                "score": match.score,
-                "metadata": match.metadata
-            })
-
-        context = "\n\n".join(context_chunks)
+        context, sources = build_context(search_results.matches)
 
-        # Get recent chat message history for context (including images)
-        cur.execute(
-            """SELECT message_type, content, image, created_at
-               FROM chat_messages
-               WHERE chat_id = %s
-               ORDER BY created_at DESC
-               LIMIT 10""",
-            (chat_id,)
-        )
-        recent_messages = cur.fetchall()
-        chat_history = ""
-        previous_image_data = None  # Store the most recent image from history
-        if recent_messages:
-            # Reverse to show chronological order (oldest first)
-            messages_list = list(reversed(recent_messages))
-            chat_history = "\n\nRecent Conversation History:\n"
-            for msg in messages_list:
-                role = "User" if msg["message_type"] == "user" else "Assistant"
-                content = msg['content']
-                # If message has an image, note it in the history
-                if msg.get('image'):
-                    content += " [Note: This message included an X-ray/medical image that was analyzed]"
-                    # Store the most recent image for potential re-use
-                    if msg["message_type"] == "user" and not previous_image_data:
-                        previous_image_data = msg['image']
-                chat_history += f"{role}: {content}\n"
+        with stage_timer("chat_message", "history"):
+            chat_history, previous_image = build_chat_history(recent_messages)
 
         # Build patient context if available
-        patient_context = ""
-        if patient_info:
-            patient_context = f"""
-Patient Information:
-- Name: {patient_info.get('name', 'N/A')}
-- Patient ID: {patient_info.get('id', 'N/A')}
-- Date of Birth: {patient_info.get('date_of_birth', 'N/A')}
-- Gender: {patient_info.get('gender', 'N/A')}
-- Email: {patient_info.get('email', 'N/A')}
-- Phone: {patient_info.get('phone', 'N/A')}
-- Address: {patient_info.get('address', 'N/A')}
-"""
-            if patient_info.get('summary'):
-                patient_context += f"- Summary: {patient_info.get('summary')}\n"
-            if patient_info.get('medical_history'):
-                patient_context += f"- Medical History: {patient_info.get('medical_history')}\n"
-            if patient_info.get('dental_history'):
-                patient_context += f"- Dental History: {patient_info.get('dental_history')}\n"
-            if patient_info.get('allergies'):
-                patient_context += f"- Allergies: {patient_info.get('allergies')}\n"
-            if patient_info.get('medications'):
-                patient_context += f"- Current Medications: {patient_info.get('medications')}\n"
-
-        # Generate prompt
-        image_instruction = ""
-        image_data_to_use = request.image_data
-        
-        # If current request doesn't have an image but previous message had one, 
-        # and the query seems related to image analysis, use the previous image
-        if not image_data_to_use and previous_image_data:
-            # Check if query is asking about previous image analysis or summary
-            query_lower = request.query.lower()
-            # More specific keywords that indicate the user wants to reference the previous image
-            image_related_keywords = ['xray', 'x-ray', 'image', 'picture', 'photo', 'summarize', 'summary', 'what did you see', 'what did you find', 'analysis', 'observe', 'findings', 'tell me about', 'describe']
-            # Also check if it's a short follow-up query (likely referencing previous image)
-            is_short_followup = len(request.query.split()) <= 5 and any(word in query_lower for word in ['summary', 'summarize', 'ok', 'what', 'tell', 'describe'])
-            
-            if any(keyword in query_lower for keyword in image_related_keywords) or is_short_followup:
-                print(f"[DEBUG] Query seems related to image analysis, using previous image from chat history")
-                image_data_to_use = previous_image_data
-        
-        if image_data_to_use:
-            print(f"[DEBUG] Image data present in request, length: {len(image_data_to_use)}")
-            image_instruction = "\n\nCRITICAL: The user has provided an X-ray or medical image that you MUST analyze. The image has been sent to you - do NOT say you don't have it or can't see it. Please carefully examine the image and provide detailed observations about:\n- Any visible dental structures, restorations, or abnormalities\n- Potential issues or concerns\n- Recommendations based on what you observe\n- Specific findings from the image\n\nYou have access to the image - analyze it now."
-        
-        prompt = f"""You are a dental assistant AI helping a dentist with patient care. Answer the following question based on the provided dental guidelines, clinical knowledge, and conversation history.{patient_context}{chat_history}
-
-Dental Guidelines Context:
-{context}
-{image_instruction}
+        patient_context = build_patient_context(patient_info)
 
-Current Question: {request.query}
-
-IMPORTANT: Provide a clear, concise, and clinically accurate answer. 
-- If the context contains relevant information, use it and cite which parts of the guidelines you're referencing.
-- If the context doesn't contain enough information, still provide a helpful general answer based on your dental knowledge and best practices. Don't just say "I don't have information" - be helpful and provide practical guidance.
-- Always be professional, empathetic, and clinically sound in your responses. 
+        # If current request doesn't have an image but previous message had one,
+        # and the query seems related to image analysis, use the previous image
+        if not image_bytes and previous_image and wants_previous_image(query):
+            logger.debug("Query seems related to image analysis, using previous image from chat history")
+            if isinstance(previous_image, int):
+                image_bytes = await run_in_threadpool(_load_image, previous_image, current_user["id"])
+            else:
+                image_bytes = base64.b64decode(previous_image)  # saved before image ids existed
 
-IMPORTANT INSTRUCTIONS:
-1. When the user asks about "this patient", "the patient", "patient summary", "patient information", or similar questions, you MUST use the Patient Information provided above.
-2. When the user asks about procedures, treatments, or actions discussed in this conversation, refer to the Recent Conversation History above to see what was previously discussed.
-3. If the conversation history mentions a procedure being done (e.g., "done with procedure of root canal"), you should acknowledge this when asked about the last procedure.
-4. Use both the dental guidelines and conversation history to provide comprehensive answers."""
+        prompt = build_chat_prompt(query, context, patient_context, chat_history, bool(image_bytes))
 
         # Generate answer using the selected LLM (with image support if provided)
-        print(f"[DEBUG] Image data present: {bool(image_data_to_use)}, length: {len(image_data_to_use) if image_data_to_use else 0}")
-        answer = generate_llm_response(prompt, model_provider, image_data_to_use)
-        print(f"[DEBUG] Got response from {model_provider}, length: {len(answer)}")
-        if image_data_to_use:
-            print(f"[DEBUG] Image analysis was performed with {model_provider}")
-
-        # Save user message with image if provided
-        cur.execute(
-            """INSERT INTO chat_messages (chat_id, message_type, content, image)
-               VALUES (%s, 'user', %s, %s)
-               RETURNING id""",
-            (chat_id, request.query, request.image_data)
-        )
-        user_result = cur.fetchone()
-        if not user_result:
-            raise Exception("Failed to save user message")
-        user_message_id = user_result['id']
-
-        # Save AI message
-        cur.execute(
-            """INSERT INTO chat_messages (chat_id, message_type, content, sources)
-               VALUES (%s, 'ai', %s, %s)
-               RETURNING id""",
-            (chat_id, answer, json.dumps(sources))
-        )
-        ai_result = cur.fetchone()
-        if not ai_result:
-            raise Exception("Failed to save AI message")
-        ai_message_id = ai_result['id']
-
-        # Update chat timestamp
-        cur.execute(
-            "UPDATE chats SET updated_at = CURRENT_TIMESTAMP WHERE id = %s",
-            (chat_id,)
-        )
-
-        # Update chat title if it's the first message
-        cur.execute(
-            "SELECT COUNT(*) as count FROM chat_messages WHERE chat_id = %s AND message_type = 'user'",
-            (chat_id,)
-        )
-        result = cur.fetchone()
-        message_count = result['count'] if result else 0
-        if message_count == 1:
-            title = request.query[:30] + "..." if len(request.query) > 30 else request.query
-            cur.execute(
-                "UPDATE chats SET title = %s WHERE id = %s",
-                (title, chat_id)
+        logger.debug("Image present: %s, size: %d bytes", bool(image_bytes), len(image_bytes) if image_bytes else 0)
+        operation = "vision" if image_bytes else "generate"
+        with stage_timer("chat_message", "generation", provider_label(model_provider), provider_model(model_provider, operation)):
+            answer, answered_by = await generate_answer(prompt, model_provider, image_bytes, allow_fallback=bool(allow_fallback))
+        logger.debug("Got response from %s, length: %d, image analysis: %s", answered_by, len(answer), bool(image_bytes))
+
+        with stage_timer("chat_message", "persist"):
+            user_message_id, ai_message_id, saved_image_id = await run_in_threadpool(
+                _save_chat_turn, chat_id, query, answer, sources, image_id=image_id, upload=upload
             )
 
-        conn.commit()
-        cur.close()
-        conn.close()
-
-        return {
-            "user_message": {"id": user_message_id, "content": request.query, "type": "user", "image": request.image_data},
-            "ai_message": {"id": ai_message_id, "content": answer, "type": "ai", "sources": sources}
-        }
+        return json_response({
+            "user_message": {"id": user_message_id, "content": query, "type": "user", "image_id": saved_image_id},
+            "ai_message": {"id": ai_message_id, "content": answer, "type": "ai", "sources": sources,
+                           "provider": answered_by}
+        })
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
         error_type = type(e).__name__
         error_message = str(e) if str(e) else repr(e)
-        print(f"=" * 50)
-        print(f"ERROR in add_chat_message:")
-        print(f"Type: {error_type}")
-        print(f"Message: {error_message}")
-        print(f"Chat ID: {chat_id}")
-        print(f"User ID: {current_user.get('id') if current_user else 'None'}")
-        print(f"Query: {request.query[:50] if request else 'N/A'}")
-        print(f"Full traceback:\n{error_details}")
-        print(f"=" * 50)
-        # Close database connection if still open
-        try:
-            if 'cur' in locals():
-                cur.close()
-            if 'conn' in locals():
-                conn.close()
-        except:
-            pass
+        # Query text stays out of error logs; ids are enough to find the turn
+        logger.exception(
+            "add_chat_message failed",
+            extra={"chat_id": chat_id, "user_id": current_user.get("id") if current_user else None,
+                   "query_length": len(query)}
+        )
         raise HTTPException(
             status_code=500,
             detail=f"Error processing query ({error_type}): {error_message}. Check backend terminal for full details."
         )
 
+@app.post("/api/chats/{chat_id}/messages")
+async def add_chat_message(chat_id: int, request: ChatMessageRequest, current_user: dict = Depends(get_current_user)):
+    """Add a message to a chat and get AI response.
+
+    Attach an image by passing the image_id (document_id) returned by
+    /api/upload-image, or send it in one request to /messages/upload.
+    """
+    upload = None
+    if request.image_data and request.image_id is None:
+        try:
+            image_bytes = base64.b64decode(request.image_data)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="image_data is not valid base64")
+        upload = ("chat_image" + image_extension(image_bytes), image_bytes)
+    return await _answer_chat_turn(chat_id, current_user, request.query, request.model_provider,
+                                   bool(request.allow_fallback), image_id=request.image_id, upload=upload)
+
+@app.post("/api/chats/{chat_id}/messages/upload")
+async def add_chat_message_with_image(chat_id: int, query: str = Form(...), image: UploadFile = File(...),
+                                      model_provider: Optional[str] = Form("ollama"), allow_fallback: bool = Form(False),
+                                      current_user: dict = Depends(get_current_user)):
+    """Add a message with an image as a multipart file part (no base64), and get AI response.
+
+    The image is stored as a patient document and the turn references it
+    by image_id, as if it had gone through /api/upload-image first.
+    """
+    file_extension = os.path.splitext(image.filename or "")[1].lower()
+    if file_extension not in ALLOWED_IMAGE_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported image type: {file_extension}. Supported: {', '.join(ALLOWED_IMAGE_EXTENSIONS)}"
+        )
+    image_bytes = await image.read()
+    return await _answer_chat_turn(chat_id, current_user, query, model_provider, allow_fallback,
+                                   upload=(image.filename, image_bytes))
+
+async def _read_audio_upload(request: Request) -> bytes:
+    """Recording bytes from a raw body, a multipart `audio` part or (deprecated) base64 JSON.
+
+    Every path is capped at MAX_AUDIO_BYTES while the body streams in.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == "application/json":
+        body = await read_audio_json(request)
+        try:
+            audio_bytes = base64.b64decode(VoiceTranscribeRequest(**json.loads(body)).audio_data)
+        except (TypeError, ValueError):  # bad JSON, missing audio_data or bad base64
+            raise HTTPException(status_code=400, detail="Expected JSON {\"audio_data\": <base64 audio>}")
+        if len(audio_bytes) > MAX_AUDIO_BYTES:
+            raise HTTPException(status_code=413, detail=f"Audio larger than {MAX_AUDIO_BYTES} bytes")
+        return audio_bytes
+    if content_type == "multipart/form-data":
+        audio_bytes = await read_audio_form(request)
+        if audio_bytes is None:
+            raise HTTPException(status_code=400, detail="Send the recording as the 'audio' file part")
+        return audio_bytes
+    return await read_audio_body(request)
+
+def _whisper_key(current_user: dict, model: Optional[str], compute_type: Optional[str]) -> tuple:
+    """Model for a transcription: the request's choice, else the user's setting, else the default"""
+    if model:
+        return whisper_models.resolve(model, compute_type)
+    try:
+        return whisper_models.resolve(current_user.get("whisper_model"), compute_type)
+    except HTTPException:
+        # A saved setting the server no longer offers falls back to the default
+        return whisper_models.resolve(None, compute_type)
+
+@app.get("/api/voice/models")
+async def list_whisper_models(current_user: dict = Depends(get_current_user)):
+    """Whisper models, tiers and compute types a transcription may ask for, and what is loaded"""
+    return {
+        "tiers": whisper_models.tiers,
+        "models": whisper_models.models,
+        "compute_types": whisper_models.compute_types,
+        "user_model": current_user.get("whisper_model"),
+        **whisper_models.status()
+    }
+
 # Voice transcription endpoint
 @app.post("/api/voice/transcribe")
-async def transcribe_audio(request: VoiceTranscribeRequest, current_user: dict = Depends(get_current_user)):
-    """Transcribe audio using Faster-Whisper"""
+async def transcribe_audio(request: Request, model: Optional[str] = None, compute_type: Optional[str] = None,
+                           current_user: dict = Depends(get_current_user)):
+    """Transcribe audio using Faster-Whisper.
+
+    Send the recording as the raw request body with its own Content-Type
+    (audio/webm, audio/ogg, audio/wav...), as the `audio` part of a
+    multipart form, or as JSON {"audio_data": <base64>} (deprecated). It is
+    decoded in memory; no temporary file is written. Recordings longer
+    than LONG_AUDIO_SECONDS are split at pauses and transcribed in
+    parallel, and the response adds timestamped segments.
+
+    model picks a Whisper size or tier ("dictation", "clinical") and
+    compute_type its precision; by default the user's setting is used.
+    """
     try:
-        from faster_whisper import WhisperModel
-        import base64
-        
-        # Decode base64 audio
-        audio_bytes = base64.b64decode(request.audio_data)
-        
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            tmp_file.write(audio_bytes)
-            tmp_file_path = tmp_file.name
-        
-        try:
-            # Load Whisper model (use base model for speed, or medium for better accuracy)
-            model = WhisperModel("base", device="cpu", compute_type="int8")
-            
-            # Transcribe
-            segments, info = model.transcribe(tmp_file_path, beam_size=5)
-            text = " ".join([segment.text for segment in segments])
-            
-            return {"text": text.strip(), "language": info.language}
-        finally:
-            # Clean up temp file
-            if os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
-    except ImportError:
-        raise HTTPException(status_code=500, detail="Faster-Whisper not installed. Install with: pip install faster-whisper")
+        model_key = _whisper_key(current_user, model, compute_type)
+        audio_bytes = await _read_audio_upload(request)
+        with stage_timer("transcribe", "decode"):
+            audio = await run_in_threadpool(decode_audio_bytes, audio_bytes)
+        # Shared Whisper model, loaded at startup by the warm-up
+        with stage_timer("transcribe", "transcription", "whisper", model_key[0]):
+            return await run_in_threadpool(transcribe_recording, audio, None, model_key)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("transcribe_audio failed")
+        raise HTTPException(status_code=500, detail=f"Transcription error: {str(e)}")
+
+@app.post("/api/voice/transcriptions", status_code=202)
+async def create_transcription_job(request: Request, model: Optional[str] = None, compute_type: Optional[str] = None,
+                                   current_user: dict = Depends(get_current_user)):
+    """Start a background transcription of a long recording (same body and
+    parameters as /api/voice/transcribe).
+
+    Returns the job at once; poll /api/voice/transcriptions/{job_id} for
+    progress and the result. 429 if the user already has
+    TRANSCRIPTION_JOB_USER_LIMIT jobs unfinished, 503 if the queue is full.
+    """
+    try:
+        model_key = _whisper_key(current_user, model, compute_type)
+        # Reject before reading and decoding the upload; submit() checks again
+        transcription_jobs.check_capacity(current_user["id"])
+        audio_bytes = await _read_audio_upload(request)
+        with stage_timer("transcribe", "decode"):
+            audio = await run_in_threadpool(decode_audio_bytes, audio_bytes)
+        return transcription_jobs.submit(
+            current_user["id"], audio,
+            lambda audio, on_progress: transcribe_recording(audio, on_progress, model_key)
+        )
+    except HTTPException:
+        raise
     except Exception as e:
+        logger.exception("create_transcription_job failed")
         raise HTTPException(status_code=500, detail=f"Transcription error: {str(e)}")
 
+@app.get("/api/voice/transcriptions/{job_id}")
+async def get_transcription_job(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Status, progress (0-1, by chunk) and, once done, the result of a transcription job"""
+    job = await run_in_threadpool(transcription_jobs.get, job_id, current_user["id"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Transcription job not found")
+    return job
+
 @app.post("/api/query", response_model=QueryResponse)
 async def query_dental_assistant(request: QueryRequest, current_user: Optional[dict] = Depends(get_current_user) if hasattr(get_current_user, '__call__') else None):
     """
@@ -1032,106 +1497,139 @@ async def query_dental_assistant(request: QueryRequest, current_user: Optional[d
     try:
         # Check if this is a conversation-ending message
         if is_conversation_ending(request.query):
-            closing_response = "You're welcome! Is there anything else you'd like to know?"
-            
-            # Log to database if user is authenticated
-            if current_user:
-                try:
-                    conn = get_db_connection()
-                    cur = conn.cursor()
-                    cur.execute(
-                        """INSERT INTO dental_queries (user_id, query, response, model_provider)
-                           VALUES (%s, %s, %s, %s)""",
-                        (current_user["id"], request.query, closing_response, "ollama")
-                    )
-                    conn.commit()
-                    cur.close()
-                    conn.close()
-                except Exception as e:
-                    print(f"Error logging query: {e}")
-            
+            closing_response = CLOSING_RESPONSE
+            user_id = current_user["id"] if current_user else None
+            query_id = await run_in_threadpool(
+                query_logger.log, user_id, request.patient_id, request.query, closing_response, []
+            )
             return QueryResponse(
-                query=request.query,
                 answer=closing_response,
                 sources=[],
-                model_provider="ollama"
+                query_id=query_id
             )
         
         model_provider = request.model_provider or "ollama"
-        print(f"[DEBUG] Using model provider: {model_provider}")
+        logger.debug("Using model provider: %s", model_provider)
 
         # 1. Generate embedding for the query
-        query_embedding = get_embedding(request.query, model_provider)
-        print(f"[DEBUG] Got embedding, dimension: {len(query_embedding)}")
+        with stage_timer("query", "embedding", provider_label(model_provider), provider_model(model_provider, "embed")):
+            query_embedding = await embed_query(request.query, model_provider)
+        logger.debug("Got embedding, dimension: %d", len(query_embedding))
 
         # 2. Search Pinecone for relevant context
-        search_results = index.query(
-            vector=query_embedding,
-            top_k=5,
-            include_metadata=True
-        )
-        print(f"[DEBUG] Pinecone query returned {len(search_results.matches)} matches")
+        with stage_timer("query", "retrieval", provider_label(model_provider)):
+            search_results = await retrieve_context(request.query, query_embedding, model_provider)
+        logger.debug("Pinecone query returned %d matches", len(search_results.matches))
 
         # 3. Build context from retrieved documents
-        context_chunks = []
-        sources = []
-        for match in search_results.matches:
-            chunk_text = match.metadata.get('text', '')
-            context_chunks.append(chunk_text)
-            sources.append({
-                "text": chunk_text[:200] + "..." if len(chunk_text) > 200 else chunk_text,
-                "score": match.score,
-                "metadata": match.metadata
-            })
-
-        context = "\n\n".join(context_chunks)
+        context, sources = build_context(search_results.matches)
 
         # 4. Generate answer using the selected LLM
-        prompt = f"""You are a dental assistant AI. Answer the following question based on the provided dental guidelines and clinical knowledge.
-
-Dental Guidelines Context:
-{context}
-
-Question: {request.query}
-
-IMPORTANT: Provide a clear, concise, and clinically accurate answer.
-- If the context contains relevant information, use it and cite which parts of the guidelines you're referencing.
-- If the context doesn't contain enough information, still provide a helpful general answer based on your dental knowledge and best practices. Don't just say "I don't have information" - be helpful and provide practical guidance.
-- Always be professional, empathetic, and clinically sound in your responses."""
-
-        answer = generate_llm_response(prompt, model_provider)
-        print(f"[DEBUG] Got response from {model_provider}, length: {len(answer)}")
-
-        # 5. Log to PostgreSQL
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=RealDictCursor)
-        user_id = current_user["id"] if current_user else None
-        cur.execute(
-            """INSERT INTO dental_queries (user_id, patient_id, query_text, ai_response, source_docs, created_at)
-               VALUES (%s, %s, %s, %s, %s, %s) RETURNING id""",
-            (user_id, request.patient_id, request.query, answer, json.dumps(sources), datetime.now())
-        )
-        result = cur.fetchone()
-        query_id = result['id'] if result else None
-        conn.commit()
-        cur.close()
-        conn.close()
+        prompt = build_query_prompt(request.query, context)
+
+        with stage_timer("query", "generation", provider_label(model_provider), provider_model(model_provider, "generate")):
+            answer, answered_by = await generate_answer(prompt, model_provider, allow_fallback=bool(request.allow_fallback))
+        logger.debug("Got response from %s, length: %d", answered_by, len(answer))
+
+        # 5. Log to PostgreSQL (buffered; the id is preallocated so we don't wait on the write)
+        with stage_timer("query", "persist"):
+            user_id = current_user["id"] if current_user else None
+            # Usually instant; only waits on Postgres when the id block has run out while it is up
+            query_id = await run_in_threadpool(
+                query_logger.log, user_id, request.patient_id, request.query, answer, sources
+            )
 
         return QueryResponse(
             answer=answer,
             sources=sources,
+            provider=answered_by,
             query_id=query_id
         )
 
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in query_dental_assistant: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("query_dental_assistant failed")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+@app.post("/api/query/batch")
+async def query_dental_assistant_batch(request: BatchQueryRequest, current_user: dict = Depends(get_current_user)):
+    """
+    Answer many questions in one call, for audit replays.
+
+    All questions are embedded up front in one batched call, retrievals run
+    concurrently, and generations are limited to PROVIDER_CONCURRENCY per
+    provider. Results stream back as NDJSON in completion order:
+    - {"type": "result", "index", "query", "answer", "sources", "provider", "query_id"} or {"type": "error", "index", "query", "error"}
+    - {"type": "summary", "total", "failed", "duration_ms"} last
+    Rows reach dental_queries through the bulk write-behind logger.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="queries must not be empty")
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+
+    model_provider = request.model_provider or "ollama"
+    allow_fallback = bool(request.allow_fallback)
+    user_id = current_user["id"]
+    started = time.perf_counter()
+
+    # Closing phrases get the canned reply and skip the pipeline, as in /api/query
+    to_embed = [i for i, query in enumerate(request.queries) if not is_conversation_ending(query)]
+    with stage_timer("query_batch", "embedding", provider_label(model_provider), provider_model(model_provider, "embed")):
+        embeddings = await run_in_threadpool(
+            cached_embeddings, [request.queries[i] for i in to_embed], model_provider
+        )
+    embedding_by_index = dict(zip(to_embed, embeddings))
+
+    async def answer_one(index: int, query: str):
+        if index not in embedding_by_index:
+            return {"type": "result", "index": index, "query": query, "answer": CLOSING_RESPONSE, "sources": []}
+        with stage_timer("query_batch", "retrieval", provider_label(model_provider)):
+            search_results = await retrieve_context(query, embedding_by_index[index], model_provider)
+        context, sources = build_context(search_results.matches)
+        prompt = build_query_prompt(query, context)
+        async with provider_limiter.limit(model_provider):
+            with stage_timer("query_batch", "generation", provider_label(model_provider), provider_model(model_provider, "generate")):
+                answer, answered_by = await generate_answer(prompt, model_provider, allow_fallback=allow_fallback)
+        return {"type": "result", "index": index, "query": query, "answer": answer, "sources": sources,
+                "provider": answered_by}
+
+    async def run_one(index: int, query: str):
+        try:
+            return await answer_one(index, query)
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            logger.warning("Batch query %d failed: %s", index, detail)
+            return {"type": "error", "index": index, "query": query, "error": detail}
+
+    async def stream():
+        tasks = [asyncio.ensure_future(run_one(i, query)) for i, query in enumerate(request.queries)]
+        failed = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item = await next_done
+                if item["type"] == "error":
+                    failed += 1
+                else:
+                    item["query_id"] = await run_in_threadpool(
+                        query_logger.log, user_id, request.patient_id, item["query"],
+                        item["answer"], item["sources"]
+                    )
+                yield dumps_json(item) + b"\n"
+            yield dumps_json({
+                "type": "summary",
+                "total": len(request.queries),
+                "failed": failed,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            }) + b"\n"
+        finally:
+            # Client went away: stop scheduling work nobody will read
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @app.post("/api/ingest")
 async def ingest_document(request: IngestRequest):
     """
@@ -1139,20 +1637,12 @@ async def ingest_document(request: IngestRequest):
     The text will be chunked and embedded.
     """
     try:
-        # Simple chunking (you can enhance this with RecursiveCharacterTextSplitter)
-        chunk_size = 1000
-        overlap = 200
-        chunks = []
-        start = 0
-        while start < len(request.text):
-            end = start + chunk_size
-            chunks.append(request.text[start:end])
-            start = end - overlap
+        chunks = chunk_text(request.text)
         
         vectors = []
         for i, chunk in enumerate(chunks):
             # Generate embedding using Ollama
-            embedding_response = ollama.embeddings(
+            embedding_response = ollama_pool.embeddings(
                 model=OLLAMA_EMBEDDING_MODEL,
                 prompt=chunk
             )
@@ -1169,15 +1659,12 @@ async def ingest_document(request: IngestRequest):
             vectors.append((vector_id, embedding, metadata))
         
         # Upsert to Pinecone
-        index.upsert(vectors=vectors)
+        pinecone_index.get().upsert(vectors=vectors)
         
         return {"message": f"Successfully ingested {len(chunks)} chunks", "chunks": len(chunks)}
     
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in ingest_document: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("ingest_document failed")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.post("/api/upload-document")
@@ -1242,19 +1729,12 @@ async def upload_document(file: UploadFile = File(...), title: Optional[str] = N
             raise HTTPException(status_code=400, detail="No text content extracted from file")
         
         # Chunk and ingest
-        chunk_size = 1000
-        overlap = 200
-        chunks = []
-        start = 0
-        while start < len(text_content):
-            end = start + chunk_size
-            chunks.append(text_content[start:end])
-            start = end - overlap
+        chunks = chunk_text(text_content)
         
         vectors = []
         for i, chunk in enumerate(chunks):
             # Generate embedding using Ollama
-            embedding_response = ollama.embeddings(
+            embedding_response = ollama_pool.embeddings(
                 model=OLLAMA_EMBEDDING_MODEL,
                 prompt=chunk
             )
@@ -1275,7 +1755,7 @@ async def upload_document(file: UploadFile = File(...), title: Optional[str] = N
         batch_size = 100
         for i in range(0, len(vectors), batch_size):
             batch = vectors[i:i + batch_size]
-            index.upsert(vectors=batch)
+            pinecone_index.get().upsert(vectors=batch)
         
         return {
             "message": f"Successfully uploaded and ingested {file.filename}",
@@ -1286,17 +1766,20 @@ async def upload_document(file: UploadFile = File(...), title: Optional[str] = N
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in upload_document: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("upload_document failed")
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+ALLOWED_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.dicom', '.dcm']
+
 @app.post("/api/upload-image")
-async def upload_image(file: UploadFile = File(...), patient_id: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+async def upload_image(file: UploadFile = File(...), patient_id: Optional[str] = None, return_data: bool = True,
+                       current_user: dict = Depends(get_current_user)):
     """
-    Upload an image (X-ray, medical image) and return base64 encoded data for vision analysis.
-    Optionally link to a patient.
+    Upload an image (X-ray, medical image) for vision analysis. Optionally link to a patient.
+
+    The image is stored as a patient document; pass the returned document_id
+    as image_id to /api/chats/{chat_id}/messages. With return_data=false the
+    base64 copy of the image is left out of the response.
     """
     try:
         # Read file content
@@ -1304,22 +1787,23 @@ async def upload_image(file: UploadFile = File(...), patient_id: Optional[str] =
         file_extension = os.path.splitext(file.filename)[1].lower()
         
         # Check if it's an image file
-        allowed_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.bmp', '.dicom', '.dcm']
-        if file_extension not in allowed_extensions:
+        if file_extension not in ALLOWED_IMAGE_EXTENSIONS:
             raise HTTPException(
                 status_code=400,
-                detail=f"Unsupported image type: {file_extension}. Supported: {', '.join(allowed_extensions)}"
+                detail=f"Unsupported image type: {file_extension}. Supported: {', '.join(ALLOWED_IMAGE_EXTENSIONS)}"
             )
         
-        # Convert to base64
-        image_base64 = base64.b64encode(contents).decode('utf-8')
+        # DICOM is decoded once here; vision models get the windowed JPEG, not the raw file
+        dicom_image = None
+        if file_extension in DICOM_EXTENSIONS:
+            dicom_image = await run_in_threadpool(decode_dicom, contents)
         
-        # Optionally save to patient_documents table if patient_id is provided
-        if patient_id:
-            try:
-                conn = get_db_connection()
-                cur = conn.cursor(cursor_factory=RealDictCursor)
-                
+        # Save to patient_documents so chat messages can reference it by id
+        conn = get_db_connection()
+        try:
+            cur = conn.cursor(cursor_factory=RealDictCursor)
+            
+            if patient_id:
                 # Verify patient belongs to user
                 cur.execute(
                     "SELECT user_id FROM patients WHERE id = %s",
@@ -1328,97 +1812,199 @@ async def upload_image(file: UploadFile = File(...), patient_id: Optional[str] =
                 patient = cur.fetchone()
                 if not patient or patient["user_id"] != current_user["id"]:
                     raise HTTPException(status_code=403, detail="Patient not found or access denied")
-                
-                # Save to patient_documents
-                cur.execute(
-                    """INSERT INTO patient_documents (patient_id, user_id, document_type, file_name, file_data, created_at)
-                       VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-                       RETURNING id""",
-                    (patient_id, current_user["id"], "xray", file.filename, contents)
-                )
-                doc_result = cur.fetchone()
-                conn.commit()
-                cur.close()
-                conn.close()
-                print(f"[DEBUG] Saved image to patient_documents: {doc_result['id']}")
-            except HTTPException:
-                raise
-            except Exception as e:
-                print(f"[WARNING] Could not save to patient_documents: {str(e)}")
-                # Continue anyway - image is still encoded and can be used
+            
+            cur.execute(
+                """INSERT INTO patient_documents (patient_id, user_id, document_type, file_name, file_size, file_data, created_at)
+                   VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                   RETURNING id""",
+                (patient_id or None, current_user["id"], "xray", file.filename, len(contents), contents)
+            )
+            doc_result = cur.fetchone()
+            if dicom_image:
+                save_dicom(cur, doc_result["id"], dicom_image)
+            conn.commit()
+            document_id = doc_result["id"]
+            cur.close()
+        finally:
+            conn.close()
+        logger.debug("Saved image to patient_documents: %s", document_id)
         
-        return {
+        image_base64 = None
+        if return_data:
+            image_base64 = base64.b64encode(dicom_image.vision_jpeg if dicom_image else contents).decode('utf-8')
+        
+        return json_response({
             "message": f"Successfully uploaded image: {file.filename}",
             "filename": file.filename,
-            "image_data": image_base64,  # Return base64 for frontend to use in queries
-            "patient_id": patient_id
-        }
+            "image_data": image_base64,
+            "patient_id": patient_id,
+            "document_id": document_id,
+            "image_url": document_image_url(document_id, file.filename),
+            "dicom": dicom_image.tags if dicom_image else None
+        })
     
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in upload_image: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("upload_image failed")
         raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
 
-@app.get("/api/patient-history/{patient_id}")
-async def get_patient_history(patient_id: str):
+QUERY_PAGE_MAX = 100
+QUERY_PREVIEW_CHARS = 200
+
+def _dental_query_page(filter_sql: str, params: dict, limit: int, cursor: Optional[str], preview: bool):
     """
-    Retrieve recent queries for a patient from PostgreSQL.
+    One page of dental_queries, newest first, keyed on (created_at, id).
+
+    In preview mode the question and answer are cut to QUERY_PREVIEW_CHARS
+    inside Postgres, so multi-KB answers never leave the database; fetch
+    the full row from /api/queries/{query_id}.
     """
+    params = dict(params, limit=clamp_limit(limit, 10, QUERY_PAGE_MAX) + 1, preview_chars=QUERY_PREVIEW_CHARS)
+    if preview:
+        columns = """LEFT(query_text, %(preview_chars)s) AS query_text,
+                     LEFT(ai_response, %(preview_chars)s) AS response_preview,
+                     (LENGTH(query_text) > %(preview_chars)s OR LENGTH(ai_response) > %(preview_chars)s) AS truncated"""
+    else:
+        columns = "query_text, ai_response"
+    after = ""
+    if cursor:
+        params["after_created_at"], params["after_id"] = decode_cursor(cursor, (datetime, int))
+        after = "AND (created_at, id) < (%(after_created_at)s::timestamp, %(after_id)s)"
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(
-            """SELECT id, query_text, ai_response, created_at 
-               FROM dental_queries 
-               WHERE patient_id = %s 
-               ORDER BY created_at DESC 
-               LIMIT 10""",
-            (patient_id,)
+            f"""SELECT id, patient_id, {columns}, created_at
+                FROM dental_queries
+                WHERE {filter_sql} {after}
+                ORDER BY created_at DESC, id DESC
+                LIMIT %(limit)s""",
+            params
         )
-        history = cur.fetchall()
+        rows = [dict(row) for row in cur.fetchall()]
         cur.close()
+    finally:
         conn.close()
-        
-        return {"history": [dict(row) for row in history]}
+    next_cursor = None
+    if len(rows) == params["limit"]:
+        rows.pop()
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+    return rows, next_cursor
+
+@app.get("/api/patient-history/{patient_id}")
+async def get_patient_history(patient_id: str, limit: int = 10, cursor: Optional[str] = None, preview: bool = False,
+                              current_user: dict = Depends(get_current_user)):
+    """
+    Retrieve the current user's queries for a patient, newest first.
+
+    Pages with next_cursor; preview=true returns truncated text only.
+    """
+    try:
+        history, next_cursor = await run_in_threadpool(
+            _dental_query_page, "patient_id = %(patient_id)s AND user_id = %(user_id)s",
+            {"patient_id": patient_id, "user_id": current_user["id"]}, limit, cursor, preview
+        )
+        return {"history": history, "next_cursor": next_cursor}
     
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in get_patient_history: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("get_patient_history failed")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 # Patient management endpoints
+PATIENT_PAGE_SIZE = 50
+PATIENT_PAGE_MAX = 200
+
 @app.get("/api/patients")
-async def get_patients(current_user: dict = Depends(get_current_user)):
-    """Get all patients for the current user, sorted A-Z by name"""
+async def get_patients(response: Response, q: Optional[str] = None, limit: int = PATIENT_PAGE_SIZE,
+                       cursor: Optional[str] = None, if_none_match: Optional[str] = Header(None),
+                       current_user: dict = Depends(get_current_user)):
+    """
+    List the current user's patients A-Z by name, one page at a time.
+
+    With q, only patients whose name, ID, email or phone contains q are
+    returned (prefix matches on name/ID first), plus near misses on the
+    name via pg_trgm similarity. Pass next_cursor back as cursor for the
+    next page; it is null on the last page. Sends a weak ETag; a matching
+    If-None-Match gets 304 without running the search.
+    """
+    limit = clamp_limit(limit, PATIENT_PAGE_SIZE, PATIENT_PAGE_MAX)
+    q = (q or "").strip().lower()
+    params = {"user_id": current_user["id"], "limit": limit + 1}
+    if q:
+        escaped = escape_like(q)
+        params.update(q=q, prefix=f"{escaped}%", contains=f"%{escaped}%")
+        # Every branch is served by a trigram GIN index (see scripts/add_patient_search_indexes.sql)
+        match_rank = """CASE WHEN LOWER(name) LIKE %(prefix)s OR LOWER(id) LIKE %(prefix)s THEN 0
+                             WHEN LOWER(name) LIKE %(contains)s OR LOWER(id) LIKE %(contains)s
+                                  OR LOWER(email) LIKE %(contains)s OR LOWER(phone) LIKE %(contains)s THEN 1
+                             ELSE 2 END"""
+        search_filter = """AND (LOWER(name) LIKE %(contains)s OR LOWER(id) LIKE %(contains)s
+                                OR LOWER(email) LIKE %(contains)s OR LOWER(phone) LIKE %(contains)s
+                                OR LOWER(name) %% %(q)s)"""
+    else:
+        match_rank = "0"
+        search_filter = ""
+    after = ""
+    if cursor:
+        params["after_rank"], params["after_name"], params["after_id"] = decode_cursor(cursor, (int, str, str))
+        if q:
+            after = "WHERE (match_rank, sort_name, id) > (%(after_rank)s, %(after_name)s, %(after_id)s)"
+        else:
+            # Without a search every rank is 0; keep the keyset on the indexed columns
+            # so it walks idx_patients_user_name directly
+            search_filter = "AND (LOWER(name), id) > (%(after_name)s, %(after_id)s)"
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
-        
+        # Index-only on idx_patients_user_updated
         cur.execute(
-            """SELECT id, name, email, phone, date_of_birth, gender, summary, created_at
-               FROM patients
-               WHERE user_id = %s
-               ORDER BY LOWER(name) ASC""",
+            """SELECT COUNT(*) AS patient_count, MAX(updated_at) AS last_updated
+               FROM patients WHERE user_id = %s""",
             (current_user["id"],)
         )
-        patients = cur.fetchall()
+        version = cur.fetchone()
+        etag = make_etag("patients", current_user["id"], q, limit, cursor,
+                         version["patient_count"], version["last_updated"])
+        if etag_matches(if_none_match, etag):
+            cur.close()
+            conn.close()
+            return not_modified(etag)
+        response.headers.update(etag_headers(etag))
+        cur.execute(
+            f"""SELECT * FROM (
+                   SELECT id, name, email, phone, date_of_birth, gender, summary, created_at,
+                          LOWER(name) AS sort_name, {match_rank} AS match_rank
+                   FROM patients
+                   WHERE user_id = %(user_id)s {search_filter}
+               ) p
+               {after}
+               ORDER BY match_rank, sort_name, id
+               LIMIT %(limit)s""",
+            params
+        )
+        rows = cur.fetchall()
         cur.close()
         conn.close()
-        
-        return {"patients": [dict(row) for row in patients]}
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in get_patients: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("get_patients failed")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last["match_rank"], last["sort_name"], last["id"])
+    patients = []
+    for row in rows:
+        patient = dict(row)
+        patient.pop("sort_name")
+        patient.pop("match_rank")
+        patients.append(patient)
+    return {"patients": patients, "next_cursor": next_cursor}
+
 @app.get("/api/patients/{patient_id}")
 async def get_patient(patient_id: str, current_user: dict = Depends(get_current_user)):
     """Get patient details by ID"""
@@ -1442,10 +2028,7 @@ async def get_patient(patient_id: str, current_user: dict = Depends(get_current_
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in get_patient: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("get_patient failed")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.post("/api/patients")
@@ -1482,10 +2065,7 @@ async def create_patient(request: PatientCreateRequest, current_user: dict = Dep
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in create_patient: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("create_patient failed")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.patch("/api/patients/{patient_id}")
@@ -1559,15 +2139,16 @@ async def update_patient(patient_id: str, request: PatientUpdateRequest, current
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in update_patient: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("update_patient failed")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
 @app.get("/api/patients/{patient_id}/chats")
-async def get_patient_chats(patient_id: str, current_user: dict = Depends(get_current_user)):
-    """Get all chats for a specific patient"""
+async def get_patient_chats(patient_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+                            current_user: dict = Depends(get_current_user)):
+    """Get all chats for a specific patient.
+
+    Sends a weak ETag; a matching If-None-Match gets 304 without listing the chats.
+    """
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
@@ -1581,6 +2162,20 @@ async def get_patient_chats(patient_id: str, current_user: dict = Depends(get_cu
         if not patient or patient["user_id"] != current_user["id"]:
             raise HTTPException(status_code=403, detail="Patient not found or access denied")
         
+        cur.execute(
+            """SELECT COUNT(*) AS chat_count, MAX(updated_at) AS last_updated
+               FROM chats
+               WHERE patient_id = %s AND user_id = %s""",
+            (patient_id, current_user["id"])
+        )
+        version = cur.fetchone()
+        etag = make_etag("patient_chats", current_user["id"], patient_id, version["chat_count"], version["last_updated"])
+        if etag_matches(if_none_match, etag):
+            cur.close()
+            conn.close()
+            return not_modified(etag)
+        response.headers.update(etag_headers(etag))
+        
         cur.execute(
             """SELECT id, title, is_favorite, created_at, updated_at
                FROM chats
@@ -1596,40 +2191,350 @@ async def get_patient_chats(patient_id: str, current_user: dict = Depends(get_cu
     except HTTPException:
         raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"ERROR in get_patient_chats: {str(e)}")
-        print(f"Full traceback:\n{error_details}")
+        logger.exception("get_patient_chats failed")
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
-@app.get("/api/recent-queries")
-async def get_recent_queries(limit: int = 10):
+@app.get("/api/patients/{patient_id}/documents")
+async def get_patient_documents(patient_id: str, current_user: dict = Depends(get_current_user)):
+    """List a patient's documents (metadata only; download each from /api/documents/{id}/download)"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        
+        # Verify patient belongs to user
+        cur.execute(
+            "SELECT user_id FROM patients WHERE id = %s",
+            (patient_id,)
+        )
+        patient = cur.fetchone()
+        if not patient or patient["user_id"] != current_user["id"]:
+            raise HTTPException(status_code=403, detail="Patient not found or access denied")
+        
+        # octet_length() reads the TOAST header only, not the file
+        cur.execute(
+            """SELECT id, document_type, file_name, description,
+                      COALESCE(file_size, octet_length(file_data)) AS file_size, created_at
+               FROM patient_documents
+               WHERE patient_id = %s AND user_id = %s
+               ORDER BY created_at DESC, id DESC""",
+            (patient_id, current_user["id"])
+        )
+        documents = cur.fetchall()
+        cur.close()
+        conn.close()
+        
+        return {"documents": [dict(row) for row in documents]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("get_patient_documents failed")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.get("/api/documents/{document_id}/download")
+async def download_document(document_id: int, range_header: Optional[str] = Header(None, alias="Range"),
+                            if_range: Optional[str] = Header(None), if_none_match: Optional[str] = Header(None),
+                            current_user: dict = Depends(get_current_user)):
     """
-    Get recent queries across all patients.
+    Stream a document's bytes in chunks, from file_data or the file store.
+
+    Supports a single `Range: bytes=...` (206 Partial Content), If-Range
+    and If-None-Match. Documents never change once uploaded, so the ETag
+    is strong and responses may be cached privately.
     """
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=RealDictCursor)
         cur.execute(
-            """SELECT id, patient_id, query_text, ai_response, created_at 
-               FROM dental_queries 
-               ORDER BY created_at DESC 
-               LIMIT %s""",
-            (limit,)
+            """SELECT id, file_name, file_path, file_data IS NOT NULL AS in_db,
+                      COALESCE(file_size, octet_length(file_data)) AS file_size
+               FROM patient_documents
+               WHERE id = %s AND user_id = %s""",
+            (document_id, current_user["id"])
+        )
+        document = cur.fetchone()
+        cur.close()
+        conn.close()
+    except Exception as e:
+        logger.exception("download_document failed")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    if document["in_db"]:
+        size = document["file_size"]
+    elif document["file_path"] and os.path.isfile(document["file_path"]):
+        size = os.path.getsize(document["file_path"])
+    else:
+        raise HTTPException(status_code=404, detail="Document has no stored content")
+
+    etag = f'"doc-{document_id}-{size}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=86400",
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": content_disposition(document["file_name"]),
+    }
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    status_code = 200
+    start, end = 0, size - 1
+    byte_range = parse_range(range_header, size) if not if_range or if_range.strip() == etag else None
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(max(end - start + 1, 0))
+
+    if size == 0:
+        chunks = iter(())
+    elif document["in_db"]:
+        chunks = iter_db_bytes(get_db_connection, document_id, start, end)
+    else:
+        chunks = iter_file_bytes(document["file_path"], start, end)
+    # A sync iterator: Starlette pulls each chunk in the threadpool
+    return StreamingResponse(chunks, status_code=status_code, media_type=content_type_for(document["file_name"]),
+                             headers=headers)
+
+@app.get("/api/documents/{document_id}/preview")
+async def get_document_preview(document_id: int, kind: str = "preview", window_center: Optional[float] = None,
+                               window_width: Optional[float] = None, if_none_match: Optional[str] = Header(None),
+                               current_user: dict = Depends(get_current_user)):
+    """
+    Decoded image of a DICOM document.
+
+    kind is "preview" (PNG) or "vision" (the JPEG sent to vision models).
+    Both are cached in document_derivatives, and built on first request for
+    files uploaded before decoding existed. window_center/window_width
+    re-window the original on the fly (not cached).
+    """
+    if kind not in DERIVATIVE_TYPES:
+        raise HTTPException(status_code=400, detail=f"kind must be one of: {', '.join(DERIVATIVE_TYPES)}")
+    custom_window = window_center is not None and window_width is not None
+    if custom_window and window_width <= 0:
+        raise HTTPException(status_code=400, detail="window_width must be positive")
+    etag = f'"doc-{document_id}-{kind}-{window_center}-{window_width}"' if custom_window else f'"doc-{document_id}-{kind}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=86400"}
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            """SELECT p.file_name, d.document_id IS NOT NULL AS has_derivative
+               FROM patient_documents p
+               LEFT JOIN document_derivatives d ON d.document_id = p.id AND d.kind = %s
+               WHERE p.id = %s AND p.user_id = %s""",
+            (kind, document_id, current_user["id"])
+        )
+        document = cur.fetchone()
+        if not document:
+            cur.close()
+            conn.close()
+            raise HTTPException(status_code=404, detail="Document not found")
+        if etag_matches(if_none_match, etag):
+            cur.close()
+            conn.close()
+            return Response(status_code=304, headers=headers)
+        if document["has_derivative"] and not custom_window:
+            # The bytes are only loaded once the ETag has missed
+            cur.execute(
+                "SELECT file_data FROM document_derivatives WHERE document_id = %s AND kind = %s",
+                (document_id, kind)
+            )
+            derivative = cur.fetchone()
+            cur.close()
+            conn.close()
+            if derivative is None:
+                raise HTTPException(status_code=404, detail="Document not found")
+            return Response(content=bytes(derivative["file_data"]), media_type=DERIVATIVE_TYPES[kind], headers=headers)
+        if os.path.splitext(document["file_name"])[1].lower() not in DICOM_EXTENSIONS:
+            cur.close()
+            conn.close()
+            raise HTTPException(status_code=404, detail="Only DICOM documents have decoded previews")
+
+        cur.execute("SELECT file_data FROM patient_documents WHERE id = %s", (document_id,))
+        original = cur.fetchone()["file_data"]
+        if original is None:
+            cur.close()
+            conn.close()
+            raise HTTPException(status_code=404, detail="Document has no stored content")
+        image = await run_in_threadpool(decode_dicom, bytes(original), window_center, window_width)
+        if not custom_window:
+            save_dicom(cur, document_id, image)
+            conn.commit()
+        cur.close()
+        conn.close()
+        payload = image.preview_png if kind == "preview" else image.vision_jpeg
+        return Response(content=payload, media_type=DERIVATIVE_TYPES[kind], headers=headers)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("get_document_preview failed")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.get("/api/documents/{document_id}/dicom")
+async def get_document_dicom_tags(document_id: int, current_user: dict = Depends(get_current_user)):
+    """Technical DICOM tags extracted from a document at upload"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            """SELECT t.document_id, t.modality, t.body_part, t.study_date, t.width, t.height,
+                      t.window_center, t.window_width, t.tags
+               FROM dicom_tags t
+               JOIN patient_documents p ON p.id = t.document_id
+               WHERE t.document_id = %s AND p.user_id = %s""",
+            (document_id, current_user["id"])
         )
-        queries = cur.fetchall()
+        tags = cur.fetchone()
         cur.close()
         conn.close()
         
-        return {"queries": [dict(row) for row in queries]}
+        if not tags:
+            raise HTTPException(status_code=404, detail="No DICOM tags for this document")
+        
+        return dict(tags)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("get_document_dicom_tags failed")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+@app.get("/api/recent-queries")
+async def get_recent_queries(limit: int = 10, cursor: Optional[str] = None, preview: bool = False,
+                             current_user: dict = Depends(get_current_user)):
+    """
+    Get the current user's recent queries across all patients.
+
+    Pages with next_cursor; preview=true returns truncated text only.
+    """
+    try:
+        queries, next_cursor = await run_in_threadpool(
+            _dental_query_page, "user_id = %(user_id)s", {"user_id": current_user["id"]}, limit, cursor, preview
+        )
+        return {"queries": queries, "next_cursor": next_cursor}
     
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        error_details = traceback.format_exc()
-        print(f"Error in get_recent_queries: {str(e)}")
-        print(f"Traceback: {error_details}")
+        logger.exception("get_recent_queries failed")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/queries/{query_id}")
+async def get_query(query_id: int, current_user: dict = Depends(get_current_user)):
+    """Get one logged query with its full answer and sources"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        cur.execute(
+            """SELECT id, patient_id, query_text, ai_response, source_docs, created_at
+               FROM dental_queries
+               WHERE id = %s AND user_id = %s""",
+            (query_id, current_user["id"])
+        )
+        query = cur.fetchone()
+        cur.close()
+        conn.close()
+        
+        if not query:
+            raise HTTPException(status_code=404, detail="Query not found")
+        
+        return dict(query)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.exception("get_query failed")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
+SEARCH_HEADLINE_OPTIONS = "MaxFragments=2, MaxWords=20, MinWords=8, StartSel=<mark>, StopSel=</mark>"
+# Message and answer text is user/model controlled: escape it before ts_headline
+# adds the <mark> tags, so the snippet is safe to render as HTML
+SEARCH_HEADLINE_BODY = "replace(replace(replace(page.body, '&', '&amp;'), '<', '&lt;'), '>', '&gt;')"
+
+@app.get("/api/search")
+async def search_history(q: str, patient_id: Optional[str] = None, source: str = "all",
+                         limit: int = 20, offset: int = 0, current_user: dict = Depends(get_current_user)):
+    """
+    Full-text search over the user's chat messages and logged queries.
+
+    source is "all", "chats" or "queries". Results are ranked with ts_rank_cd
+    on the GIN-indexed tsvector columns; snippet is an HTML ts_headline
+    excerpt: the text is escaped and matches are wrapped in <mark>.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="q must not be empty")
+    if source not in ("all", "chats", "queries"):
+        raise HTTPException(status_code=400, detail="source must be 'all', 'chats' or 'queries'")
+    limit = max(1, min(limit, 50))
+    offset = max(0, offset)
+    try:
+        params = {"q": q, "user_id": current_user["id"], "patient_id": patient_id,
+                  "window": limit + offset, "limit": limit, "offset": offset}
+        patient_filter_chats = "AND c.patient_id = %(patient_id)s" if patient_id else ""
+        patient_filter_queries = "AND d.patient_id = %(patient_id)s" if patient_id else ""
+        branches = []
+        if source in ("all", "chats"):
+            branches.append(f"""(
+                SELECT 'chat_message' AS source, m.id, m.chat_id, c.title AS chat_title, c.patient_id,
+                       m.message_type, m.content AS body, m.created_at,
+                       ts_rank_cd(m.content_tsv, query.tsq) AS rank
+                FROM chat_messages m
+                JOIN chats c ON c.id = m.chat_id, query
+                WHERE m.content_tsv @@ query.tsq AND c.user_id = %(user_id)s {patient_filter_chats}
+                ORDER BY rank DESC, m.created_at DESC
+                LIMIT %(window)s
+            )""")
+        if source in ("all", "queries"):
+            branches.append(f"""(
+                SELECT 'query' AS source, d.id, NULL::integer AS chat_id, NULL AS chat_title, d.patient_id,
+                       NULL AS message_type, d.query_text || E'\n\n' || d.ai_response AS body, d.created_at,
+                       ts_rank_cd(d.search_tsv, query.tsq) AS rank
+                FROM dental_queries d, query
+                WHERE d.search_tsv @@ query.tsq AND d.user_id = %(user_id)s {patient_filter_queries}
+                ORDER BY rank DESC, d.created_at DESC
+                LIMIT %(window)s
+            )""")
+
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
+        # ts_headline is the expensive part, so it only runs on the page being returned
+        cur.execute(
+            f"""WITH query AS (SELECT websearch_to_tsquery('english', %(q)s) AS tsq),
+               hits AS ({" UNION ALL ".join(branches)}),
+               page AS (
+                   SELECT * FROM hits
+                   ORDER BY rank DESC, created_at DESC
+                   LIMIT %(limit)s OFFSET %(offset)s
+               )
+               SELECT page.source, page.id, page.chat_id, page.chat_title, page.patient_id,
+                      page.message_type, page.created_at, page.rank,
+                      ts_headline('english', {SEARCH_HEADLINE_BODY}, query.tsq, '{SEARCH_HEADLINE_OPTIONS}') AS snippet
+               FROM page, query
+               ORDER BY page.rank DESC, page.created_at DESC""",
+            params
+        )
+        results = cur.fetchall()
+        cur.close()
+        conn.close()
+
+        return {
+            "results": [dict(row) for row in results],
+            "limit": limit,
+            "offset": offset,
+            "next_offset": offset + limit if len(results) == limit else None
+        }
+    except Exception as e:
+        logger.exception("search_history failed")
+        raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # WEB_CONCURRENCY > 1 serves from one process per core. Each worker imports
+    # this module and runs the lifespan hook on its own; point CACHE_URL at Redis
+    # so embeddings, answers and users are shared between them.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    if workers > 1:
+        if not is_shared_url(cache_url()):
+            logger.warning("WEB_CONCURRENCY=%d with an in-process cache: each worker caches separately", workers)
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=workers,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
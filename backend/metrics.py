@@ -0,0 +1,224 @@
+"""
+Prometheus-format metrics for DentalGPT.
+
+Per-stage latency histograms for the RAG pipeline, request totals and
+in-flight gauges, plus a Server-Timing header summarizing where each
+request spent its time.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+import threading
+import time
+
+# Seconds. LLM generations on CPU routinely take tens of seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Stage timings of the current request, for the Server-Timing header
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = [
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in labels
+    ]
+    return "{" + ",".join(escaped) + "}"
+
+
+def _label_key(labels: dict) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for key, series in self._series.items():
+                for i, upper in enumerate(self.buckets):
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', str(upper)),))} {series[i]}")
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', '+Inf'),))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        """Callback returning extra exposition lines computed at scrape time"""
+        self._collectors.append(collector)
+
+    def reset_after_fork(self):
+        """Start a forked worker from zero so the parent's samples aren't counted twice"""
+        for metric in self._metrics:
+            metric._lock = threading.Lock()
+            if isinstance(metric, Histogram):
+                metric._series = {}
+            else:
+                metric._values = {}
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            lines.extend(collector())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "dentalgpt_stage_duration_seconds",
+    "Time spent in each stage of the RAG pipeline"
+))
+HTTP_REQUESTS = registry.register(Counter(
+    "dentalgpt_http_requests_total",
+    "HTTP requests by handler, method and status"
+))
+HTTP_SECONDS = registry.register(Histogram(
+    "dentalgpt_http_request_duration_seconds",
+    "End-to-end HTTP request latency by handler"
+))
+HTTP_IN_FLIGHT = registry.register(Gauge(
+    "dentalgpt_http_requests_in_flight",
+    "HTTP requests currently being served"
+))
+STAGE_IN_FLIGHT = registry.register(Gauge(
+    "dentalgpt_stage_in_flight",
+    "Pipeline stages currently running, by stage and provider"
+))
+
+
+@contextmanager
+def stage_timer(endpoint: str, stage: str, provider: str = "", model: str = ""):
+    """Time one pipeline stage into the histogram and the Server-Timing header"""
+    labels = {"endpoint": endpoint, "stage": stage, "provider": provider, "model": model}
+    in_flight_labels = {"stage": stage, "provider": provider}
+    STAGE_IN_FLIGHT.inc(**in_flight_labels)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_IN_FLIGHT.dec(**in_flight_labels)
+        STAGE_SECONDS.observe(elapsed, **labels)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total: float) -> str:
+    # Repeated stages (e.g. two DB reads) are summed into one entry
+    merged: Dict[str, float] = {}
+    for stage, elapsed in timings:
+        merged[stage] = merged.get(stage, 0.0) + elapsed
+    parts = [f"{stage};dur={elapsed * 1000:.1f}" for stage, elapsed in merged.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: request totals, latency, in-flight gauge and Server-Timing"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings: List[Tuple[str, float]] = []
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                header = server_timing_header(timings, time.perf_counter() - started)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", header.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            _request_timings.reset(token)
+            # The router stores the matched endpoint in the scope; use its name
+            # rather than the raw path so ids don't explode label cardinality
+            endpoint = scope.get("endpoint")
+            handler = getattr(endpoint, "__name__", "unmatched")
+            HTTP_REQUESTS.inc(handler=handler, method=scope["method"], status=str(status["code"]))
+            HTTP_SECONDS.observe(time.perf_counter() - started, handler=handler)
@@ -0,0 +1,256 @@
+"""
+Multi-host Ollama pool for DentalGPT.
+
+Spreads chat, vision and embedding calls over several Ollama servers. Each
+host is health-checked, we remember which models it has pulled, and every
+call goes to the eligible host with the fewest requests in flight.
+
+Checks that fall due while serving a request run on a background thread
+with their own short timeout, so a slow or unreachable host never holds
+up the request that noticed it was stale.
+"""
+from typing import List, Optional
+import os
+import logging
+import threading
+import time
+
+logger = logging.getLogger("dentalgpt.ollama")
+
+OLLAMA_TIMEOUT = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+HEALTH_INTERVAL = float(os.getenv("OLLAMA_HEALTH_INTERVAL", "15"))
+HEALTH_TIMEOUT = float(os.getenv("OLLAMA_HEALTH_TIMEOUT", "3"))
+# How long Ollama keeps a model loaded after a call (e.g. "30m", "-1" for forever);
+# unset leaves Ollama's own default (5 minutes)
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE")
+
+
+def normalize_model_name(name: str) -> str:
+    """'llava' and 'llava:latest' name the same model"""
+    return name if ":" in name else f"{name}:latest"
+
+
+class OllamaHost:
+    def __init__(self, url: str, timeout: float = OLLAMA_TIMEOUT, health_timeout: float = HEALTH_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.health_timeout = health_timeout
+        self._client = None
+        self._health_client = None
+        self.outstanding = 0
+        self.healthy = True
+        self.models: Optional[set] = None  # None until the first health check
+        self.checking = False
+        self.last_checked = 0.0
+        self.last_error: Optional[str] = None
+
+    @property
+    def client(self):
+        # The SDK (and its HTTP stack) is imported on first use, not at startup
+        if self._client is None:
+            import ollama
+            self._client = ollama.Client(host=self.url, timeout=self.timeout)
+        return self._client
+
+    @property
+    def health_client(self):
+        # Separate client so a health check gives up long before a generation would
+        if self._health_client is None:
+            import ollama
+            self._health_client = ollama.Client(host=self.url, timeout=self.health_timeout)
+        return self._health_client
+
+    def has_model(self, model: str) -> bool:
+        # Unknown model list (never checked) counts as "maybe" so we still try it
+        return self.models is None or normalize_model_name(model) in self.models
+
+
+class OllamaPool:
+    """Least-outstanding-requests dispatch across healthy Ollama hosts"""
+
+    def __init__(self, urls: List[str], timeout: float = OLLAMA_TIMEOUT, keep_alive: Optional[str] = KEEP_ALIVE,
+                 health_timeout: float = HEALTH_TIMEOUT):
+        if not urls:
+            raise ValueError("At least one Ollama host is required")
+        self.hosts = [OllamaHost(url, timeout, health_timeout) for url in urls]
+        self.keep_alive = keep_alive
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "OllamaPool":
+        """Build from OLLAMA_BASE_URLS (comma separated), falling back to OLLAMA_BASE_URL"""
+        urls = os.getenv("OLLAMA_BASE_URLS") or os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+        return cls([url.strip() for url in urls.split(",") if url.strip()])
+
+    def _claim_check(self, host: OllamaHost, stale_only: bool) -> bool:
+        # One check per host at a time; the claim is taken before the slow call
+        with self._lock:
+            if host.checking or (stale_only and time.monotonic() - host.last_checked < HEALTH_INTERVAL):
+                return False
+            host.checking = True
+            return True
+
+    def _check(self, host: OllamaHost):
+        # Caller has claimed the host
+        try:
+            response = host.health_client.list()
+            models = {normalize_model_name(m["name"]) for m in response.get("models", [])}
+            with self._lock:
+                host.models = models
+                host.healthy = True
+                host.last_error = None
+        except Exception as e:
+            if host.healthy:
+                logger.warning("Ollama host %s failed its health check: %s", host.url, e)
+            with self._lock:
+                host.healthy = False
+                host.last_error = str(e)
+        finally:
+            with self._lock:
+                host.checking = False
+                host.last_checked = time.monotonic()
+
+    def check_host(self, host: OllamaHost):
+        """Refresh a host's health and the list of models it has pulled, unless a check is already running"""
+        if self._claim_check(host, stale_only=False):
+            self._check(host)
+
+    def check_all(self):
+        for host in self.hosts:
+            self.check_host(host)
+
+    def _refresh_stale(self):
+        """Start background checks of the hosts whose last check is older than HEALTH_INTERVAL"""
+        stale = [host for host in self.hosts if self._claim_check(host, stale_only=True)]
+        if stale:
+            threading.Thread(target=self._check_each, args=(stale,), name="ollama-health", daemon=True).start()
+
+    def _check_each(self, hosts: List[OllamaHost]):
+        for host in hosts:
+            self._check(host)
+
+    def _acquire(self, model: str, exclude: set) -> OllamaHost:
+        self._refresh_stale()
+        with self._lock:
+            candidates = [h for h in self.hosts if h.url not in exclude and h.healthy]
+            with_model = [h for h in candidates if h.has_model(model)]
+            # If no healthy host reports the model, still try one so the caller
+            # gets Ollama's own "model not found" error
+            pool = with_model or candidates
+            if not pool:
+                raise ConnectionError(f"No healthy Ollama host available for model '{model}'")
+            host = min(pool, key=lambda h: h.outstanding)
+            host.outstanding += 1
+            return host
+
+    def _release(self, host: OllamaHost):
+        with self._lock:
+            host.outstanding -= 1
+
+    def _dispatch(self, model: str, call):
+        from ollama import ResponseError
+        tried = set()
+        last_error: Optional[Exception] = None
+        while len(tried) < len(self.hosts):
+            try:
+                host = self._acquire(model, tried)
+            except ConnectionError as e:
+                if last_error is not None:
+                    raise last_error
+                raise e
+            tried.add(host.url)
+            try:
+                return call(host.client)
+            except ResponseError as e:
+                if e.status_code == 404 and host.models is not None:
+                    # Host lost the model (or never had it) - try another host
+                    with self._lock:
+                        host.models.discard(normalize_model_name(model))
+                    last_error = e
+                    continue
+                raise
+            except Exception as e:
+                # Connection refused, timeout, crashed runner: take the host out
+                # of rotation until its next health check
+                with self._lock:
+                    host.healthy = False
+                    host.last_error = str(e)
+                    host.last_checked = time.monotonic()
+                last_error = e
+            finally:
+                self._release(host)
+        raise last_error
+
+    def _with_keep_alive(self, kwargs: dict) -> dict:
+        if self.keep_alive is not None:
+            kwargs.setdefault("keep_alive", self.keep_alive)
+        return kwargs
+
+    def generate(self, model: str, prompt: str, **kwargs) -> dict:
+        kwargs = self._with_keep_alive(kwargs)
+        return self._dispatch(model, lambda client: client.generate(model=model, prompt=prompt, **kwargs))
+
+    def embeddings(self, model: str, prompt: str, **kwargs) -> dict:
+        kwargs = self._with_keep_alive(kwargs)
+        return self._dispatch(model, lambda client: client.embeddings(model=model, prompt=prompt, **kwargs))
+
+    def warm(self, model: str, embedding: bool = False) -> List[str]:
+        """Load a model into memory on every healthy host that has it.
+
+        An empty generate prompt makes Ollama load the model without producing
+        tokens. Returns the URLs of the hosts warmed; raises if none were.
+        """
+        self._refresh_stale()
+        kwargs = self._with_keep_alive({})
+        warmed, errors = [], []
+        for host in self.hosts:
+            if not host.healthy or not host.has_model(model):
+                continue
+            try:
+                if embedding:
+                    host.client.embeddings(model=model, prompt="warm-up", **kwargs)
+                else:
+                    host.client.generate(model=model, prompt="", **kwargs)
+                warmed.append(host.url)
+            except Exception as e:
+                errors.append(f"{host.url}: {e}")
+        if not warmed:
+            raise RuntimeError("; ".join(errors) or f"No healthy Ollama host has model '{model}'")
+        return warmed
+
+    def reset_after_fork(self):
+        """Give a forked worker its own HTTP clients and a clean slate"""
+        self._lock = threading.Lock()
+        for host in self.hosts:
+            host._client = None
+            host._health_client = None
+            host.outstanding = 0
+            host.checking = False  # the parent's check thread isn't in this process
+            host.last_checked = 0.0
+
+    def has_healthy_host(self) -> bool:
+        # Unchecked hosts count, so calls are tried before the first check finishes
+        with self._lock:
+            return any(host.healthy for host in self.hosts)
+
+    def has_verified_host(self) -> bool:
+        """A host has passed a health check (and not failed a call since); what readiness needs"""
+        with self._lock:
+            return any(host.healthy and host.models is not None for host in self.hosts)
+
+    def checked(self) -> bool:
+        with self._lock:
+            return any(host.models is not None or host.last_error is not None for host in self.hosts)
+
+    def status(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    "url": host.url,
+                    "healthy": host.healthy,
+                    "outstanding": host.outstanding,
+                    "models": sorted(host.models) if host.models is not None else None,
+                    "last_error": host.last_error,
+                }
+                for host in self.hosts
+            ]
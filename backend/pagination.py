@@ -0,0 +1,54 @@
+"""
+Opaque keyset cursors for paginated list endpoints.
+
+A cursor carries the sort key of the last row on a page; the next page
+starts strictly after it, so pages stay fast and stable however deep the
+client scrolls (no OFFSET scans, no skipped or repeated rows on inserts).
+"""
+from fastapi import HTTPException
+from datetime import date, datetime
+import base64
+import json
+
+
+def encode_cursor(*values) -> str:
+    """Encode the sort key of a page's last row"""
+    payload = [v.isoformat() if isinstance(v, (datetime, date)) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, types: tuple) -> list:
+    """Decode a cursor made by encode_cursor into values of the given types
+    (int, str, or datetime for ISO timestamps); raises HTTPException(400) if
+    it is malformed or doesn't match"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(types):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return [_cursor_value(value, expected) for value, expected in zip(values, types)]
+
+
+def _cursor_value(value, expected: type):
+    if expected is datetime:
+        try:
+            return datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    # bool is an int to isinstance, but never a valid sort key
+    if isinstance(value, bool) or not isinstance(value, expected):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value
+
+
+def clamp_limit(limit: int, default: int = 50, maximum: int = 200) -> int:
+    if limit is None:
+        return default
+    return max(1, min(limit, maximum))
+
+
+def escape_like(text: str) -> str:
+    """Escape LIKE wildcards so user input matches literally"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
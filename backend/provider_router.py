@@ -0,0 +1,308 @@
+"""
+Provider routing for DentalGPT.
+
+Tracks per-provider latency and error rates, opens a circuit breaker when a
+provider operation (embed, generate, vision) keeps failing, and (when the caller allows it) falls back to the
+fastest other healthy provider once the requested one has failed. The
+requested provider is always tried first while its breaker is closed:
+prompts carry patient records and X-rays, so they only leave the chosen
+(possibly local) provider when it can't answer.
+
+Only outages count against a breaker: connection errors, timeouts and 5xx
+responses (and GLM's out-of-quota reply). A missing model, a rejected
+request or a configuration error is the caller's problem and would fail
+the same way on the next try, so it is raised without touching the
+circuit that other operations and users share.
+"""
+from fastapi import HTTPException
+from collections import deque
+from typing import Callable, Dict, List, Optional
+import asyncio
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("dentalgpt.providers")
+
+FAILURE_THRESHOLD = int(os.getenv("PROVIDER_FAILURE_THRESHOLD", "3"))
+RESET_TIMEOUT = float(os.getenv("PROVIDER_RESET_TIMEOUT", "30"))
+STATS_WINDOW = int(os.getenv("PROVIDER_STATS_WINDOW", "200"))
+# Concurrent generations per provider for bulk work, e.g. "ollama=4,gemini=16,glm=8"
+PROVIDER_CONCURRENCY = os.getenv("PROVIDER_CONCURRENCY", "ollama=4,gemini=16,glm=8")
+DEFAULT_CONCURRENCY = 4
+
+# Error text that means the provider will not recover within a retry window
+# (GLM reports exhausted balance as HTTP 429 with business code 1113). Only
+# GLM's errors are matched: "insufficient memory" from Ollama is not a quota.
+QUOTA_MARKERS = ("429", "1113", "余额不足", "insufficient")
+QUOTA_PROVIDERS = ("glm",)
+
+# Exception class names (anywhere in the MRO) that mean the provider could not be reached
+# in time: builtin ConnectionError/TimeoutError, httpx (Ollama), requests, google.api_core, zhipuai
+OUTAGE_ERROR_NAMES = (
+    "ConnectionError", "TimeoutError", "Timeout", "TimeoutException", "ConnectError",
+    "TransportError", "NetworkError", "RemoteProtocolError", "APITimeoutError", "APIConnectionError",
+    "DeadlineExceeded", "ServiceUnavailable", "InternalServerError", "BadGateway", "GatewayTimeout",
+)
+
+
+def is_quota_error(error: Exception, provider: str) -> bool:
+    """Check if an error means the provider account is out of quota"""
+    if provider not in QUOTA_PROVIDERS:
+        return False
+    error_str = str(getattr(error, "detail", None) or error).lower()
+    return any(marker in error_str for marker in QUOTA_MARKERS)
+
+
+def _error_chain(error: Optional[BaseException]):
+    # Provider helpers re-raise SDK errors as HTTPException; the original is the context
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    for attr in ("status_code", "code"):
+        value = getattr(error, attr, None)
+        value = getattr(value, "value", value)  # http.HTTPStatus
+        if isinstance(value, int) and not isinstance(value, bool) and 100 <= value < 600:
+            return value
+    return None
+
+
+def is_outage_error(error: Exception) -> bool:
+    """A transport error, timeout or 5xx from the provider itself, as opposed to a bad
+    request, a missing model or our own HTTPException for a configuration problem"""
+    for link in _error_chain(error):
+        if isinstance(link, HTTPException):
+            continue  # our wrapper; its status says nothing about the provider
+        if any(cls.__name__ in OUTAGE_ERROR_NAMES for cls in type(link).__mro__):
+            return True
+        status = _status_code(link)
+        if status is not None:
+            return status >= 500
+    return False
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open trial after a cooldown"""
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.trial_in_flight:
+            # Let exactly one request probe the provider
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self, trip: bool = False):
+        self.consecutive_failures += 1
+        self.trial_in_flight = False
+        if trip or self.consecutive_failures >= self.failure_threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+
+class ProviderStats:
+    """Sliding window of recent call outcomes for one provider operation"""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self.samples = deque(maxlen=window)  # (latency_seconds, ok)
+        self.total_calls = 0
+        self.total_errors = 0
+
+    def record(self, latency: float, ok: bool):
+        self.samples.append((latency, ok))
+        self.total_calls += 1
+        if not ok:
+            self.total_errors += 1
+
+    def percentile(self, pct: float) -> Optional[float]:
+        latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        rank = min(len(latencies) - 1, max(0, int(round(pct / 100.0 * len(latencies))) - 1))
+        return latencies[rank]
+
+    def error_rate(self) -> float:
+        if not self.samples:
+            return 0.0
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+
+class ProviderRouter:
+    """Routes provider calls through per-(provider, operation) circuit breakers and latency stats"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._available: Dict[str, Callable[[], bool]] = {}
+        self._breakers: Dict[tuple, CircuitBreaker] = {}
+        self._stats: Dict[tuple, ProviderStats] = {}
+
+    def register(self, provider: str, is_available: Callable[[], bool] = lambda: True):
+        """Register a provider with a check for whether it is configured"""
+        self._available[provider] = is_available
+
+    def _breaker(self, provider: str, operation: str) -> CircuitBreaker:
+        # A broken vision model must not take embeddings and chat down with it
+        key = (provider, operation)
+        if key not in self._breakers:
+            self._breakers[key] = CircuitBreaker()
+        return self._breakers[key]
+
+    def _stats_for(self, provider: str, operation: str) -> ProviderStats:
+        key = (provider, operation)
+        if key not in self._stats:
+            self._stats[key] = ProviderStats()
+        return self._stats[key]
+
+    def candidates(self, provider: str, operation: str, allow_fallback: bool = False,
+                   eligible: Optional[List[str]] = None) -> List[str]:
+        """Providers to try, in order. Without fallback only the requested one.
+
+        With fallback the requested provider still comes first unless its
+        breaker is open; the others follow, fastest first.
+        """
+        if not allow_fallback:
+            return [provider]
+        pool = [
+            name for name, is_available in self._available.items()
+            if (eligible is None or name in eligible) and (name == provider or is_available())
+        ]
+        if provider not in pool:
+            pool.append(provider)
+
+        def sort_key(name):
+            p50 = self._stats_for(name, operation).percentile(50)
+            if p50 is None:
+                p50 = float("inf")  # unmeasured providers go after measured ones
+            return (self._breaker(name, operation).state == "open", name != provider, p50)
+
+        with self._lock:
+            return sorted(pool, key=sort_key)
+
+    def call(self, provider: str, operation: str, fn: Callable[[str], object],
+             allow_fallback: bool = False, eligible: Optional[List[str]] = None):
+        """Call fn(provider_name) on the first healthy candidate provider"""
+        return self.call_with_provider(provider, operation, fn, allow_fallback, eligible)[0]
+
+    def call_with_provider(self, provider: str, operation: str, fn: Callable[[str], object],
+                           allow_fallback: bool = False, eligible: Optional[List[str]] = None) -> tuple:
+        """Like call(), but returns (result, name of the provider that answered)"""
+        self.register(provider, self._available.get(provider, lambda: True))
+        last_error: Optional[Exception] = None
+        skipped = []
+        for name in self.candidates(provider, operation, allow_fallback, eligible):
+            with self._lock:
+                breaker = self._breaker(name, operation)
+                allowed = breaker.allow()
+            if not allowed:
+                skipped.append(name)
+                continue
+
+            started = time.perf_counter()
+            try:
+                result = fn(name)
+            except Exception as e:
+                quota = is_quota_error(e, name)
+                with self._lock:
+                    self._stats_for(name, operation).record(time.perf_counter() - started, ok=False)
+                    if quota or is_outage_error(e):
+                        breaker.record_failure(trip=quota)
+                    elif breaker.trial_in_flight:
+                        # The provider answered, so the half-open trial is over; the circuit stays as it was
+                        breaker.trial_in_flight = False
+                last_error = e
+                if allow_fallback:
+                    logger.warning("%s %s failed, trying next provider: %s", name, operation, e)
+                    continue
+                raise
+            with self._lock:
+                self._stats_for(name, operation).record(time.perf_counter() - started, ok=True)
+                breaker.record_success()
+            if name != provider:
+                logger.warning("%s %s answered by fallback provider %s", provider, operation, name)
+            return result, name
+
+        if last_error is not None:
+            raise last_error
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model provider temporarily unavailable (circuit open for: {', '.join(skipped)}). Try again shortly or switch provider."
+        )
+
+    def reset_after_fork(self):
+        # Keep breakers and stats; only the lock may be stuck from the parent
+        self._lock = threading.Lock()
+
+    def snapshot(self) -> dict:
+        """Breaker state and latency/error stats for every provider operation"""
+        with self._lock:
+            providers = {}
+            for name, is_available in self._available.items():
+                providers[name] = {"configured": bool(is_available()), "operations": {}}
+            for (name, operation) in set(self._stats) | set(self._breakers):
+                breaker = self._breakers.get((name, operation))
+                stats = self._stats.get((name, operation)) or ProviderStats()
+                providers.setdefault(name, {"configured": False, "operations": {}})["operations"][operation] = {
+                    "circuit": breaker.state if breaker else "closed",
+                    "consecutive_failures": breaker.consecutive_failures if breaker else 0,
+                    "calls": stats.total_calls,
+                    "errors": stats.total_errors,
+                    "error_rate": round(stats.error_rate(), 4),
+                    "p50_ms": _ms(stats.percentile(50)),
+                    "p95_ms": _ms(stats.percentile(95)),
+                    "p99_ms": _ms(stats.percentile(99)),
+                }
+            return providers
+
+
+class ProviderLimiter:
+    """Per-provider asyncio semaphores that cap concurrent calls from bulk endpoints"""
+
+    def __init__(self, spec: str = PROVIDER_CONCURRENCY, default: int = DEFAULT_CONCURRENCY):
+        self.limits: Dict[str, int] = {}
+        for item in spec.split(","):
+            name, _, value = item.partition("=")
+            if name.strip() and value.strip():
+                self.limits[name.strip()] = max(1, int(value))
+        self.default = default
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def limit(self, provider: str) -> asyncio.Semaphore:
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = self._semaphores[provider] = asyncio.Semaphore(self.limits.get(provider, self.default))
+        return semaphore
+
+    def reset_after_fork(self):
+        # Semaphores belong to the parent's event loop
+        self._semaphores = {}
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return round(seconds * 1000, 1) if seconds is not None else None
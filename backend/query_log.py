@@ -0,0 +1,357 @@
+"""
+Write-behind logging of answered queries into dental_queries.
+
+Answers no longer wait on Postgres: rows are buffered in memory and a
+background thread writes them with COPY when QUERY_LOG_FLUSH_SIZE rows are
+waiting or every QUERY_LOG_FLUSH_INTERVAL seconds. Query ids come from
+blocks of nextval() fetched ahead of time (the first one when the writer
+starts), so the response can include the id before the row exists. If the
+database is unreachable, rows are appended to a spill file and replayed
+once it is back.
+
+The response never waits on an outage: if the id block runs out while the
+database is known to be down, the row is logged without an id (the
+response's query_id is null) and gets one from the sequence on replay.
+
+If a batch fails for any other reason, its rows are retried one by one so
+a single bad row (a NUL byte, a user_id that no longer exists) can't hold
+up the others; rows that still fail go to a dead-letter file, which is
+never replayed automatically.
+"""
+from collections import deque
+from datetime import datetime
+from typing import Callable, List, Optional
+import csv
+import glob
+import io
+import json
+import logging
+import os
+import threading
+import uuid
+
+import psycopg2
+
+from metrics import Counter, Gauge, registry
+
+logger = logging.getLogger("dentalgpt.query_log")
+
+FLUSH_SIZE = int(os.getenv("QUERY_LOG_FLUSH_SIZE", "100"))
+FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", "1.0"))
+ID_BLOCK_SIZE = int(os.getenv("QUERY_LOG_ID_BLOCK", "100"))
+# Each process appends to <base>.<pid>.jsonl; any process replays all of them
+SPILL_BASE = os.getenv("QUERY_LOG_SPILL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "query_log_spill"))
+# Rows the database rejected, for inspection; deliberately outside the spill glob
+DEAD_LETTER_BASE = os.getenv("QUERY_LOG_DEAD_LETTER_PATH", f"{SPILL_BASE}-dead")
+
+COLUMNS = ("id", "user_id", "patient_id", "query_text", "ai_response", "source_docs", "created_at")
+
+# Ids are normally preallocated; rows logged while the database was down have none
+ID_OR_NEXTVAL = "COALESCE(%s, nextval(pg_get_serial_sequence('dental_queries', 'id')))"
+INSERT_ROW_SQL = f"""
+    INSERT INTO dental_queries ({', '.join(COLUMNS)})
+    VALUES ({ID_OR_NEXTVAL}, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (id) DO NOTHING
+"""
+
+QUERY_LOG_ROWS = registry.register(Counter(
+    "dentalgpt_query_log_rows_total",
+    "dental_queries rows by outcome (written, spilled, replayed, dead_lettered, dropped)"
+))
+QUERY_LOG_INLINE_ID_BLOCKS = registry.register(Counter(
+    "dentalgpt_query_log_inline_id_blocks_total",
+    "Query id blocks fetched on the request path because the preallocated block ran out"
+))
+QUERY_LOG_BUFFERED = registry.register(Gauge(
+    "dentalgpt_query_log_buffered_rows",
+    "dental_queries rows waiting to be written"
+))
+
+
+class QueryLogWriter:
+    """Buffers dental_queries rows and writes them in bulk from a background thread"""
+
+    def __init__(self, connect: Callable, flush_size: int = FLUSH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 id_block_size: int = ID_BLOCK_SIZE, spill_base: str = SPILL_BASE,
+                 dead_letter_base: str = DEAD_LETTER_BASE):
+        self.connect = connect
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+        self.spill_base = spill_base
+        self.dead_letter_base = dead_letter_base
+        self._reset_state()
+
+    def _reset_state(self):
+        self._rows: List[tuple] = []
+        self._ids = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._id_lock = threading.Lock()
+        self._db_reachable = True  # as of the last connection attempt
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # -- request path ------------------------------------------------------
+
+    def log(self, user_id, patient_id, query_text: str, ai_response: str, sources: list) -> Optional[int]:
+        """Queue one row and return its id, or None if the database is unreachable
+        and no preallocated id is left. Never raises for a database problem.
+
+        If the block has run out while the database is up (a burst outran the
+        writer), the next block is fetched here.
+        """
+        query_id = self._next_id()
+        with self._lock:
+            self._rows.append((query_id, user_id, patient_id, query_text, ai_response,
+                               json.dumps(sources), datetime.now()))
+            buffered = len(self._rows)
+            low_on_ids = len(self._ids) < self.id_block_size // 4
+        QUERY_LOG_BUFFERED.inc()
+        if buffered >= self.flush_size or low_on_ids:
+            self._wake.set()
+        return query_id
+
+    def _next_id(self) -> Optional[int]:
+        with self._lock:
+            if self._ids:
+                return self._ids.popleft()
+            if not self._db_reachable:
+                # Don't make the answer wait out a connect timeout; replay assigns the id
+                return None
+        # Block exhausted while the database is up (the writer is behind):
+        # fetch one inline, once, while other callers wait for it
+        with self._id_lock:
+            with self._lock:
+                if self._ids:
+                    return self._ids.popleft()
+                if not self._db_reachable:
+                    return None
+            try:
+                conn = self.connect()
+                try:
+                    ids = self._allocate_ids(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                self._set_reachable(False)
+                logger.warning("Could not fetch query ids, logging without: %s", e)
+                return None
+            QUERY_LOG_INLINE_ID_BLOCKS.inc()
+            with self._lock:
+                self._ids.extend(ids[1:])
+            return ids[0]
+
+    def _set_reachable(self, reachable: bool):
+        with self._lock:
+            self._db_reachable = reachable
+
+    # -- background thread -------------------------------------------------
+
+    def _allocate_ids(self, conn) -> List[int]:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT nextval(pg_get_serial_sequence('dental_queries', 'id')) FROM generate_series(1, %s)",
+                (self.id_block_size,)
+            )
+            ids = [row[0] for row in cur.fetchall()]
+        conn.commit()
+        return ids
+
+    def _refill_ids(self, conn):
+        with self._lock:
+            if len(self._ids) >= self.id_block_size // 4:
+                return
+        ids = self._allocate_ids(conn)
+        with self._lock:
+            self._ids.extend(ids)
+
+    def _copy_rows(self, conn, rows: List[tuple]):
+        with_id = [row for row in rows if row[0] is not None]
+        without_id = [row for row in rows if row[0] is None]
+        with conn.cursor() as cur:
+            if with_id:
+                buffer = io.StringIO()
+                # None and '' both come out as an empty field, which COPY reads as NULL;
+                # FORCE_NOT_NULL keeps empty question/answer text as ''
+                csv.writer(buffer).writerows(with_id)
+                buffer.seek(0)
+                cur.copy_expert(
+                    f"COPY dental_queries ({', '.join(COLUMNS)}) FROM STDIN "
+                    "WITH (FORMAT csv, FORCE_NOT_NULL (query_text, ai_response))",
+                    buffer
+                )
+            if without_id:
+                from psycopg2.extras import execute_values
+                execute_values(cur, f"INSERT INTO dental_queries ({', '.join(COLUMNS)}) VALUES %s",
+                               without_id, template=f"({ID_OR_NEXTVAL}, %s, %s, %s, %s, %s, %s)")
+        conn.commit()
+
+    def _insert_each(self, conn, rows: List[tuple]) -> List[tuple]:
+        """Insert rows one at a time after a batch failed. Rows the database
+        rejects go to the dead-letter file; if the connection itself fails,
+        the rows not yet written are returned for spilling."""
+        written = 0
+        for i, row in enumerate(rows):
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(INSERT_ROW_SQL, row)
+                conn.commit()
+                written += 1
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                QUERY_LOG_ROWS.inc(written, outcome="written")
+                return rows[i:]
+            except Exception as e:
+                if conn.closed:
+                    QUERY_LOG_ROWS.inc(written, outcome="written")
+                    return rows[i:]
+                conn.rollback()
+                self._dead_letter(row, e)
+        QUERY_LOG_ROWS.inc(written, outcome="written")
+        return []
+
+    def _dead_letter(self, row: tuple, error: Exception):
+        path = f"{self.dead_letter_base}.{os.getpid()}.jsonl"
+        record = dict(zip(COLUMNS, row), error=str(error))
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+            QUERY_LOG_ROWS.inc(outcome="dead_lettered")
+            logger.error("Query log row %s rejected by the database, moved to %s: %s", row[0], path, error)
+        except OSError as e:
+            QUERY_LOG_ROWS.inc(outcome="dropped")
+            logger.error("Could not dead-letter query log row %s: %s", row[0], e)
+
+    @staticmethod
+    def _write_jsonl(path: str, rows: List[tuple]):
+        with open(path, "a", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(COLUMNS, row)), default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _spill(self, rows: List[tuple]):
+        path = f"{self.spill_base}.{os.getpid()}.jsonl"
+        try:
+            self._write_jsonl(path, rows)
+            QUERY_LOG_ROWS.inc(len(rows), outcome="spilled")
+            logger.warning("Database unavailable, spilled %d query log rows to %s", len(rows), path)
+        except OSError as e:
+            QUERY_LOG_ROWS.inc(len(rows), outcome="dropped")
+            logger.error("Could not spill %d query log rows: %s", len(rows), e)
+
+    def _replay_spills(self, conn):
+        for path in glob.glob(f"{self.spill_base}.*.jsonl"):
+            claimed = f"{path}.replaying-{os.getpid()}"
+            try:
+                os.rename(path, claimed)  # atomic: only one worker replays a file
+            except OSError:
+                continue
+            with open(claimed, encoding="utf-8") as f:
+                records = [json.loads(line) for line in f if line.strip()]
+            rows = [tuple(r.get(c) for c in COLUMNS) for r in records]
+            if rows:
+                from psycopg2.extras import execute_values
+                try:
+                    with conn.cursor() as cur:
+                        # A row may have landed before the failure was reported; skip duplicates
+                        execute_values(
+                            cur,
+                            f"""INSERT INTO dental_queries ({', '.join(COLUMNS)})
+                                VALUES %s ON CONFLICT (id) DO NOTHING""",
+                            rows,
+                            template=f"({ID_OR_NEXTVAL}, %s, %s, %s, %s, %s, %s)"
+                        )
+                    conn.commit()
+                    QUERY_LOG_ROWS.inc(len(rows), outcome="replayed")
+                    logger.info("Replayed %d spilled query log rows from %s", len(rows), path)
+                except Exception:
+                    # Bad rows are dead-lettered; only rows the connection failed on go back
+                    remaining = rows
+                    if not conn.closed:
+                        conn.rollback()
+                        remaining = self._insert_each(conn, rows)
+                    if remaining:
+                        # Under a fresh name; this process may have spilled to `path` since
+                        self._write_jsonl(f"{self.spill_base}.{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl", remaining)
+                        os.unlink(claimed)
+                        raise
+                    logger.info("Replayed spilled query log rows from %s row by row", path)
+            os.unlink(claimed)
+
+    def flush(self):
+        """Write everything buffered; on failure spill it to disk"""
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                need_ids = len(self._ids) < self.id_block_size // 4
+            QUERY_LOG_BUFFERED.dec(len(rows))
+            if not rows and not need_ids and not glob.glob(f"{self.spill_base}.*.jsonl"):
+                return
+            try:
+                conn = self.connect()
+            except Exception as e:
+                self._set_reachable(False)
+                if rows:
+                    logger.warning("Query log flush failed: %s", e)
+                    self._spill(rows)
+                return
+            self._set_reachable(True)
+            try:
+                if rows:
+                    try:
+                        self._copy_rows(conn, rows)
+                        QUERY_LOG_ROWS.inc(len(rows), outcome="written")
+                    except Exception as e:
+                        logger.warning("Query log batch failed, retrying row by row: %s", e)
+                        remaining = rows
+                        if not conn.closed:
+                            conn.rollback()
+                            remaining = self._insert_each(conn, rows)
+                        if remaining:
+                            self._spill(remaining)
+                            return
+                self._refill_ids(conn)
+                self._replay_spills(conn)
+            except Exception as e:
+                logger.warning("Query log maintenance failed: %s", e)
+            finally:
+                conn.close()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        """Fetch the first block of ids, then start the writer thread"""
+        if not self._ids:
+            try:
+                conn = self.connect()
+                try:
+                    self._refill_ids(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                # Until the writer reconnects, log() returns rows without ids
+                self._set_reachable(False)
+                logger.warning("Could not preallocate query ids: %s", e)
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the writer thread and flush what is left"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def reset_after_fork(self):
+        # The parent flushes its own buffer, and its preallocated ids must not be reused
+        self._reset_state()
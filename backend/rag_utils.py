@@ -0,0 +1,199 @@
+"""
+Request-path helpers for the DentalGPT RAG pipeline.
+
+Pure functions with no network or database access: text chunking, context
+and source building, prompt assembly, conversation-ending detection and
+image preparation. Every chat turn and upload runs through them, which is
+why they are benchmarked in benchmarks/micro.
+"""
+from typing import List, Optional, Tuple, Union
+import io
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+SOURCE_PREVIEW_CHARS = 200
+MAX_VISION_IMAGE_SIZE = 1024  # Longest side, in pixels, of images sent to vision models
+CLOSING_RESPONSE = "You're welcome! Is there anything else you'd like to know?"
+
+IMAGE_INSTRUCTION = "\n\nCRITICAL: The user has provided an X-ray or medical image that you MUST analyze. The image has been sent to you - do NOT say you don't have it or can't see it. Please carefully examine the image and provide detailed observations about:\n- Any visible dental structures, restorations, or abnormalities\n- Potential issues or concerns\n- Recommendations based on what you observe\n- Specific findings from the image\n\nYou have access to the image - analyze it now."
+
+# Keywords that indicate the user wants to reference the previous image
+IMAGE_RELATED_KEYWORDS = ['xray', 'x-ray', 'image', 'picture', 'photo', 'summarize', 'summary', 'what did you see', 'what did you find', 'analysis', 'observe', 'findings', 'tell me about', 'describe']
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    """Split text into fixed-size chunks that overlap by `overlap` characters"""
+    # Simple chunking (you can enhance this with RecursiveCharacterTextSplitter)
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        chunks.append(text[start:end])
+        start = end - overlap
+    return chunks
+
+
+def build_context(matches) -> Tuple[str, List[dict]]:
+    """Join retrieved chunks into prompt context and build the truncated source list"""
+    context_chunks = []
+    sources = []
+    for match in matches:
+        chunk_text = match.metadata.get('text', '')
+        context_chunks.append(chunk_text)
+        sources.append({
+            "text": chunk_text[:SOURCE_PREVIEW_CHARS] + "..." if len(chunk_text) > SOURCE_PREVIEW_CHARS else chunk_text,
+            "score": match.score,
+            "metadata": match.metadata
+        })
+    return "\n\n".join(context_chunks), sources
+
+
+def build_patient_context(patient_info: Optional[dict]) -> str:
+    """Patient section of the chat prompt"""
+    if not patient_info:
+        return ""
+    patient_context = f"""
+Patient Information:
+- Name: {patient_info.get('name', 'N/A')}
+- Patient ID: {patient_info.get('id', 'N/A')}
+- Date of Birth: {patient_info.get('date_of_birth', 'N/A')}
+- Gender: {patient_info.get('gender', 'N/A')}
+- Email: {patient_info.get('email', 'N/A')}
+- Phone: {patient_info.get('phone', 'N/A')}
+- Address: {patient_info.get('address', 'N/A')}
+"""
+    if patient_info.get('summary'):
+        patient_context += f"- Summary: {patient_info.get('summary')}\n"
+    if patient_info.get('medical_history'):
+        patient_context += f"- Medical History: {patient_info.get('medical_history')}\n"
+    if patient_info.get('dental_history'):
+        patient_context += f"- Dental History: {patient_info.get('dental_history')}\n"
+    if patient_info.get('allergies'):
+        patient_context += f"- Allergies: {patient_info.get('allergies')}\n"
+    if patient_info.get('medications'):
+        patient_context += f"- Current Medications: {patient_info.get('medications')}\n"
+    return patient_context
+
+
+def build_chat_history(recent_messages: List[dict]) -> Tuple[str, Optional[Union[int, str]]]:
+    """History section of the chat prompt, plus the most recent user image in it.
+
+    recent_messages is newest first, as returned by the history query. The
+    image comes back as its image_id, or as base64 for messages saved
+    before images were stored as documents.
+    """
+    chat_history = ""
+    previous_image = None
+    if recent_messages:
+        # Reverse to show chronological order (oldest first)
+        messages_list = list(reversed(recent_messages))
+        chat_history = "\n\nRecent Conversation History:\n"
+        for msg in messages_list:
+            role = "User" if msg["message_type"] == "user" else "Assistant"
+            content = msg['content']
+            # If message has an image, note it in the history
+            image = msg.get('image_id') or msg.get('image')
+            if image:
+                content += " [Note: This message included an X-ray/medical image that was analyzed]"
+                # Store the most recent image for potential re-use
+                if msg["message_type"] == "user" and not previous_image:
+                    previous_image = image
+            chat_history += f"{role}: {content}\n"
+    return chat_history, previous_image
+
+
+def wants_previous_image(query: str) -> bool:
+    """Check if a query without an image refers back to the last image in the chat"""
+    query_lower = query.lower()
+    # Also check if it's a short follow-up query (likely referencing previous image)
+    is_short_followup = len(query.split()) <= 5 and any(word in query_lower for word in ['summary', 'summarize', 'ok', 'what', 'tell', 'describe'])
+    return any(keyword in query_lower for keyword in IMAGE_RELATED_KEYWORDS) or is_short_followup
+
+
+def build_chat_prompt(query: str, context: str, patient_context: str = "", chat_history: str = "",
+                      has_image: bool = False) -> str:
+    """Prompt for a chat turn"""
+    image_instruction = IMAGE_INSTRUCTION if has_image else ""
+    return f"""You are a dental assistant AI helping a dentist with patient care. Answer the following question based on the provided dental guidelines, clinical knowledge, and conversation history.{patient_context}{chat_history}
+
+Dental Guidelines Context:
+{context}
+{image_instruction}
+
+Current Question: {query}
+
+IMPORTANT: Provide a clear, concise, and clinically accurate answer. 
+- If the context contains relevant information, use it and cite which parts of the guidelines you're referencing.
+- If the context doesn't contain enough information, still provide a helpful general answer based on your dental knowledge and best practices. Don't just say "I don't have information" - be helpful and provide practical guidance.
+- Always be professional, empathetic, and clinically sound in your responses. 
+
+IMPORTANT INSTRUCTIONS:
+1. When the user asks about "this patient", "the patient", "patient summary", "patient information", or similar questions, you MUST use the Patient Information provided above.
+2. When the user asks about procedures, treatments, or actions discussed in this conversation, refer to the Recent Conversation History above to see what was previously discussed.
+3. If the conversation history mentions a procedure being done (e.g., "done with procedure of root canal"), you should acknowledge this when asked about the last procedure.
+4. Use both the dental guidelines and conversation history to provide comprehensive answers."""
+
+
+def build_query_prompt(query: str, context: str) -> str:
+    """Prompt for the stateless /api/query endpoint"""
+    return f"""You are a dental assistant AI. Answer the following question based on the provided dental guidelines and clinical knowledge.
+
+Dental Guidelines Context:
+{context}
+
+Question: {query}
+
+IMPORTANT: Provide a clear, concise, and clinically accurate answer.
+- If the context contains relevant information, use it and cite which parts of the guidelines you're referencing.
+- If the context doesn't contain enough information, still provide a helpful general answer based on your dental knowledge and best practices. Don't just say "I don't have information" - be helpful and provide practical guidance.
+- Always be professional, empathetic, and clinically sound in your responses."""
+
+
+def is_conversation_ending(query: str) -> bool:
+    """Check if the query sounds like the end of a conversation"""
+    query_lower = query.lower().strip()
+    
+    # List of phrases that indicate conversation ending
+    ending_phrases = [
+        "ok thanks", "ok thank you", "okay thanks", "okay thank you",
+        "thanks", "thank you", "thx", "ty",
+        "that's all", "thats all", "that is all",
+        "nothing else", "nothing more",
+        "no more questions", "no more",
+        "that's it", "thats it", "that is it",
+        "all done", "done", "finished",
+        "no further questions", "no other questions",
+        "got it", "understood", "i understand",
+        "perfect", "great thanks", "great thank you",
+        "appreciate it", "appreciate",
+        "sounds good", "sounds great"
+    ]
+    
+    # Check if query matches any ending phrase (exact match or starts with it)
+    for phrase in ending_phrases:
+        if query_lower == phrase or query_lower.startswith(phrase + " ") or query_lower.endswith(" " + phrase):
+            return True
+    
+    # Check if query is very short and contains thanks/ok
+    if len(query_lower.split()) <= 3:
+        if any(word in query_lower for word in ["ok", "okay", "thanks", "thank", "thx", "ty"]):
+            return True
+    
+    return False
+
+
+def resize_image_for_vision(image_bytes: bytes, max_size: int = MAX_VISION_IMAGE_SIZE) -> bytes:
+    """Downscale an image so its longest side is at most max_size pixels.
+
+    Returns the original bytes when the image is already small enough.
+    Raises ImportError without Pillow and PIL errors for unreadable images.
+    """
+    from PIL import Image
+    img = Image.open(io.BytesIO(image_bytes))
+    if max(img.size) <= max_size:
+        return image_bytes
+    img_format = img.format or 'JPEG'
+    img.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    img.save(output, format=img_format, quality=85, optimize=True)
+    return output.getvalue()
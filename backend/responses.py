@@ -0,0 +1,176 @@
+"""
+Response encoding for DentalGPT.
+
+JSON is rendered with orjson when it is installed, which is several times
+faster than the standard library on message lists and source arrays.
+Responses of at least COMPRESS_MIN_SIZE bytes are compressed with brotli
+or gzip, whichever the client prefers and the server supports (brotli
+needs the optional `brotli` package). Media that is already compressed
+(images, audio, PDFs, archives) passes through untouched.
+"""
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from typing import Optional
+import json
+import os
+import zlib
+
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    orjson = None
+    FastJSONResponse = JSONResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+# Quality 4 compresses about as fast as gzip -6 and a little smaller
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "4"))
+
+# Already compressed, or must reach the client unbuffered
+SKIP_CONTENT_TYPES = (
+    "image/", "audio/", "video/", "application/octet-stream", "application/zip",
+    "application/gzip", "application/pdf", "application/dicom", "text/event-stream",
+)
+
+
+def json_response(content, status_code: int = 200, headers: Optional[dict] = None):
+    """A JSON response rendered directly, without FastAPI's jsonable_encoder pass.
+
+    Use it for large payloads of plain dicts/lists/datetimes (DB rows,
+    sources). Falls back to the standard encoder if orjson is missing.
+    """
+    if orjson is not None:
+        return FastJSONResponse(content, status_code=status_code, headers=headers)
+    return JSONResponse(jsonable_encoder(content), status_code=status_code, headers=headers)
+
+
+def dumps_json(obj) -> bytes:
+    """Serialize one JSON document, e.g. an NDJSON line"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=str).encode("utf-8")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick "br" or "gzip" from an Accept-Encoding header, or None for identity"""
+    weights = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.partition(";")
+        token = token.strip().lower()
+        if not token:
+            continue
+        weight = 1.0
+        params = params.strip().replace(" ", "")
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[token] = weight
+    supported = (["br"] if brotli is not None else []) + ["gzip"]
+    # max() keeps the first of equal weights, so brotli wins ties
+    best = max(supported, key=lambda enc: weights.get(enc, weights.get("*", 0.0)))
+    return best if weights.get(best, weights.get("*", 0.0)) > 0 else None
+
+
+class _GzipCompressor:
+    def __init__(self):
+        self._z = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits 31: gzip container
+
+    def compress(self, data: bytes) -> bytes:
+        return self._z.compress(data)
+
+    def flush(self) -> bytes:
+        return self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._z.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self):
+        self._c = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._c.process(data)
+
+    def flush(self) -> bytes:
+        return self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+class CompressionMiddleware:
+    """ASGI middleware: negotiated brotli/gzip for responses of at least `minimum_size` bytes.
+
+    Streamed responses are compressed chunk by chunk with a flush after each
+    one, so NDJSON lines still reach the client as they are produced.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        state = {"start": None, "compressor": None, "passthrough": False}
+
+        async def send_compressed(message):
+            if message["type"] == "http.response.start":
+                # Hold the headers until the first body chunk shows whether to compress
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            compressor = state["compressor"]
+            if compressor is None:
+                start = state["start"]
+                headers = MutableHeaders(raw=list(start["headers"]))
+                content_type = headers.get("content-type", "")
+                # Ranged downloads: byte offsets and strong ETags refer to the stored bytes
+                if ("content-encoding" in headers or "accept-ranges" in headers
+                        or content_type.startswith(SKIP_CONTENT_TYPES)
+                        or (not more_body and len(body) < self.minimum_size)):
+                    state["passthrough"] = True
+                    await send(start)
+                    await send(message)
+                    return
+                compressor = state["compressor"] = _BrotliCompressor() if encoding == "br" else _GzipCompressor()
+                headers["content-encoding"] = encoding
+                headers.add_vary_header("Accept-Encoding")
+                if "content-length" in headers:
+                    del headers["content-length"]
+                if not more_body:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers["content-length"] = str(len(body))
+                    await send({**start, "headers": headers.raw})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send({**start, "headers": headers.raw})
+
+            if more_body:
+                await send({"type": "http.response.body", "body": compressor.compress(body) + compressor.flush(),
+                            "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": compressor.compress(body) + compressor.finish()})
+
+        await self.app(scope, receive, send_compressed)
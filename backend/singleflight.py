@@ -0,0 +1,58 @@
+"""
+Single-flight request coalescing for DentalGPT.
+
+When an identical embedding, retrieval or generation is already running
+(double-submits, staff clicking the same suggested question), later callers
+await the in-flight result instead of doing the work again.
+"""
+from starlette.concurrency import run_in_threadpool
+from collections import defaultdict
+from typing import Callable, Dict, Hashable
+import asyncio
+import hashlib
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different inputs share a key"""
+    return " ".join((text or "").split())
+
+
+def digest(*parts) -> str:
+    """Stable short key for large inputs such as prompts and images"""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else str(part or "").encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+class SingleFlight:
+    """Runs blocking work in the threadpool, once per key at a time"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._stats = defaultdict(lambda: {"executed": 0, "coalesced": 0})
+
+    async def do(self, key: tuple, fn: Callable, *args, **kwargs):
+        """key is (operation, provider, normalized input...)"""
+        operation = key[0]
+        task = self._inflight.get(key)
+        if task is not None:
+            self._stats[operation]["coalesced"] += 1
+        else:
+            self._stats[operation]["executed"] += 1
+            task = asyncio.ensure_future(run_in_threadpool(fn, *args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: one caller disconnecting must not cancel the shared work
+        return await asyncio.shield(task)
+
+    def reset_after_fork(self):
+        # In-flight tasks belong to the parent's event loop
+        self._inflight.clear()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._inflight),
+            "operations": {op: dict(counts) for op, counts in self._stats.items()},
+        }
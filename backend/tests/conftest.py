@@ -0,0 +1,9 @@
+"""
+Unit tests for the backend modules that run without external services.
+
+Run from the repository root: python -m pytest backend/tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -0,0 +1,74 @@
+"""Upload size limits in audio.py, with a fake request that streams its body in chunks"""
+import asyncio
+import sys
+import types
+
+import pytest
+from fastapi import HTTPException
+
+import audio
+
+BOUNDARY = "recording"
+
+
+class FakeRequest:
+    def __init__(self, chunks, headers):
+        self.chunks = chunks
+        self.headers = headers
+        self.received = 0
+
+    async def stream(self):
+        for chunk in self.chunks:
+            self.received += len(chunk)
+            yield chunk
+
+
+class DrainingParser:
+    """Stands in for starlette's MultiPartParser: consumes the stream it is given"""
+
+    def __init__(self, headers, stream, max_files=1000, max_fields=1000):
+        self.stream = stream
+
+    async def parse(self):
+        async for _chunk in self.stream:
+            pass
+        raise AssertionError("an oversized body was read to the end")
+
+
+@pytest.fixture
+def fake_parser(monkeypatch):
+    formparsers = types.ModuleType("starlette.formparsers")
+    formparsers.MultiPartParser = DrainingParser
+    formparsers.MultiPartException = type("MultiPartException", (Exception,), {})
+    monkeypatch.setitem(sys.modules, "starlette.formparsers", formparsers)
+
+
+def multipart_request(size, declare_length):
+    headers = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+    if declare_length:
+        headers["content-length"] = str(size)
+    return FakeRequest([b"x" * 1024] * (size // 1024), headers)
+
+
+def read_form(request, limit):
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(audio.read_audio_form(request, limit))
+    return raised.value
+
+
+def test_oversized_multipart_refused_by_content_length(fake_parser):
+    request = multipart_request(audio.MULTIPART_OVERHEAD + 8192, declare_length=True)
+    assert read_form(request, 4096).status_code == 413
+    assert request.received == 0
+
+
+def test_oversized_multipart_refused_while_streaming(fake_parser):
+    limit = 4096
+    request = multipart_request(audio.MULTIPART_OVERHEAD + 64 * 1024, declare_length=False)
+    assert read_form(request, limit).status_code == 413
+    assert request.received <= limit + audio.MULTIPART_OVERHEAD + 1024
+
+
+def test_raw_body_within_limit():
+    request = FakeRequest([b"a" * 10, b"b" * 10], {})
+    assert asyncio.run(audio.read_audio_body(request, 20)) == b"a" * 10 + b"b" * 10
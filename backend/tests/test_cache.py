@@ -0,0 +1,60 @@
+"""cache settings are read when used, so values loaded from .env after import still apply"""
+import sys
+from types import SimpleNamespace
+
+import cache
+
+
+class FakeRedis:
+    def __init__(self, url):
+        self.url = url
+        self.data = {}
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        return cls(url)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, payload, ex=None):
+        self.data[key] = payload.encode("utf-8")
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+def fresh_cache(monkeypatch):
+    monkeypatch.setattr(cache, "_cache", None)
+
+
+def test_redis_chosen_when_cache_url_set_after_import(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", SimpleNamespace(Redis=FakeRedis))
+    fresh_cache(monkeypatch)
+    monkeypatch.setenv("CACHE_URL", "redis://cache.internal:6379/0")
+    backend = cache.get_cache()
+    assert isinstance(backend, cache.RedisCache)
+    assert backend._client.url == "redis://cache.internal:6379/0"
+
+
+def test_memory_cache_without_cache_url(monkeypatch):
+    fresh_cache(monkeypatch)
+    monkeypatch.delenv("CACHE_URL", raising=False)
+    assert isinstance(cache.get_cache(), cache.MemoryCache)
+
+
+def test_ttl_set_after_import(monkeypatch):
+    monkeypatch.delenv("ANSWER_CACHE_TTL", raising=False)
+    assert cache.cache_ttl("answer") == 0
+    monkeypatch.setenv("ANSWER_CACHE_TTL", "600")
+    assert cache.cache_ttl("answer") == 600
+    assert cache.cache_ttl("user") == 60
+
+
+def test_round_trip_through_redis(monkeypatch):
+    monkeypatch.setitem(sys.modules, "redis", SimpleNamespace(Redis=FakeRedis))
+    fresh_cache(monkeypatch)
+    monkeypatch.setenv("CACHE_URL", "redis://localhost:6379/0")
+    key = cache.make_key("user", 7)
+    cache.cache_set("user", key, {"id": 7}, 60)
+    assert cache.cache_get("user", key) == {"id": 7}
@@ -0,0 +1,50 @@
+"""iter_db_bytes against a fake connection: no connection stays open between yielded chunks"""
+from documents import iter_db_bytes
+
+DATA = bytes(range(256)) * 4
+
+
+class FakeCursor:
+    def execute(self, query, params):
+        start, length, _document_id = params
+        self.row = (DATA[start - 1:start - 1 + length],)
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class FakeConnect:
+    def __init__(self):
+        self.open = 0
+        self.autocommit = []
+
+    def __call__(self):
+        self.open += 1
+        pool = self
+
+        class Conn:
+            autocommit = False
+
+            def cursor(self):
+                return FakeCursor()
+
+            def close(self):
+                pool.autocommit.append(self.autocommit)
+                pool.open -= 1
+
+        return Conn()
+
+
+def test_chunks_cover_the_range():
+    connect = FakeConnect()
+    assert b"".join(iter_db_bytes(connect, 1, 10, 700, chunk_size=100)) == DATA[10:701]
+
+
+def test_no_connection_open_while_a_chunk_is_pending():
+    connect = FakeConnect()
+    for _chunk in iter_db_bytes(connect, 1, 0, len(DATA) - 1, chunk_size=256):
+        assert connect.open == 0
+    assert connect.autocommit == [True] * 4
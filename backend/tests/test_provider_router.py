@@ -0,0 +1,91 @@
+"""ProviderRouter breakers: per operation, outages only, quota markers for GLM only"""
+import pytest
+from fastapi import HTTPException
+
+from provider_router import ProviderRouter, is_outage_error
+
+
+class ResponseError(Exception):
+    """Shaped like ollama.ResponseError"""
+
+    def __init__(self, error, status_code):
+        super().__init__(error)
+        self.status_code = status_code
+
+
+def wrapped(error):
+    # What the provider helpers in main.py do with SDK errors
+    try:
+        raise error
+    except Exception as e:
+        try:
+            raise HTTPException(status_code=500, detail=f"Ollama error: {e}")
+        except HTTPException as wrapper:
+            return wrapper
+
+
+def fail_with(error):
+    def fn(provider):
+        raise error
+    return fn
+
+
+def fail_times(router, provider, operation, error, times=3):
+    for _ in range(times):
+        with pytest.raises(Exception):
+            router.call(provider, operation, fail_with(error))
+
+
+def circuit(router, provider, operation):
+    return router.snapshot()[provider]["operations"][operation]["circuit"]
+
+
+def test_outage_opens_only_that_operation():
+    router = ProviderRouter()
+    router.register("ollama")
+    fail_times(router, "ollama", "vision", wrapped(ConnectionError("connection refused")))
+    assert circuit(router, "ollama", "vision") == "open"
+    assert router.call("ollama", "embed", lambda provider: [0.1]) == [0.1]
+    assert circuit(router, "ollama", "embed") == "closed"
+
+
+def test_missing_model_does_not_count():
+    router = ProviderRouter()
+    router.register("ollama")
+    fail_times(router, "ollama", "vision", wrapped(ResponseError("model 'llava' not found", 404)), times=5)
+    assert circuit(router, "ollama", "vision") == "closed"
+
+
+def test_configuration_error_does_not_count():
+    router = ProviderRouter()
+    router.register("gemini")
+    fail_times(router, "gemini", "generate", HTTPException(status_code=500, detail="Gemini API key not configured"), 5)
+    assert circuit(router, "gemini", "generate") == "closed"
+
+
+def test_server_error_counts():
+    router = ProviderRouter()
+    router.register("ollama")
+    fail_times(router, "ollama", "generate", wrapped(ResponseError("runner crashed", 500)))
+    assert circuit(router, "ollama", "generate") == "open"
+
+
+def test_quota_trips_glm_at_once():
+    router = ProviderRouter()
+    router.register("glm")
+    fail_times(router, "glm", "generate", HTTPException(status_code=500, detail="GLM generation error: 429 余额不足"), 1)
+    assert circuit(router, "glm", "generate") == "open"
+
+
+def test_quota_markers_ignored_for_ollama():
+    router = ProviderRouter()
+    router.register("ollama")
+    fail_times(router, "ollama", "generate", wrapped(ResponseError("insufficient memory", 400)), 1)
+    assert circuit(router, "ollama", "generate") == "closed"
+
+
+def test_is_outage_error():
+    assert is_outage_error(TimeoutError("timed out"))
+    assert is_outage_error(wrapped(ConnectionError("refused")))
+    assert not is_outage_error(wrapped(ResponseError("bad request", 400)))
+    assert not is_outage_error(ValueError("bad input"))
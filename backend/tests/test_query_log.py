@@ -0,0 +1,58 @@
+"""QueryLogWriter with a connection factory that fails: answers never wait on or fail with the database"""
+import glob
+import json
+
+from query_log import QueryLogWriter
+
+
+def unreachable():
+    raise ConnectionError("could not connect to server")
+
+
+class CountingConnect:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        unreachable()
+
+
+def make_writer(tmp_path, connect, **kwargs):
+    return QueryLogWriter(connect, id_block_size=4, spill_base=str(tmp_path / "spill"),
+                          dead_letter_base=str(tmp_path / "spill-dead"), **kwargs)
+
+
+def test_log_without_database_returns_none(tmp_path):
+    writer = make_writer(tmp_path, unreachable)
+    assert writer.log(1, None, "question", "answer", []) is None
+
+
+def test_log_does_not_reconnect_once_database_is_down(tmp_path):
+    connect = CountingConnect()
+    writer = make_writer(tmp_path, connect)
+    # The first attempt finds the database down; later ones don't wait on it again
+    for _ in range(5):
+        assert writer.log(1, None, "question", "answer", []) is None
+    assert connect.calls == 1
+
+
+def test_rows_without_ids_are_spilled(tmp_path):
+    writer = make_writer(tmp_path, unreachable)
+    writer.log(1, "P-1", "question", "answer", [{"source": "doc"}])
+    writer.flush()
+    [path] = glob.glob(str(tmp_path / "spill.*.jsonl"))
+    with open(path, encoding="utf-8") as f:
+        [row] = [json.loads(line) for line in f]
+    assert row["id"] is None
+    assert row["query_text"] == "question"
+    assert row["patient_id"] == "P-1"
+
+
+def test_preallocated_ids_used_while_database_is_down(tmp_path):
+    writer = make_writer(tmp_path, unreachable)
+    writer._ids.extend([41, 42])
+    writer._set_reachable(False)
+    assert writer.log(1, None, "q1", "a1", []) == 41
+    assert writer.log(1, None, "q2", "a2", []) == 42
+    assert writer.log(1, None, "q3", "a3", []) is None
@@ -0,0 +1,122 @@
+"""WhisperModelRegistry with a fake loader: LRU order, eviction, failed loads, limits"""
+import pytest
+from fastapi import HTTPException
+
+from whisper_models import WhisperModelRegistry, estimate_mb
+
+
+class FakeLoader:
+    def __init__(self, fail=()):
+        self.fail = set(fail)
+        self.calls = []
+
+    def __call__(self, size, compute_type):
+        self.calls.append((size, compute_type))
+        if (size, compute_type) in self.fail:
+            raise RuntimeError("out of memory")
+        return f"model:{size}:{compute_type}"
+
+
+def make_registry(loader, budget_mb=600, **kwargs):
+    options = dict(models=["tiny", "base", "small", "medium"], tiers={"dictation": "base", "clinical": "small"},
+                   default_size="base", default_compute_type="int8", compute_types=["int8", "float32"],
+                   device="cpu")
+    options.update(kwargs)
+    return WhisperModelRegistry(loader=loader, budget_mb=budget_mb, **options)
+
+
+def loaded_keys(registry):
+    return [(m["model"], m["compute_type"]) for m in registry.status()["loaded"]]
+
+
+def test_loads_once_and_reuses():
+    loader = FakeLoader()
+    registry = make_registry(loader)
+    assert registry.get("base", "int8") == "model:base:int8"
+    assert registry.get("base", "int8") == "model:base:int8"
+    assert loader.calls == [("base", "int8")]
+    assert registry.status()["state"] == "ready"
+
+
+def test_lru_order_follows_use():
+    registry = make_registry(FakeLoader())
+    registry.get("tiny", "int8")
+    registry.get("base", "int8")
+    registry.get("tiny", "int8")
+    assert loaded_keys(registry) == [("base", "int8"), ("tiny", "int8")]
+
+
+def test_evicts_least_recently_used_to_fit():
+    # base ~111 MB, tiny ~58 MB, small ~366 MB: adding small needs one model out
+    registry = make_registry(FakeLoader(), budget_mb=estimate_mb("small", "int8") + estimate_mb("base", "int8"))
+    registry.get("base", "int8")
+    registry.get("tiny", "int8")
+    registry.get("small", "int8")
+    assert loaded_keys(registry) == [("tiny", "int8"), ("small", "int8")]
+    assert registry.used_mb() <= registry.budget_mb
+
+
+def test_recent_use_protects_from_eviction():
+    registry = make_registry(FakeLoader(), budget_mb=estimate_mb("small", "int8") + estimate_mb("base", "int8"))
+    registry.get("base", "int8")
+    registry.get("tiny", "int8")
+    registry.get("base", "int8")
+    registry.get("small", "int8")
+    assert loaded_keys(registry) == [("base", "int8"), ("small", "int8")]
+
+
+def test_failed_load_evicts_nothing():
+    loader = FakeLoader(fail=[("small", "int8")])
+    registry = make_registry(loader, budget_mb=estimate_mb("small", "int8"))
+    registry.get("base", "int8")
+    with pytest.raises(HTTPException) as excinfo:
+        registry.get("small", "int8")
+    assert excinfo.value.status_code == 503
+    assert loaded_keys(registry) == [("base", "int8")]
+
+
+def test_failed_default_load_is_reported():
+    registry = make_registry(FakeLoader(fail=[("base", "int8")]))
+    with pytest.raises(HTTPException):
+        registry.get("base", "int8")
+    status = registry.status()
+    assert status["state"] == "pending"
+    assert "out of memory" in status["error"]
+
+
+def test_resolve_tiers_and_defaults():
+    registry = make_registry(FakeLoader())
+    assert registry.resolve() == ("base", "int8")
+    assert registry.resolve("clinical") == ("small", "int8")
+    assert registry.resolve("tiny", "float32") == ("tiny", "float32")
+
+
+def test_resolve_rejects_over_budget():
+    registry = make_registry(FakeLoader(), budget_mb=3072)
+    assert estimate_mb("medium", "float32") > 3072
+    with pytest.raises(HTTPException) as excinfo:
+        registry.resolve("medium", "float32")
+    assert excinfo.value.status_code == 400
+    assert registry.resolve("medium", "int8") == ("medium", "int8")
+
+
+def test_resolve_rejects_unknown_model():
+    with pytest.raises(HTTPException) as excinfo:
+        make_registry(FakeLoader()).resolve("large-v3")
+    assert excinfo.value.status_code == 400
+
+
+def test_resolve_rejects_compute_type_not_offered():
+    registry = make_registry(FakeLoader(), compute_types=["int8"])
+    with pytest.raises(HTTPException) as excinfo:
+        registry.resolve("tiny", "float32")
+    assert excinfo.value.status_code == 400
+
+
+def test_resolve_rejects_compute_type_device_cannot_run():
+    cpu = make_registry(FakeLoader(), compute_types=["int8", "float16"])
+    assert cpu.compute_types == ["int8"]
+    with pytest.raises(HTTPException):
+        cpu.resolve("tiny", "float16")
+    gpu = make_registry(FakeLoader(), compute_types=["int8", "float16"], device="cuda")
+    assert gpu.resolve("tiny", "float16") == ("tiny", "float16")
@@ -0,0 +1,292 @@
+"""
+Long-audio transcription for DentalGPT.
+
+A consult recording of several minutes is split at silences found by
+faster-whisper's Silero VAD into chunks of at most CHUNK_SECONDS. The
+chunks are transcribed concurrently on a thread pool and their segment
+timestamps are shifted back onto the recording's timeline. CTranslate2
+releases the GIL and runs up to `num_workers` transcriptions on one
+loaded model at a time, so threads give real parallelism without a model
+copy per process.
+
+Long recordings can also run as background jobs. Job state (status,
+progress, result) is kept in the worker that runs the job and mirrored
+to the shared cache, so with a Redis CACHE_URL any worker can usually
+answer a status poll. Each queued job holds its decoded audio (~115 MB
+per 30 minutes), so the queue is capped overall and per user.
+"""
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from fastapi import HTTPException
+from typing import Callable, Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+import uuid
+
+from audio import SAMPLE_RATE
+from cache import cache_get, cache_set, make_key
+from metrics import Counter, Gauge, registry
+
+logger = logging.getLogger("dentalgpt.transcription")
+
+# Parallel chunk transcriptions; also the Whisper model's num_workers
+TRANSCRIBE_WORKERS = int(os.getenv("TRANSCRIBE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Recordings longer than this (seconds) are split and transcribed in parallel
+LONG_AUDIO_SECONDS = float(os.getenv("LONG_AUDIO_SECONDS", "120"))
+CHUNK_SECONDS = float(os.getenv("TRANSCRIBE_CHUNK_SECONDS", "60"))
+# A pause at least this long may end a chunk
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "500"))
+BEAM_SIZE = 5
+
+# Background jobs: how many run at once, and how long their state is kept (seconds)
+TRANSCRIPTION_JOB_CONCURRENCY = int(os.getenv("TRANSCRIPTION_JOB_CONCURRENCY", "2"))
+TRANSCRIPTION_JOB_TTL = int(os.getenv("TRANSCRIPTION_JOB_TTL", "3600"))
+# Unfinished (queued or running) jobs allowed per worker and per user
+TRANSCRIPTION_JOB_QUEUE_LIMIT = int(os.getenv("TRANSCRIPTION_JOB_QUEUE_LIMIT", "8"))
+TRANSCRIPTION_JOB_USER_LIMIT = int(os.getenv("TRANSCRIPTION_JOB_USER_LIMIT", "2"))
+
+TRANSCRIPTION_JOBS = registry.register(Counter(
+    "dentalgpt_transcription_jobs_total",
+    "Background transcription jobs by outcome (queued, rejected, done, error)"
+))
+TRANSCRIPTION_JOBS_ACTIVE = registry.register(Gauge(
+    "dentalgpt_transcription_jobs_active",
+    "Background transcription jobs queued or running in this worker"
+))
+TRANSCRIPTION_CHUNKS = registry.register(Counter(
+    "dentalgpt_transcription_chunks_total",
+    "Audio chunks transcribed by the long-audio path"
+))
+
+_chunk_pool: Optional[ThreadPoolExecutor] = None
+_chunk_pool_lock = threading.Lock()
+
+
+def _get_chunk_pool() -> ThreadPoolExecutor:
+    global _chunk_pool
+    if _chunk_pool is None:
+        with _chunk_pool_lock:
+            if _chunk_pool is None:
+                _chunk_pool = ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS, thread_name_prefix="whisper-chunk")
+    return _chunk_pool
+
+
+def reset_after_fork():
+    # The parent's pool threads don't exist in the child
+    global _chunk_pool, _chunk_pool_lock
+    _chunk_pool = None
+    _chunk_pool_lock = threading.Lock()
+
+
+def is_long(audio) -> bool:
+    return len(audio) > LONG_AUDIO_SECONDS * SAMPLE_RATE
+
+
+def split_on_silence(audio, max_seconds: float = CHUNK_SECONDS) -> List[Tuple[int, int]]:
+    """(start, end) sample ranges that cover the speech in `audio`.
+
+    Neighbouring speech regions are merged while the chunk stays within
+    max_seconds, so every cut falls in a pause; stretches of silence
+    between chunks are skipped.
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+    options = VadOptions(min_silence_duration_ms=VAD_MIN_SILENCE_MS, max_speech_duration_s=max_seconds)
+    max_samples = int(max_seconds * SAMPLE_RATE)
+    chunks: List[List[int]] = []
+    for region in get_speech_timestamps(audio, options):
+        if chunks and region["end"] - chunks[-1][0] <= max_samples:
+            chunks[-1][1] = region["end"]
+        else:
+            chunks.append([region["start"], region["end"]])
+    return [(start, end) for start, end in chunks]
+
+
+def _transcribe_chunk(model, audio, language: Optional[str]) -> tuple:
+    segments, info = model.transcribe(audio, beam_size=BEAM_SIZE, language=language)
+    # segments is lazy; decode here, on the pool thread
+    return list(segments), info.language
+
+
+def transcribe_long(model, audio, language: Optional[str] = None,
+                    on_progress: Optional[Callable[[int, int], None]] = None) -> dict:
+    """Transcribe 16 kHz samples chunk by chunk in parallel.
+
+    Returns text, language (the one spoken longest), duration and
+    segments with start/end seconds on the whole recording's timeline.
+    on_progress(done, total) is called as chunks finish.
+    """
+    chunks = split_on_silence(audio)
+    if on_progress:
+        on_progress(0, len(chunks))
+    pool = _get_chunk_pool()
+    futures = {pool.submit(_transcribe_chunk, model, audio[start:end], language): i
+               for i, (start, end) in enumerate(chunks)}
+    results = [None] * len(chunks)
+    try:
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            TRANSCRIPTION_CHUNKS.inc()
+            if on_progress:
+                on_progress(done, len(chunks))
+    except Exception:
+        for future in futures:
+            future.cancel()
+        raise
+
+    segments = []
+    spoken = {}
+    for (start, end), (chunk_segments, chunk_language) in zip(chunks, results):
+        offset = start / SAMPLE_RATE
+        for segment in chunk_segments:
+            segments.append({
+                "start": round(offset + segment.start, 2),
+                "end": round(offset + segment.end, 2),
+                "text": segment.text.strip(),
+            })
+        spoken[chunk_language] = spoken.get(chunk_language, 0) + (end - start)
+    return {
+        "text": " ".join(segment["text"] for segment in segments if segment["text"]),
+        "language": max(spoken, key=spoken.get) if spoken else language,
+        "duration": round(len(audio) / SAMPLE_RATE, 2),
+        "segments": segments,
+    }
+
+
+class TranscriptionJobs:
+    """Runs transcriptions in the background.
+
+    The job table in this process is authoritative; the shared cache only
+    mirrors it so other workers can answer polls, and a dropped cache write
+    can at worst make such a poll stale.
+    """
+
+    def __init__(self, max_concurrent: int = TRANSCRIPTION_JOB_CONCURRENCY, ttl: int = TRANSCRIPTION_JOB_TTL,
+                 queue_limit: int = TRANSCRIPTION_JOB_QUEUE_LIMIT, user_limit: int = TRANSCRIPTION_JOB_USER_LIMIT):
+        self.max_concurrent = max_concurrent
+        self.ttl = ttl
+        self.queue_limit = queue_limit
+        self.user_limit = user_limit
+        self._reset_state()
+
+    def _reset_state(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, dict] = {}  # job_id -> state
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent,
+                                                    thread_name_prefix="transcription-job")
+            return self._executor
+
+    def _save(self, state: dict):
+        with self._lock:
+            self._jobs[state["job_id"]] = state
+            mirror = dict(state)
+        cache_set("transcription_job", make_key("transcription_job", state["job_id"]), mirror, self.ttl)
+
+    def _expire(self):
+        # Caller holds self._lock
+        cutoff = time.time() - self.ttl
+        for job_id in [job_id for job_id, state in self._jobs.items()
+                       if state.get("finished_at") and state["finished_at"] < cutoff]:
+            del self._jobs[job_id]
+
+    def _active(self, user_id: Optional[int] = None) -> int:
+        # Caller holds self._lock
+        return sum(1 for state in self._jobs.values()
+                   if state["status"] in ("queued", "running") and (user_id is None or state["user_id"] == user_id))
+
+    def _check_capacity(self, user_id: int):
+        # Caller holds self._lock
+        self._expire()
+        if self._active(user_id) >= self.user_limit:
+            TRANSCRIPTION_JOBS.inc(outcome="rejected")
+            raise HTTPException(
+                status_code=429,
+                detail=f"You already have {self.user_limit} transcriptions in progress; wait for one to finish",
+                headers={"Retry-After": "30"}
+            )
+        if self._active() >= self.queue_limit:
+            TRANSCRIPTION_JOBS.inc(outcome="rejected")
+            raise HTTPException(
+                status_code=503,
+                detail="Transcription queue is full; try again shortly",
+                headers={"Retry-After": "30"}
+            )
+
+    def check_capacity(self, user_id: int):
+        """HTTPException(429) if the user already has user_limit unfinished jobs,
+        HTTPException(503) if this worker's queue is full"""
+        with self._lock:
+            self._check_capacity(user_id)
+
+    def submit(self, user_id: int, audio, transcribe: Callable) -> dict:
+        """Queue transcribe(audio, on_progress) and return the new job's state.
+
+        Raises HTTPException(429/503) when the user's or the worker's queue is full.
+        """
+        state = {
+            "job_id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "status": "queued",
+            "progress": 0.0,
+            "chunks_done": 0,
+            "chunks_total": None,
+            "duration": round(len(audio) / SAMPLE_RATE, 2),
+            "created_at": time.time(),
+            "finished_at": None,
+            "result": None,
+            "error": None,
+        }
+        with self._lock:
+            # Checked under the same lock as the insert, so concurrent submits can't overshoot
+            self._check_capacity(user_id)
+            self._jobs[state["job_id"]] = state
+            queued = self.public(state)  # copied before the job thread starts updating state
+        self._save(state)
+        TRANSCRIPTION_JOBS.inc(outcome="queued")
+        TRANSCRIPTION_JOBS_ACTIVE.inc()
+        self._get_executor().submit(self._run, state, audio, transcribe)
+        return queued
+
+    def get(self, job_id: str, user_id: int) -> Optional[dict]:
+        """A job's state, or None if it is unknown, expired or someone else's"""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            state = dict(state) if state else None
+        if state is None:
+            # Started by another worker
+            state = cache_get("transcription_job", make_key("transcription_job", job_id))
+        if not state or state.get("user_id") != user_id:
+            return None
+        return self.public(state)
+
+    @staticmethod
+    def public(state: dict) -> dict:
+        return {key: value for key, value in state.items() if key != "user_id"}
+
+    def _run(self, state: dict, audio, transcribe: Callable):
+        def on_progress(done: int, total: int):
+            state.update(chunks_done=done, chunks_total=total, progress=round(done / total, 3) if total else 1.0)
+            self._save(state)
+
+        state["status"] = "running"
+        self._save(state)
+        try:
+            state["result"] = transcribe(audio, on_progress)
+            state.update(status="done", progress=1.0)
+            TRANSCRIPTION_JOBS.inc(outcome="done")
+        except Exception as e:
+            logger.exception("Transcription job %s failed", state["job_id"])
+            state.update(status="error", error=str(e))
+            TRANSCRIPTION_JOBS.inc(outcome="error")
+        state["finished_at"] = time.time()
+        self._save(state)
+        TRANSCRIPTION_JOBS_ACTIVE.dec()
+
+    def reset_after_fork(self):
+        self._reset_state()
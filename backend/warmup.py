@@ -0,0 +1,127 @@
+"""
+Model warm-up for DentalGPT.
+
+Loads the Ollama chat, embedding and vision models and the Whisper model
+at startup and again on a schedule, so the first clinician after a deploy
+(or after Ollama unloads an idle model) doesn't wait out a cold start.
+Warm/cold state per model is reported on /ready.
+"""
+from typing import Callable, Dict, List, Optional
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("dentalgpt.warmup")
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() in ("1", "true", "yes")
+# Keep this below Ollama's keep-alive (OLLAMA_KEEP_ALIVE, default 5 minutes)
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", "240"))
+# Which registered targets to warm: any of llm, embedding, vision, whisper
+WARMUP_TARGETS = [t.strip() for t in os.getenv("WARMUP_TARGETS", "llm,embedding,vision,whisper").split(",") if t.strip()]
+
+
+class WarmupTarget:
+    def __init__(self, name: str, warm: Callable[[], Optional[object]], repeat: bool = True):
+        self.name = name
+        self.warm = warm
+        self.repeat = repeat  # False for in-process models that stay loaded once built
+        self.state = "cold"
+        self.last_warmed: Optional[float] = None
+        self.duration_ms: Optional[float] = None
+        self.detail = None
+        self.error: Optional[str] = None
+
+
+class ModelWarmer:
+    """Runs registered warm-up callables once at startup, then every `interval` seconds"""
+
+    def __init__(self, interval: float = WARMUP_INTERVAL, enabled_targets: List[str] = WARMUP_TARGETS,
+                 enabled: bool = WARMUP_ENABLED):
+        self.interval = interval
+        self.enabled_targets = enabled_targets
+        self.enabled = enabled
+        self.targets: Dict[str, WarmupTarget] = {}
+        self.passes = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def register(self, name: str, warm: Callable[[], Optional[object]], repeat: bool = True):
+        if name in self.enabled_targets:
+            self.targets[name] = WarmupTarget(name, warm, repeat)
+
+    def warm_target(self, target: WarmupTarget):
+        with self._lock:
+            if target.state != "warm":
+                target.state = "warming"
+        start = time.perf_counter()
+        try:
+            detail = target.warm()
+        except Exception as e:
+            with self._lock:
+                target.state = "failed"
+                target.error = str(e)
+            logger.warning("Warm-up of %s failed: %s", target.name, e)
+            return
+        with self._lock:
+            target.state = "warm"
+            target.error = None
+            target.detail = detail
+            target.last_warmed = time.time()
+            target.duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        logger.info("Warmed %s in %.1f ms", target.name, target.duration_ms)
+
+    def warm_all(self):
+        for target in list(self.targets.values()):
+            if self._stop.is_set():
+                return
+            if target.state == "warm" and not target.repeat:
+                continue
+            self.warm_target(target)
+        self.passes += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.warm_all()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if not self.enabled or not self.targets or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+    def reset_after_fork(self):
+        """The warm-up thread doesn't survive a fork; each worker's lifespan starts its own"""
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def complete(self) -> bool:
+        """The first pass has finished (or warm-up is off), whatever its outcome"""
+        return not self.enabled or not self.targets or self.passes > 0
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "complete": self.complete,
+                "interval_seconds": self.interval,
+                "models": {
+                    name: {
+                        "state": target.state,
+                        "last_warmed": target.last_warmed,
+                        "duration_ms": target.duration_ms,
+                        "detail": target.detail,
+                        "error": target.error,
+                    }
+                    for name, target in self.targets.items()
+                },
+            }
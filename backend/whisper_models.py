@@ -0,0 +1,215 @@
+"""
+Whisper model registry for DentalGPT.
+
+Transcription can run on any of several faster-whisper model sizes and
+compute types, picked per request (`model`/`compute_type`), per user
+(users.whisper_model) or from WHISPER_MODEL_SIZE. Requests may also name
+a tier: "dictation" (fast, WHISPER_DICTATION_MODEL) or "clinical"
+(accurate, WHISPER_CLINICAL_MODEL).
+
+Loaded models are kept in an LRU under WHISPER_MEMORY_BUDGET_MB, using a
+size estimate per model and compute type. A model that loads but doesn't
+fit evicts the least recently used ones; a model that would not fit even
+alone is refused up front, as is a compute type the device can't run or
+that WHISPER_COMPUTE_TYPES doesn't offer. A transcription already running
+on an evicted model finishes normally; the memory is freed when it drops
+its reference.
+"""
+from collections import OrderedDict
+from fastapi import HTTPException
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+from metrics import Counter, Gauge, Histogram, registry
+from transcription import TRANSCRIBE_WORKERS
+
+logger = logging.getLogger("dentalgpt.whisper")
+
+WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE", "base")  # base for speed, or medium for better accuracy
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+# Compute types requests may choose (WHISPER_COMPUTE_TYPE is always allowed)
+WHISPER_COMPUTE_TYPES = [c.strip() for c in os.getenv("WHISPER_COMPUTE_TYPES", WHISPER_COMPUTE_TYPE).split(",") if c.strip()]
+# Cores per transcription; TRANSCRIBE_WORKERS of them can run at once
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", str(max(1, (os.cpu_count() or 1) // TRANSCRIBE_WORKERS))))
+# Sizes that requests and user settings may choose
+WHISPER_MODELS = [m.strip() for m in os.getenv("WHISPER_MODELS", "tiny,base,small,medium").split(",") if m.strip()]
+WHISPER_TIERS = {
+    "dictation": os.getenv("WHISPER_DICTATION_MODEL", "base"),
+    "clinical": os.getenv("WHISPER_CLINICAL_MODEL", "small"),
+}
+WHISPER_MEMORY_BUDGET_MB = float(os.getenv("WHISPER_MEMORY_BUDGET_MB", "3072"))
+
+# Parameters (millions) per model family; ".en" variants are the same size
+MODEL_PARAMS_M = {
+    "tiny": 39, "base": 74, "small": 244, "medium": 769,
+    "large-v1": 1550, "large-v2": 1550, "large-v3": 1550, "large": 1550,
+    "distil-small": 166, "distil-medium": 394, "distil-large-v2": 756, "distil-large-v3": 756,
+}
+BYTES_PER_PARAM = {
+    "int8": 1, "int8_float32": 1, "int8_float16": 1, "int8_bfloat16": 1,
+    "int16": 2, "float16": 2, "bfloat16": 2, "float32": 4,
+}
+# What CTranslate2 can run on each device; half precision needs a GPU
+DEVICE_COMPUTE_TYPES = {
+    "cpu": {"int8", "int8_float32", "int16", "float32"},
+    "cuda": set(BYTES_PER_PARAM),
+}
+# Weights are most of a loaded model; allow for vocab, caches and per-worker buffers
+RUNTIME_OVERHEAD = 1.5
+
+WHISPER_MODEL_LOADS = registry.register(Counter(
+    "dentalgpt_whisper_model_loads_total",
+    "Whisper model loads by model, compute type and outcome"
+))
+WHISPER_MODEL_LOAD_SECONDS = registry.register(Histogram(
+    "dentalgpt_whisper_model_load_seconds",
+    "Time to load a Whisper model"
+))
+WHISPER_MODEL_EVICTIONS = registry.register(Counter(
+    "dentalgpt_whisper_model_evictions_total",
+    "Whisper models unloaded to stay within the memory budget"
+))
+WHISPER_MODEL_MEMORY = registry.register(Gauge(
+    "dentalgpt_whisper_model_memory_mb",
+    "Estimated memory of the loaded Whisper models"
+))
+
+
+def estimate_mb(size: str, compute_type: str) -> float:
+    family = size[:-3] if size.endswith(".en") else size
+    params = MODEL_PARAMS_M.get(family, MODEL_PARAMS_M["large-v3"])  # unknown: assume the largest
+    return round(params * BYTES_PER_PARAM.get(compute_type, 4) * RUNTIME_OVERHEAD, 1)
+
+
+def load_whisper(size: str, compute_type: str):
+    try:
+        from faster_whisper import WhisperModel
+    except ImportError:
+        raise RuntimeError("Faster-Whisper not installed. Install with: pip install faster-whisper")
+    return WhisperModel(size, device=WHISPER_DEVICE, compute_type=compute_type,
+                        cpu_threads=WHISPER_CPU_THREADS, num_workers=TRANSCRIBE_WORKERS)
+
+
+class WhisperModelRegistry:
+    """Loaded Whisper models, least recently used first, within a memory budget"""
+
+    def __init__(self, loader: Callable[[str, str], Any] = load_whisper,
+                 budget_mb: float = WHISPER_MEMORY_BUDGET_MB, models: List[str] = WHISPER_MODELS,
+                 tiers: Dict[str, str] = WHISPER_TIERS, default_size: str = WHISPER_MODEL_SIZE,
+                 default_compute_type: str = WHISPER_COMPUTE_TYPE,
+                 compute_types: List[str] = WHISPER_COMPUTE_TYPES, device: str = WHISPER_DEVICE):
+        self.loader = loader
+        self.budget_mb = budget_mb
+        self.models = models
+        self.tiers = tiers
+        self.default = (default_size, default_compute_type)
+        runnable = DEVICE_COMPUTE_TYPES.get(device, set(BYTES_PER_PARAM))
+        self.compute_types = [c for c in dict.fromkeys([default_compute_type] + compute_types)
+                              if c in BYTES_PER_PARAM and c in runnable]
+        if default_compute_type not in self.compute_types:
+            logger.warning("WHISPER_COMPUTE_TYPE %s can't run on %s; set one of %s",
+                           default_compute_type, device, ", ".join(sorted(runnable)))
+        self._reset_state()
+
+    def _reset_state(self):
+        self._loaded: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()  # key -> (model, estimated MB)
+        self._lock = threading.Lock()
+        self._load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._errors: Dict[Tuple[str, str], str] = {}
+
+    def resolve(self, model: Optional[str] = None, compute_type: Optional[str] = None) -> Tuple[str, str]:
+        """(size, compute_type) for a requested model or tier.
+
+        HTTPException(400) if the size or compute type isn't offered, or the
+        model would not fit in the memory budget even on its own.
+        """
+        size = self.tiers.get(model, model) if model else self.default[0]
+        compute_type = compute_type or self.default[1]
+        if size not in self.models and size != self.default[0]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown Whisper model: {model}. Available: {', '.join(list(self.tiers) + self.models)}"
+            )
+        if compute_type not in self.compute_types:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported compute type: {compute_type}. Available: {', '.join(self.compute_types)}"
+            )
+        estimate = estimate_mb(size, compute_type)
+        if estimate > self.budget_mb:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Whisper {size} ({compute_type}) needs ~{estimate:.0f} MB, over the {self.budget_mb:.0f} MB budget"
+            )
+        return size, compute_type
+
+    def get(self, size: str, compute_type: str):
+        """The loaded model, loading it (and evicting others) if needed.
+
+        Raises HTTPException(503) if the model can't be loaded.
+        """
+        key = (size, compute_type)
+        with self._lock:
+            if key in self._loaded:
+                self._loaded.move_to_end(key)
+                return self._loaded[key][0]
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        # One load per model at a time; other callers wait for it rather than loading a copy
+        with load_lock:
+            with self._lock:
+                if key in self._loaded:
+                    self._loaded.move_to_end(key)
+                    return self._loaded[key][0]
+            started = time.perf_counter()
+            try:
+                model = self.loader(size, compute_type)
+            except Exception as e:
+                self._errors[key] = str(e)
+                WHISPER_MODEL_LOADS.inc(model=size, compute_type=compute_type, outcome="error")
+                logger.warning("Whisper %s (%s) failed to load: %s", size, compute_type, e)
+                raise HTTPException(status_code=503, detail=f"whisper {size} unavailable: {e}")
+            elapsed = time.perf_counter() - started
+            WHISPER_MODEL_LOADS.inc(model=size, compute_type=compute_type, outcome="loaded")
+            WHISPER_MODEL_LOAD_SECONDS.observe(elapsed, model=size, compute_type=compute_type)
+            estimate = estimate_mb(size, compute_type)
+            with self._lock:
+                # Evict only once the load has succeeded, so a failed load costs nothing
+                self._evict_for(estimate)
+                self._loaded[key] = (model, estimate)
+                self._errors.pop(key, None)
+            WHISPER_MODEL_MEMORY.inc(estimate, model=size, compute_type=compute_type)
+            logger.info("Whisper %s (%s) loaded in %.1f s, ~%.0f MB", size, compute_type, elapsed, estimate)
+            return model
+
+    def _evict_for(self, needed_mb: float):
+        # Caller holds self._lock. resolve() refuses models larger than the whole budget;
+        # the default is not checked there, so it still loads, alone.
+        while self._loaded and self.used_mb() + needed_mb > self.budget_mb:
+            (size, compute_type), (_, estimate) = self._loaded.popitem(last=False)
+            WHISPER_MODEL_EVICTIONS.inc(model=size, compute_type=compute_type)
+            WHISPER_MODEL_MEMORY.dec(estimate, model=size, compute_type=compute_type)
+            logger.info("Evicted Whisper %s (%s) to stay within %.0f MB", size, compute_type, self.budget_mb)
+
+    def used_mb(self) -> float:
+        return sum(estimate for _, estimate in self._loaded.values())
+
+    def status(self) -> dict:
+        with self._lock:
+            loaded = [{"model": size, "compute_type": compute_type, "estimated_mb": estimate}
+                      for (size, compute_type), (_, estimate) in self._loaded.items()]
+            return {
+                "state": "ready" if self.default in self._loaded else "pending",
+                "error": self._errors.get(self.default),
+                "default": {"model": self.default[0], "compute_type": self.default[1]},
+                "loaded": loaded,  # least recently used first
+                "used_mb": round(self.used_mb(), 1),
+                "budget_mb": self.budget_mb,
+            }
+
+    def reset_after_fork(self):
+        """Drop the parent's models; CTranslate2's worker threads don't survive a fork"""
+        self._reset_state()
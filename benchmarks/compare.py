@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Compare two load-test reports written by load_test.py.
+
+    python benchmarks/compare.py reports/1.3.0.json reports/1.4.0.json --threshold 10
+
+Exits with status 1 if any scenario's p95 latency got worse (or throughput
+dropped) by more than --threshold percent.
+"""
+import argparse
+import json
+import sys
+
+METRICS = [("p50_ms", False), ("p95_ms", False), ("p99_ms", False), ("throughput_rps", True)]
+
+
+def change(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return (after - before) / before * 100.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed regression in percent")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline {baseline['meta']['revision']}  vs  candidate {candidate['meta']['revision']}\n")
+    print(f"{'scenario':<12}{'metric':<16}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    regressions = []
+    for name, before in baseline["scenarios"].items():
+        after = candidate["scenarios"].get(name)
+        if after is None:
+            print(f"{name:<12}(missing from candidate)")
+            continue
+        for metric, higher_is_better in METRICS:
+            pct = change(before.get(metric), after.get(metric))
+            pct_text = f"{pct:+.1f}%" if pct is not None else "n/a"
+            print(f"{name:<12}{metric:<16}{str(before.get(metric)):>12}{str(after.get(metric)):>12}{pct_text:>10}")
+            if pct is None or metric in ("p50_ms", "p99_ms"):
+                continue
+            worse = -pct if higher_is_better else pct
+            if worse > args.threshold:
+                regressions.append(f"{name} {metric} {pct_text}")
+        if after.get("errors", 0) > before.get("errors", 0):
+            regressions.append(f"{name} errors {before.get('errors', 0)} -> {after['errors']}")
+
+    if regressions:
+        print("\nRegressions beyond threshold:")
+        for line in regressions:
+            print(f"  - {line}")
+        sys.exit(1)
+    print("\nNo regressions beyond threshold.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Ollama HTTP API, for load testing DentalGPT.
+
+Serves /api/tags, /api/generate and /api/embeddings with configurable
+latency and token rate, so the backend can be benchmarked without GPUs or
+real models.
+
+    python benchmarks/fake_ollama.py --port 11500 --latency-ms 150 --token-rate 40
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import hashlib
+import json
+import random
+import struct
+import threading
+import time
+
+DEFAULT_MODELS = ["llama3.2:3b", "nomic-embed-text:latest", "llava:latest"]
+
+
+class FakeOllamaConfig:
+    def __init__(self, latency_ms=150.0, embed_latency_ms=20.0, token_rate=40.0,
+                 response_tokens=200, dimension=768, models=None, jitter=0.1):
+        self.latency_ms = latency_ms              # time to first token (prompt eval)
+        self.embed_latency_ms = embed_latency_ms
+        self.token_rate = token_rate              # generated tokens per second
+        self.response_tokens = response_tokens
+        self.dimension = dimension
+        self.models = models or list(DEFAULT_MODELS)
+        self.jitter = jitter                      # +/- fraction applied to every delay
+
+
+def _sleep(seconds: float, jitter: float):
+    if seconds > 0:
+        time.sleep(seconds * random.uniform(1 - jitter, 1 + jitter))
+
+
+def fake_embedding(text: str, dimension: int):
+    """Deterministic unit-ish vector derived from the text"""
+    values = []
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    while len(values) < dimension:
+        seed = hashlib.sha256(seed).digest()
+        values.extend(v / 2**31 for v in struct.unpack("<8i", seed))
+    return values[:dimension]
+
+
+def make_handler(config: FakeOllamaConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _check_model(self, model):
+            if model not in config.models and f"{model}:latest" not in config.models:
+                self._send_json({"error": f"model '{model}' not found, try pulling it first"}, status=404)
+                return False
+            return True
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": m, "size": 0, "digest": ""} for m in config.models]})
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            payload = self._read_json()
+            model = payload.get("model", "")
+            if self.path == "/api/embeddings":
+                if not self._check_model(model):
+                    return
+                _sleep(config.embed_latency_ms / 1000.0, config.jitter)
+                self._send_json({"embedding": fake_embedding(payload.get("prompt", ""), config.dimension)})
+            elif self.path == "/api/generate":
+                if not self._check_model(model):
+                    return
+                _sleep(config.latency_ms / 1000.0, config.jitter)
+                if config.token_rate > 0:
+                    _sleep(config.response_tokens / config.token_rate, config.jitter)
+                text = " ".join(["token"] * config.response_tokens)
+                self._send_json({
+                    "model": model,
+                    "response": text,
+                    "done": True,
+                    "eval_count": config.response_tokens,
+                })
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+    return Handler
+
+
+def start_fake_ollama(config: FakeOllamaConfig, host="127.0.0.1", port=0):
+    """Start in a daemon thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Time to first token")
+    parser.add_argument("--embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--token-rate", type=float, default=40.0, help="Generated tokens per second (0 = instant)")
+    parser.add_argument("--response-tokens", type=int, default=200)
+    parser.add_argument("--dimension", type=int, default=768)
+    args = parser.parse_args()
+
+    config = FakeOllamaConfig(args.latency_ms, args.embed_latency_ms, args.token_rate,
+                              args.response_tokens, args.dimension)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    server.serve_forever()
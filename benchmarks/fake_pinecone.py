@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a Pinecone serverless index, for load testing DentalGPT.
+
+Implements the data-plane calls the backend makes (query, upsert,
+describe_index_stats) with configurable latency. Point the backend at it
+with PINECONE_INDEX_HOST=http://127.0.0.1:<port>.
+
+    python benchmarks/fake_pinecone.py --port 5081 --latency-ms 40
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import threading
+import time
+
+SAMPLE_CHUNK = (
+    "Periapical radiographs should be taken before endodontic treatment to assess root "
+    "morphology, periapical status and canal curvature. Rubber dam isolation is mandatory. "
+)
+
+
+class FakePineconeConfig:
+    def __init__(self, latency_ms=40.0, upsert_latency_ms=20.0, chunk_chars=1000, dimension=768, jitter=0.1):
+        self.latency_ms = latency_ms
+        self.upsert_latency_ms = upsert_latency_ms
+        self.chunk_chars = chunk_chars  # size of the 'text' metadata on each match
+        self.dimension = dimension
+        self.jitter = jitter
+
+
+def make_handler(config: FakePineconeConfig):
+    chunk = (SAMPLE_CHUNK * (config.chunk_chars // len(SAMPLE_CHUNK) + 1))[:config.chunk_chars]
+    state = {"vectors": 0, "lock": threading.Lock()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _delay(self, ms):
+            if ms > 0:
+                time.sleep(ms / 1000.0 * random.uniform(1 - config.jitter, 1 + config.jitter))
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _stats(self):
+            return {"dimension": config.dimension, "indexFullness": 0.0,
+                    "namespaces": {"": {"vectorCount": state["vectors"]}},
+                    "totalVectorCount": state["vectors"]}
+
+        def do_GET(self):
+            if self.path.startswith("/describe_index_stats"):
+                self._send_json(self._stats())
+            else:
+                self._send_json({"message": "not found"}, status=404)
+
+        def do_POST(self):
+            payload = self._read_json()
+            if self.path == "/query":
+                self._delay(config.latency_ms)
+                top_k = int(payload.get("topK", 5))
+                matches = [
+                    {
+                        "id": f"doc_bench_{i}",
+                        "score": round(0.9 - i * 0.05, 4),
+                        "values": [],
+                        "metadata": {"text": chunk, "chunk_index": i, "total_chunks": top_k,
+                                     "source_file": "guidelines.pdf", "title": "Clinical guidelines"},
+                    }
+                    for i in range(top_k)
+                ]
+                self._send_json({"matches": matches, "namespace": ""})
+            elif self.path == "/vectors/upsert":
+                self._delay(config.upsert_latency_ms)
+                count = len(payload.get("vectors", []))
+                with state["lock"]:
+                    state["vectors"] += count
+                self._send_json({"upsertedCount": count})
+            elif self.path == "/describe_index_stats":
+                self._send_json(self._stats())
+            else:
+                self._send_json({"message": "not found"}, status=404)
+
+    return Handler
+
+
+def start_fake_pinecone(config: FakePineconeConfig, host="127.0.0.1", port=0):
+    """Start in a daemon thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5081)
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--upsert-latency-ms", type=float, default=20.0)
+    parser.add_argument("--chunk-chars", type=int, default=1000)
+    args = parser.parse_args()
+
+    config = FakePineconeConfig(args.latency_ms, args.upsert_latency_ms, args.chunk_chars)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    print(f"Fake Pinecone listening on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test for the DentalGPT backend.
+
+Starts fake Ollama and Pinecone servers, prepares a Postgres database with a
+test user, chats and a JWT (no Google sign-in), launches backend/main.py
+under uvicorn, and drives the main endpoints at a configurable concurrency.
+Prints p50/p95/p99 latency and throughput per scenario and can save a JSON
+report to compare between releases (see compare.py).
+
+    # Postgres from RDS_* env vars (use a throwaway database!)
+    python benchmarks/load_test.py --concurrency 16 --requests 200 --output reports/1.4.0.json
+
+    # No Postgres installed: `pip install pgserver` and let it start one
+    python benchmarks/load_test.py --embedded-postgres
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import base64
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import psycopg2
+import requests
+
+from fake_ollama import FakeOllamaConfig, start_fake_ollama
+from fake_pinecone import FakePineconeConfig, start_fake_pinecone
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+BACKEND_DIR = os.path.join(ROOT, "backend")
+SCHEMA_FILE = os.path.join(ROOT, "scripts", "setup_database.sql")
+SCENARIOS = ["chat", "query", "upload", "transcribe"]
+JWT_SECRET = "loadtest-secret"
+
+QUESTIONS = [
+    "What are the indications for a pulpotomy in primary molars?",
+    "How should I manage a patient on warfarin before an extraction?",
+    "Which local anaesthetic is safest in pregnancy?",
+    "What is the recommended recall interval for a low caries risk adult?",
+    "How do I treat dry socket after a lower third molar extraction?",
+]
+
+
+# ---------------------------------------------------------------------------
+# Database
+# ---------------------------------------------------------------------------
+
+def start_embedded_postgres(data_dir: str) -> dict:
+    """Start a throwaway Postgres via the optional `pgserver` package"""
+    try:
+        import pgserver
+    except ImportError:
+        sys.exit("--embedded-postgres needs the pgserver package: pip install pgserver")
+    from urllib.parse import urlparse, parse_qs
+    server = pgserver.get_server(data_dir, cleanup_mode="stop")
+    uri = urlparse(server.get_uri())
+    query = parse_qs(uri.query)
+    return {
+        "RDS_HOST": query.get("host", [uri.hostname or "localhost"])[0],
+        "RDS_PORT": str(uri.port or 5432),
+        "RDS_DATABASE": uri.path.lstrip("/") or "postgres",
+        "RDS_USER": uri.username or "postgres",
+        "RDS_PASSWORD": uri.password or "",
+    }
+
+
+def db_connect(db_env: dict):
+    return psycopg2.connect(
+        host=db_env["RDS_HOST"], port=db_env["RDS_PORT"], database=db_env["RDS_DATABASE"],
+        user=db_env["RDS_USER"], password=db_env["RDS_PASSWORD"]
+    )
+
+
+def prepare_database(db_env: dict, chats: int) -> tuple:
+    """Create the schema, a load-test user and one chat per virtual user"""
+    conn = db_connect(db_env)
+    cur = conn.cursor()
+    with open(SCHEMA_FILE) as f:
+        cur.execute(f.read())
+    cur.execute(
+        """INSERT INTO users (google_id, email, name) VALUES ('loadtest-user', 'loadtest@example.com', 'Load Test')
+           ON CONFLICT (google_id) DO UPDATE SET updated_at = CURRENT_TIMESTAMP
+           RETURNING id"""
+    )
+    user_id = cur.fetchone()[0]
+    chat_ids = []
+    for i in range(chats):
+        cur.execute("INSERT INTO chats (user_id, title) VALUES (%s, %s) RETURNING id", (user_id, f"Load test {i}"))
+        chat_ids.append(cur.fetchone()[0])
+    conn.commit()
+    cur.close()
+    conn.close()
+    return user_id, chat_ids
+
+
+def make_jwt(user_id: int) -> str:
+    sys.path.insert(0, BACKEND_DIR)
+    os.environ["JWT_SECRET"] = JWT_SECRET
+    from auth import create_jwt_token
+    return create_jwt_token(user_id)
+
+
+# ---------------------------------------------------------------------------
+# Backend process
+# ---------------------------------------------------------------------------
+
+def start_backend(port: int, env: dict, workers: int) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+           "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        cmd += ["--workers", str(workers)]
+    process = subprocess.Popen(cmd, cwd=BACKEND_DIR, env={**os.environ, **env})
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"Backend exited during startup (code {process.returncode})")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    sys.exit("Backend did not become healthy within 60s")
+
+
+# ---------------------------------------------------------------------------
+# Payloads
+# ---------------------------------------------------------------------------
+
+def synthetic_wav(seconds: float, rate: int = 16000) -> bytes:
+    """Mono 16-bit WAV with a voice-band tone, enough for Whisper to chew on"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        frames = bytearray()
+        for n in range(int(seconds * rate)):
+            sample = int(8000 * math.sin(2 * math.pi * 220 * n / rate) * (0.5 + 0.5 * math.sin(2 * math.pi * 3 * n / rate)))
+            frames += sample.to_bytes(2, "little", signed=True)
+        wav.writeframes(bytes(frames))
+    return buffer.getvalue()
+
+
+def synthetic_document(kb: int) -> bytes:
+    paragraph = ("Section 4.2 Endodontic assessment. " + " ".join(QUESTIONS) + "\n").encode("utf-8")
+    return (paragraph * (kb * 1024 // len(paragraph) + 1))[:kb * 1024]
+
+
+class Scenario:
+    def __init__(self, name, base_url, token, chat_ids, args):
+        self.name = name
+        self.base_url = base_url
+        self.headers = {"Authorization": f"Bearer {token}"}
+        self.chat_ids = chat_ids
+        self.args = args
+        self.local = threading.local()
+        if name == "upload":
+            self.document = synthetic_document(args.doc_kb)
+        if name == "transcribe":
+            self.audio_b64 = base64.b64encode(synthetic_wav(args.audio_seconds)).decode("ascii")
+
+    def session(self) -> requests.Session:
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers.update(self.headers)
+        return self.local.session
+
+    def request(self, i: int) -> requests.Response:
+        session = self.session()
+        question = QUESTIONS[i % len(QUESTIONS)] + f" (case {i})"
+        if self.name == "chat":
+            chat_id = self.chat_ids[i % len(self.chat_ids)]
+            return session.post(f"{self.base_url}/api/chats/{chat_id}/messages",
+                                json={"query": question, "model_provider": "ollama"}, timeout=300)
+        if self.name == "query":
+            return session.post(f"{self.base_url}/api/query",
+                                json={"query": question, "model_provider": "ollama"}, timeout=300)
+        if self.name == "upload":
+            files = {"file": (f"guidelines_{i}.txt", self.document, "text/plain")}
+            return session.post(f"{self.base_url}/api/upload-document", files=files, timeout=300)
+        if self.name == "transcribe":
+            return session.post(f"{self.base_url}/api/voice/transcribe",
+                                json={"audio_data": self.audio_b64}, timeout=300)
+        raise ValueError(self.name)
+
+
+# ---------------------------------------------------------------------------
+# Runner and report
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(math.ceil(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def run_scenario(scenario: Scenario, concurrency: int, total: int, warmup: int) -> dict:
+    for i in range(warmup):
+        scenario.request(-(i + 1))
+
+    latencies, errors, statuses = [], 0, {}
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            status = scenario.request(i).status_code
+        except requests.RequestException:
+            status = "error"
+        elapsed = time.perf_counter() - started
+        with lock:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda v: round(v * 1000, 1) if v is not None else None
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "status_codes": statuses,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def print_table(results: dict):
+    print(f"\n{'scenario':<12}{'reqs':>6}{'err':>5}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<12}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>9}"
+              f"{str(r['p50_ms']):>10}{str(r['p95_ms']):>10}{str(r['p99_ms']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated subset of {SCENARIOS}")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--warmup", type=int, default=3, help="Unmeasured requests per scenario")
+    parser.add_argument("--port", type=int, default=8765, help="Port for the backend under test")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--base-url", help="Benchmark an already running backend instead of starting one "
+                                           f"(it must use JWT_SECRET={JWT_SECRET} and the same database)")
+    parser.add_argument("--embedded-postgres", action="store_true", help="Start a throwaway Postgres via pgserver")
+    parser.add_argument("--ollama-latency-ms", type=float, default=150.0)
+    parser.add_argument("--ollama-embed-latency-ms", type=float, default=20.0)
+    parser.add_argument("--ollama-token-rate", type=float, default=40.0)
+    parser.add_argument("--ollama-response-tokens", type=int, default=200)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=40.0)
+    parser.add_argument("--doc-kb", type=int, default=64, help="Size of the uploaded document")
+    parser.add_argument("--audio-seconds", type=float, default=5.0, help="Length of the transcribed clip")
+    parser.add_argument("--output", help="Write the JSON report here")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    if args.embedded_postgres:
+        db_env = start_embedded_postgres(tempfile.mkdtemp(prefix="dentalgpt-pg-"))
+    else:
+        db_env = {k: os.getenv(k, d) for k, d in [("RDS_HOST", "localhost"), ("RDS_PORT", "5432"),
+                                                   ("RDS_DATABASE", "dentalgpt"), ("RDS_USER", "postgres"),
+                                                   ("RDS_PASSWORD", "")]}
+    user_id, chat_ids = prepare_database(db_env, max(1, args.concurrency))
+    token = make_jwt(user_id)
+
+    process = None
+    base_url = args.base_url
+    if not base_url:
+        _, ollama_url = start_fake_ollama(FakeOllamaConfig(
+            args.ollama_latency_ms, args.ollama_embed_latency_ms, args.ollama_token_rate, args.ollama_response_tokens))
+        _, pinecone_url = start_fake_pinecone(FakePineconeConfig(args.pinecone_latency_ms))
+        env = {
+            **db_env,
+            "JWT_SECRET": JWT_SECRET,
+            "OLLAMA_BASE_URL": ollama_url,
+            "PINECONE_API_KEY": "loadtest",
+            "PINECONE_INDEX_HOST": pinecone_url,
+            "GEMINI_API_KEY": "",
+            "GLM_API_KEY": "",
+            "LOG_LEVEL": "WARNING",
+        }
+        process = start_backend(args.port, env, args.workers)
+        base_url = f"http://127.0.0.1:{args.port}"
+
+    results = {}
+    try:
+        for name in scenarios:
+            print(f"Running {name}: {args.requests} requests at concurrency {args.concurrency}...")
+            scenario = Scenario(name, base_url, token, chat_ids, args)
+            results[name] = run_scenario(scenario, args.concurrency, args.requests, args.warmup)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    print_table(results)
+    if args.output:
+        report = {
+            "meta": {
+                "revision": git_revision(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "args": vars(args),
+            },
+            "scenarios": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Fixtures for the request-path microbenchmarks.
+
+Inputs are sized like production traffic: a ~300 page guideline PDF worth of
+extracted text, a full 10-message chat history, and a 5 MB X-ray.
+"""
+from types import SimpleNamespace
+import base64
+import io
+import os
+import random
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.abspath(os.path.join(HERE, "..", ".."))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+BASELINE_DIR = os.path.join(HERE, "baselines")
+SAMPLE_GUIDELINES = os.path.join(ROOT, "scripts", "sample_dental_guidelines.txt")
+
+
+def pytest_configure(config):
+    # Keep saved runs next to the suite regardless of the working directory,
+    # so baselines are committed and diffed in review
+    storage = getattr(config.option, "benchmark_storage", None)
+    if storage is not None and storage in ("file://./.benchmarks", "./.benchmarks"):
+        config.option.benchmark_storage = f"file://{BASELINE_DIR}"
+
+
+@pytest.fixture(scope="session")
+def guideline_text():
+    with open(SAMPLE_GUIDELINES, encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.fixture(scope="session")
+def large_document_text(guideline_text):
+    """Text extracted from a ~300 page PDF (about 1 MB)"""
+    pages = []
+    for page in range(300):
+        pages.append(f"Page {page + 1}\n{guideline_text[:3000]}")
+    return "\n".join(pages)
+
+
+@pytest.fixture(scope="session")
+def pinecone_matches(guideline_text):
+    """top_k=5 matches with full 1000-character chunks in metadata"""
+    return [
+        SimpleNamespace(
+            score=0.9 - i * 0.05,
+            metadata={"text": guideline_text[i * 500:i * 500 + 1000], "chunk_index": i, "total_chunks": 40,
+                      "source_file": "guidelines.pdf", "title": "Clinical guidelines"},
+        )
+        for i in range(5)
+    ]
+
+
+@pytest.fixture(scope="session")
+def patient_info():
+    return {
+        "id": "P-10442", "name": "Jordan Avery", "email": "jordan@example.com", "phone": "+1 555 0100",
+        "date_of_birth": "1979-04-02", "gender": "female", "address": "12 Harbour Road, Springfield",
+        "summary": "Long-standing bruxism, recurrent caries on posterior restorations.",
+        "medical_history": "Type 2 diabetes (metformin), hypertension. " * 5,
+        "dental_history": "RCT on 36 (2019), implant 46 (2021), SRP every 6 months. " * 5,
+        "allergies": "Penicillin", "medications": "Metformin 500mg, Lisinopril 10mg",
+    }
+
+
+@pytest.fixture(scope="session")
+def xray_jpeg():
+    """A ~5 MB JPEG X-ray (3600x2700 greyscale with film-grain noise)"""
+    Image = pytest.importorskip("PIL.Image")
+    width, height = 3600, 2700
+    rng = random.Random(42)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.frombytes("L", (width, height), rng.randbytes(width * height))
+    img = Image.blend(gradient, noise, 0.35)
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=95)
+    return output.getvalue()
+
+
+@pytest.fixture(scope="session")
+def xray_base64(xray_jpeg):
+    return base64.b64encode(xray_jpeg).decode("utf-8")
+
+
+@pytest.fixture(scope="session")
+def long_chat_history(guideline_text, xray_base64):
+    """10 most recent messages, newest first, one user turn carrying an X-ray"""
+    messages = []
+    for i in range(10):
+        is_user = i % 2 == 1
+        messages.append({
+            "message_type": "user" if is_user else "ai",
+            "content": (f"Question {i}: what about tooth 3{i}? " * 20) if is_user else guideline_text[:2500],
+            "image": xray_base64 if i == 5 else None,
+            "created_at": None,
+        })
+    return messages
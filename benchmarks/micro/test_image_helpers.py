@@ -0,0 +1,15 @@
+"""Microbenchmarks for X-ray handling in generate_llm_response."""
+import pytest
+
+from rag_utils import MAX_VISION_IMAGE_SIZE, resize_image_for_vision
+
+pytest.importorskip("PIL")
+
+
+def test_resize_xray_for_vision(benchmark, xray_jpeg):
+    from PIL import Image
+    import io
+
+    resized = benchmark(resize_image_for_vision, xray_jpeg)
+    assert max(Image.open(io.BytesIO(resized)).size) <= MAX_VISION_IMAGE_SIZE
+
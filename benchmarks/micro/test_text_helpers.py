@@ -0,0 +1,50 @@
+"""Microbenchmarks for chunking, context/source building and prompt assembly."""
+import pytest
+
+from rag_utils import (
+    build_chat_history, build_chat_prompt, build_context, build_patient_context,
+    build_query_prompt, chunk_text, is_conversation_ending
+)
+
+
+def test_chunk_large_document(benchmark, large_document_text):
+    chunks = benchmark(chunk_text, large_document_text)
+    assert len(chunks) >= len(large_document_text) // 800
+
+
+def test_build_context_and_truncate_sources(benchmark, pinecone_matches):
+    context, sources = benchmark(build_context, pinecone_matches)
+    assert len(sources) == 5
+    assert all(len(source["text"]) <= 203 for source in sources)
+
+
+def test_build_chat_history(benchmark, long_chat_history):
+    history, previous_image = benchmark(build_chat_history, long_chat_history)
+    assert previous_image is not None
+    assert history.count("User:") == 5
+
+
+def test_assemble_chat_prompt(benchmark, pinecone_matches, long_chat_history, patient_info):
+    def assemble():
+        context, _ = build_context(pinecone_matches)
+        history, _ = build_chat_history(long_chat_history)
+        patient_context = build_patient_context(patient_info)
+        return build_chat_prompt("Summarize the findings on the last X-ray", context, patient_context, history, True)
+
+    prompt = benchmark(assemble)
+    assert "Patient Information" in prompt
+
+
+def test_assemble_query_prompt(benchmark, pinecone_matches):
+    context, _ = build_context(pinecone_matches)
+    prompt = benchmark(build_query_prompt, "How do I manage dry socket?", context)
+    assert "dry socket" in prompt
+
+
+@pytest.mark.parametrize("query", [
+    "ok thanks",
+    "What is the recommended irrigation protocol for a necrotic pulp with a periapical lesion?",
+    "Can you summarize this patient's history and tell me whether an implant is contraindicated? " * 5,
+], ids=["closing", "question", "long-question"])
+def test_is_conversation_ending(benchmark, query):
+    benchmark(is_conversation_ending, query)
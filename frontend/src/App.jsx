@@ -1,8 +1,9 @@
-import React, { useState, useEffect } from 'react'
+import React, { useState, useEffect, useRef } from 'react'
 import axios from 'axios'
 import { Plus, Grid3x3, Folder, Smile, Settings, Paperclip, ArrowUp, ChevronRight, ChevronDown, Upload, X, Clock, FileText, Star, Mic, MicOff, LogOut, Edit2, Trash2, Save, Send, User, Search } from 'lucide-react'
 import Auth from './Auth'
 import { LiveWaveform } from './LiveWaveform'
+import { AuthImage } from './AuthImage'
 import ReactMarkdown from 'react-markdown'
 import remarkGfm from 'remark-gfm'
 import './App.css'
@@ -61,6 +62,8 @@ function App() {
     // Load from localStorage or default to 'ollama'
     return localStorage.getItem('model_provider') || 'ollama'
   })
+  // Opt-in: questions carry patient data, so they only go to another provider if the user allows it
+  const [allowFallback, setAllowFallback] = useState(() => localStorage.getItem('allow_fallback') === 'true')
   const [isRecording, setIsRecording] = useState(false)
   const [mediaRecorder, setMediaRecorder] = useState(null)
   const [audioStream, setAudioStream] = useState(null) // Share stream with LiveWaveform
@@ -78,7 +81,7 @@ function App() {
   const [uploadTitle, setUploadTitle] = useState('')
   const [uploading, setUploading] = useState(false)
   const [uploadStatus, setUploadStatus] = useState('')
-  const [uploadedImage, setUploadedImage] = useState(null) // Store base64 image data
+  const [uploadedImageId, setUploadedImageId] = useState(null) // document_id of the uploaded image
   const [uploadedImagePreview, setUploadedImagePreview] = useState(null) // Store image preview URL
   const [editingChatId, setEditingChatId] = useState(null)
   const [editingChatTitle, setEditingChatTitle] = useState('')
@@ -96,6 +99,8 @@ function App() {
   const [patients, setPatients] = useState([])
   const [selectedPatient, setSelectedPatient] = useState(null)
   const [patientSearchQuery, setPatientSearchQuery] = useState('')
+  const [patientsCursor, setPatientsCursor] = useState(null)
+  const patientsRequestRef = useRef(0)
   const [showAddPatientForm, setShowAddPatientForm] = useState(false)
   const [newPatient, setNewPatient] = useState({
     id: '',
@@ -168,9 +173,15 @@ function App() {
     if (user && authToken) {
       loadUserChats()
       loadRecentQueries()
-      loadPatients()
     }
   }, [user, authToken])
+
+  // Patients are searched server-side; wait for a pause in typing before asking
+  useEffect(() => {
+    if (!user || !authToken) return
+    const timer = setTimeout(() => loadPatients(), patientSearchQuery ? 250 : 0)
+    return () => clearTimeout(timer)
+  }, [user, authToken, patientSearchQuery])
   
   useEffect(() => {
     if (selectedPatient?.id) {
@@ -190,7 +201,7 @@ function App() {
     if (patientId) {
       loadPatientHistory()
     }
-  }, [patientId])
+  }, [patientId, authToken])
   
   // Update patient summary when switching to a chat that's linked to a different patient
   useEffect(() => {
@@ -243,6 +254,10 @@ function App() {
     localStorage.setItem('model_provider', modelProvider)
   }, [modelProvider])
 
+  useEffect(() => {
+    localStorage.setItem('allow_fallback', allowFallback ? 'true' : 'false')
+  }, [allowFallback])
+
   useEffect(() => {
     // Close dropdown when clicking outside
     const handleClickOutside = (event) => {
@@ -323,7 +338,9 @@ function App() {
           type: msg.message_type,
           content: msg.content,
           sources: sources,
-          image: msg.image ? `data:image/jpeg;base64,${msg.image}` : null,
+          image: msg.image ? `data:image/jpeg;base64,${msg.image}` : null, // messages saved before image ids
+          imageId: msg.image_id,
+          imageUrl: msg.image_url, // the decoded preview for DICOM, which browsers can't show
           timestamp: new Date(msg.created_at)
         }
       })
@@ -346,14 +363,35 @@ function App() {
   }
 
   const loadRecentQueries = async () => {
+    if (!authToken) return
     try {
-      const response = await axios.get(`${API_BASE_URL}/api/recent-queries?limit=10`)
+      const response = await axios.get(`${API_BASE_URL}/api/recent-queries`, {
+        params: { limit: 5, preview: true },
+        headers: { Authorization: `Bearer ${authToken}` }
+      })
       setRecentQueries(response.data.queries || [])
     } catch (error) {
       console.error('Error loading recent queries:', error)
     }
   }
 
+  // Sidebar rows are previews; a truncated one is fetched in full before it is reused
+  const reuseQuery = async (item) => {
+    createNewChat()
+    let text = item.query_text
+    if (item.truncated) {
+      try {
+        const response = await axios.get(`${API_BASE_URL}/api/queries/${item.id}`, {
+          headers: { Authorization: `Bearer ${authToken}` }
+        })
+        text = response.data.query_text
+      } catch (error) {
+        console.error('Error loading query:', error)
+      }
+    }
+    setTimeout(() => setQuery(text), 100)
+  }
+
   const handleAuthSuccess = (userData, token) => {
     console.log('Auth successful, user:', userData)
     setUser(userData)
@@ -573,7 +611,8 @@ function App() {
 
       recorder.onstop = async () => {
         setVoiceState('thinking')
-        const audioBlob = new Blob(audioChunks, { type: 'audio/wav' })
+        // MediaRecorder records webm/opus (or ogg/mp4), not WAV; keep its real type
+        const audioBlob = new Blob(audioChunks, { type: recorder.mimeType || 'audio/webm' })
         await transcribeAudio(audioBlob)
         
         // Cleanup stream
@@ -607,27 +646,20 @@ function App() {
   const transcribeAudio = async (audioBlob) => {
     try {
       setVoiceState('thinking')
-      // Convert blob to base64
-      const reader = new FileReader()
-      reader.onloadend = async () => {
-        try {
-          const base64Audio = reader.result.split(',')[1]
-          
-          const response = await axios.post(
-            `${API_BASE_URL}/api/voice/transcribe`,
-            { audio_data: base64Audio },
-            { headers: { Authorization: `Bearer ${authToken}` } }
-          )
-          
-          setQuery(response.data.text)
-          setVoiceState('idle')
-        } catch (error) {
-          console.error('Error transcribing audio:', error)
-          alert('Failed to transcribe audio. Please try again.')
-          setVoiceState('idle')
+      // Send the recording as the raw request body; the server decodes it in memory
+      const response = await axios.post(
+        `${API_BASE_URL}/api/voice/transcribe`,
+        audioBlob,
+        {
+          headers: {
+            'Content-Type': audioBlob.type || 'audio/webm',
+            Authorization: `Bearer ${authToken}`
+          }
         }
-      }
-      reader.readAsDataURL(audioBlob)
+      )
+      
+      setQuery(response.data.text)
+      setVoiceState('idle')
     } catch (error) {
       console.error('Error transcribing audio:', error)
       alert('Failed to transcribe audio. Please try again.')
@@ -635,13 +667,22 @@ function App() {
     }
   }
 
-  const loadPatients = async () => {
+  const loadPatients = async (cursor = null) => {
     if (!authToken) return
+    const requestId = ++patientsRequestRef.current
     try {
+      const params = {}
+      if (patientSearchQuery.trim()) params.q = patientSearchQuery.trim()
+      if (cursor) params.cursor = cursor
       const response = await axios.get(`${API_BASE_URL}/api/patients`, {
+        params,
         headers: { Authorization: `Bearer ${authToken}` }
       })
-      setPatients(response.data.patients || [])
+      // Ignore responses to searches the user has already typed past
+      if (requestId !== patientsRequestRef.current) return
+      const page = response.data.patients || []
+      setPatients(prevPatients => cursor ? [...prevPatients, ...page] : page)
+      setPatientsCursor(response.data.next_cursor || null)
     } catch (error) {
       console.error('Error loading patients:', error)
     }
@@ -717,9 +758,12 @@ function App() {
   }
   
   const loadPatientHistory = async () => {
-    if (!patientId) return
+    if (!patientId || !authToken) return
     try {
-      const response = await axios.get(`${API_BASE_URL}/api/patient-history/${patientId}`)
+      const response = await axios.get(`${API_BASE_URL}/api/patient-history/${patientId}`, {
+        params: { limit: 5, preview: true },
+        headers: { Authorization: `Bearer ${authToken}` }
+      })
       setPatientHistory(response.data.history || [])
     } catch (error) {
       console.error('Error loading patient history:', error)
@@ -798,13 +842,6 @@ function App() {
     }
   }
   
-  const filteredPatients = patients.filter(patient => {
-    const searchLower = patientSearchQuery.toLowerCase()
-    return patient.name.toLowerCase().includes(searchLower) || 
-           patient.id.toLowerCase().includes(searchLower) ||
-           (patient.email && patient.email.toLowerCase().includes(searchLower))
-  })
-  
   const handleCreatePatient = async (e) => {
     e.preventDefault()
     if (!authToken) {
@@ -1018,13 +1055,14 @@ function App() {
         const requestData = {
           query: queryText,
           patient_id: patientId || null,
-          model_provider: modelProvider
+          model_provider: modelProvider,
+          allow_fallback: allowFallback
         }
         
-        // Include image data if an image was uploaded
-        if (uploadedImage) {
-          requestData.image_data = uploadedImage
-          console.log('[DEBUG] Sending image with query. Image data length:', uploadedImage.length)
+        // Reference the uploaded image by id; its bytes are already on the server
+        if (uploadedImageId) {
+          requestData.image_id = uploadedImageId
+          console.log('[DEBUG] Sending image with query. Image id:', uploadedImageId)
         } else {
           console.log('[DEBUG] No image data to send')
         }
@@ -1041,15 +1079,11 @@ function App() {
           type: 'ai',
           content: response.data.ai_message.content,
           sources: response.data.ai_message.sources,
+          provider: response.data.ai_message.provider,
+          requestedProvider: modelProvider,
           timestamp: new Date()
         }
         
-        // Update user message with image from backend if provided
-        const userMessageFromBackend = response.data.user_message
-        const userMessageImage = userMessageFromBackend.image 
-          ? `data:image/jpeg;base64,${userMessageFromBackend.image}` 
-          : null
-        
         // Clear uploaded image after successfully sending
         clearUploadedImage()
 
@@ -1060,9 +1094,6 @@ function App() {
               messages: chat.messages.map(msg => {
                 if (msg.id === thinkingMessageId) {
                   return aiMessage
-                } else if (msg.id === userMessageId && userMessageImage) {
-                  // Update user message with image from backend
-                  return { ...msg, image: userMessageImage }
                 }
                 return msg
               })
@@ -1106,7 +1137,8 @@ function App() {
         const response = await axios.post(`${API_BASE_URL}/api/query`, {
           query: queryText,
           patient_id: patientId || null,
-          model_provider: modelProvider
+          model_provider: modelProvider,
+          allow_fallback: allowFallback
         })
 
         const aiMessage = {
@@ -1114,6 +1146,8 @@ function App() {
           type: 'ai',
           content: response.data.answer,
           sources: response.data.sources || [],
+          provider: response.data.provider,
+          requestedProvider: modelProvider,
           timestamp: new Date()
         }
 
@@ -1260,17 +1294,18 @@ function App() {
       }
       reader.readAsDataURL(file)
 
-      // Upload to backend
+      // Upload to backend; the preview above is local, so skip the base64 echo
       const formData = new FormData()
       formData.append('file', file)
-      if (selectedPatient?.id) {
-        formData.append('patient_id', selectedPatient.id)
-      }
 
       const response = await axios.post(
         `${API_BASE_URL}/api/upload-image`,
         formData,
         {
+          params: {
+            return_data: false,
+            ...(selectedPatient?.id && { patient_id: selectedPatient.id })
+          },
           headers: {
             'Content-Type': 'multipart/form-data',
             ...(authToken && { Authorization: `Bearer ${authToken}` })
@@ -1278,9 +1313,9 @@ function App() {
         }
       )
 
-      // Store base64 image data for sending with queries
-      console.log('Image uploaded, storing base64 data. Length:', response.data.image_data?.length)
-      setUploadedImage(response.data.image_data)
+      // Store the document id for sending with queries
+      console.log('Image uploaded, document id:', response.data.document_id)
+      setUploadedImageId(response.data.document_id)
       setUploadStatus(`✓ X-ray uploaded: ${response.data.filename}`)
       
       setTimeout(() => {
@@ -1295,7 +1330,7 @@ function App() {
   }
 
   const clearUploadedImage = () => {
-    setUploadedImage(null)
+    setUploadedImageId(null)
     setUploadedImagePreview(null)
   }
 
@@ -1387,19 +1422,19 @@ function App() {
                       <Search size={16} className="search-icon" />
                       <input
                         type="text"
-                        placeholder="Search by name or ID..."
+                        placeholder="Search by name, ID, email or phone..."
                         value={patientSearchQuery}
                         onChange={(e) => setPatientSearchQuery(e.target.value)}
                         className="patient-search-input"
                       />
                     </div>
                     <div className="patients-list">
-                      {filteredPatients.length === 0 ? (
+                      {patients.length === 0 ? (
                         <div className="no-patients">
                           <p>No patients found. {patientSearchQuery && 'Try a different search.'}</p>
                         </div>
                       ) : (
-                        filteredPatients.map((patient) => (
+                        patients.map((patient) => (
                           <div
                             key={patient.id}
                             className={`patient-item ${selectedPatient?.id === patient.id ? 'active' : ''}`}
@@ -1413,6 +1448,11 @@ function App() {
                           </div>
                         ))
                       )}
+                      {patientsCursor && (
+                        <button className="load-more-patients-btn" onClick={() => loadPatients(patientsCursor)}>
+                          Load more
+                        </button>
+                      )}
                     </div>
                     <button 
                       className="add-patient-btn" 
@@ -1687,6 +1727,16 @@ function App() {
                       <option value="glm">GLM-4.5 (Zhipu AI)</option>
                     </select>
                   </div>
+                  <div className="setting-item">
+                    <label>
+                      <input
+                        type="checkbox"
+                        checked={allowFallback}
+                        onChange={(e) => setAllowFallback(e.target.checked)}
+                      />
+                      If this provider fails, let another provider answer (sends the question and patient context to it)
+                    </label>
+                  </div>
                   <div className="setting-item">
                     <label>Current LLM</label>
                     <select disabled>
@@ -1841,10 +1891,18 @@ function App() {
             <div className="messages-container">
               {activeChat.messages.map((message) => (
                 <div key={message.id} className={`message ${message.type} ${message.thinking ? 'thinking' : ''} ${message.isError ? 'error' : ''}`}>
-                  {message.image && (
+                  {message.image ? (
                     <div className="message-image">
                       <img src={message.image} alt="Uploaded X-ray" />
                     </div>
+                  ) : message.imageId && (
+                    <div className="message-image">
+                      <AuthImage
+                        src={`${API_BASE_URL}${message.imageUrl || `/api/documents/${message.imageId}/download`}`}
+                        authToken={authToken}
+                        alt="Uploaded X-ray"
+                      />
+                    </div>
                   )}
                   <div className="message-content">
                     {message.thinking ? (
@@ -1860,6 +1918,11 @@ function App() {
                       {formatTimestamp(message.timestamp)}
                     </div>
                   )}
+                  {message.provider && message.requestedProvider && message.provider !== message.requestedProvider && (
+                    <div className="message-provider">
+                      Answered by {message.provider} ({message.requestedProvider} was unavailable)
+                    </div>
+                  )}
                   {message.type === 'ai' && !message.thinking && message.sources && message.sources.length > 0 && (
                     <div className="message-sources">
                       <details className="sources-details">
@@ -2319,10 +2382,7 @@ function App() {
                       <div
                         key={item.id}
                         className="collection-item"
-                        onClick={() => {
-                          createNewChat()
-                          setTimeout(() => setQuery(item.query_text), 100)
-                        }}
+                        onClick={() => reuseQuery(item)}
                       >
                         <Clock size={12} />
                         <span>{item.query_text.substring(0, 40)}...</span>
@@ -2342,10 +2402,7 @@ function App() {
                       <div
                         key={item.id}
                         className="collection-item"
-                        onClick={() => {
-                          createNewChat()
-                          setTimeout(() => setQuery(item.query_text), 100)
-                        }}
+                        onClick={() => reuseQuery(item)}
                       >
                         <FileText size={12} />
                         <span>{item.query_text.substring(0, 40)}...</span>
@@ -0,0 +1,36 @@
+import React, { useEffect, useState } from 'react'
+import axios from 'axios'
+
+// <img> for an endpoint that needs the Authorization header: the bytes are
+// fetched as a blob and shown through an object URL, so no base64 copy of
+// the image is kept in state
+export function AuthImage({ src, authToken, alt = '', ...props }) {
+  const [objectUrl, setObjectUrl] = useState(null)
+
+  useEffect(() => {
+    if (!src) return
+    let url = null
+    let cancelled = false
+
+    axios.get(src, {
+      responseType: 'blob',
+      headers: authToken ? { Authorization: `Bearer ${authToken}` } : {}
+    })
+      .then(response => {
+        if (cancelled) return
+        url = URL.createObjectURL(response.data)
+        setObjectUrl(url)
+      })
+      .catch(error => {
+        console.warn('Failed to load image:', error)
+      })
+
+    return () => {
+      cancelled = true
+      if (url) URL.revokeObjectURL(url)
+    }
+  }, [src, authToken])
+
+  if (!objectUrl) return null
+  return <img src={objectUrl} alt={alt} {...props} />
+}
@@ -0,0 +1,28 @@
+-- Tables for decoded DICOM uploads: cached PNG/JPEG derivatives and
+-- extracted technical tags. Safe to run more than once.
+
+-- Decoded derivatives of uploaded documents (DICOM previews, vision-ready JPEGs)
+CREATE TABLE IF NOT EXISTS document_derivatives (
+    id SERIAL PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES patient_documents(id) ON DELETE CASCADE,
+    kind VARCHAR(20) NOT NULL, -- 'preview' (PNG), 'vision' (JPEG)
+    content_type VARCHAR(100) NOT NULL,
+    file_size INTEGER,
+    file_data BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (document_id, kind)
+);
+
+-- Technical DICOM tags extracted at upload (no patient identifiers)
+CREATE TABLE IF NOT EXISTS dicom_tags (
+    document_id INTEGER PRIMARY KEY REFERENCES patient_documents(id) ON DELETE CASCADE,
+    modality VARCHAR(16),
+    body_part VARCHAR(64),
+    study_date DATE,
+    width INTEGER,
+    height INTEGER,
+    window_center REAL,
+    window_width REAL,
+    tags JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Prepare patient_documents for chunked, ranged downloads
+"""
+import os
+import sys
+import psycopg2
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+def get_db_connection():
+    return psycopg2.connect(
+        host=os.getenv("RDS_HOST", "localhost"),
+        port=os.getenv("RDS_PORT", "5432"),
+        database=os.getenv("RDS_DATABASE", "dentalgpt"),
+        user=os.getenv("RDS_USER", "postgres"),
+        password=os.getenv("RDS_PASSWORD", "")
+    )
+
+def main():
+    """Store file_data uncompressed for new rows and backfill file_size"""
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor()
+
+        print("Setting file_data storage to EXTERNAL...")
+        cur.execute("ALTER TABLE patient_documents ALTER COLUMN file_data SET STORAGE EXTERNAL")
+
+        print("Backfilling file_size...")
+        cur.execute(
+            """UPDATE patient_documents
+               SET file_size = octet_length(file_data)
+               WHERE file_size IS NULL AND file_data IS NOT NULL"""
+        )
+        print(f"Updated {cur.rowcount} documents")
+
+        conn.commit()
+        cur.close()
+        conn.close()
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        print(f"Error running migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+-- Chunked document downloads (/api/documents/{id}/download).
+-- With EXTERNAL storage, substring() on file_data reads only the TOAST
+-- chunks it needs instead of decompressing the whole file. This applies to
+-- rows written from now on; older rows still stream correctly, just less
+-- cheaply. file_size is backfilled so listings and downloads don't have to
+-- measure file_data.
+ALTER TABLE patient_documents ALTER COLUMN file_data SET STORAGE EXTERNAL;
+
+UPDATE patient_documents
+SET file_size = octet_length(file_data)
+WHERE file_size IS NULL AND file_data IS NOT NULL;
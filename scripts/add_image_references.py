@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Reference chat images by patient_documents id (chat_messages.image_id)
+"""
+import os
+import sys
+import psycopg2
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+def get_db_connection():
+    return psycopg2.connect(
+        host=os.getenv("RDS_HOST", "localhost"),
+        port=os.getenv("RDS_PORT", "5432"),
+        database=os.getenv("RDS_DATABASE", "dentalgpt"),
+        user=os.getenv("RDS_USER", "postgres"),
+        password=os.getenv("RDS_PASSWORD", "")
+    )
+
+def main():
+    """Run add_image_references.sql"""
+    sql_path = os.path.join(os.path.dirname(__file__), "add_image_references.sql")
+    try:
+        with open(sql_path) as f:
+            sql = f.read()
+
+        conn = get_db_connection()
+        cur = conn.cursor()
+        print("Adding chat_messages.image_id...")
+        cur.execute(sql)
+        conn.commit()
+        cur.close()
+        conn.close()
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        print(f"Error running migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+-- Store chat images once, in patient_documents, and reference them from
+-- chat_messages by id instead of repeating base64 in every message row.
+-- Safe to run more than once.
+
+-- Images sent in a chat without a patient are stored too
+ALTER TABLE patient_documents ALTER COLUMN patient_id DROP NOT NULL;
+
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS image_id INTEGER REFERENCES patient_documents(id) ON DELETE SET NULL;
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_image_id ON chat_messages(image_id) WHERE image_id IS NOT NULL;
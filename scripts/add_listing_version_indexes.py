@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Add the chats/patients indexes used by the ETag version checks
+"""
+import os
+import sys
+import psycopg2
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+def get_db_connection():
+    return psycopg2.connect(
+        host=os.getenv("RDS_HOST", "localhost"),
+        port=os.getenv("RDS_PORT", "5432"),
+        database=os.getenv("RDS_DATABASE", "dentalgpt"),
+        user=os.getenv("RDS_USER", "postgres"),
+        password=os.getenv("RDS_PASSWORD", "")
+    )
+
+INDEXES = [
+    ("idx_chats_user_updated", "chats", "(user_id, updated_at DESC)"),
+    ("idx_patients_user_updated", "patients", "(user_id, updated_at)"),
+]
+
+def main():
+    """Build the indexes without blocking writes"""
+    try:
+        conn = get_db_connection()
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        for name, table, definition in INDEXES:
+            print(f"Building {name}...")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {definition}")
+
+        cur.close()
+        conn.close()
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        print(f"Error running migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+-- Indexes for the ETag version checks on /api/chats and /api/patients:
+-- COUNT(*) and MAX(updated_at) per user come from an index-only scan.
+-- idx_chats_user_updated also serves the chat list's ORDER BY updated_at.
+-- add_listing_version_indexes.py builds them CONCURRENTLY instead, so they
+-- don't block writes.
+CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats(user_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_patients_user_updated ON patients(user_id, updated_at);
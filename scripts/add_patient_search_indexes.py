@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Add the pg_trgm extension and patient search indexes for /api/patients
+"""
+import os
+import sys
+import psycopg2
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+def get_db_connection():
+    return psycopg2.connect(
+        host=os.getenv("RDS_HOST", "localhost"),
+        port=os.getenv("RDS_PORT", "5432"),
+        database=os.getenv("RDS_DATABASE", "dentalgpt"),
+        user=os.getenv("RDS_USER", "postgres"),
+        password=os.getenv("RDS_PASSWORD", "")
+    )
+
+INDEXES = [
+    ("idx_patients_user_name", "(user_id, LOWER(name), id)"),
+    ("idx_patients_name_trgm", "USING GIN (LOWER(name) gin_trgm_ops)"),
+    ("idx_patients_id_trgm", "USING GIN (LOWER(id) gin_trgm_ops)"),
+    ("idx_patients_email_trgm", "USING GIN (LOWER(email) gin_trgm_ops)"),
+    ("idx_patients_phone_trgm", "USING GIN (LOWER(phone) gin_trgm_ops)"),
+]
+
+def main():
+    """Enable pg_trgm, then build the indexes without blocking writes"""
+    try:
+        conn = get_db_connection()
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        print("Enabling pg_trgm...")
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+        for name, definition in INDEXES:
+            print(f"Building {name}...")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON patients {definition}")
+
+        cur.close()
+        conn.close()
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        print(f"Error running migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
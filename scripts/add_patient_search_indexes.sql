@@ -0,0 +1,12 @@
+-- Indexes for paginated patient search (GET /api/patients?q=&cursor=).
+-- idx_patients_user_name serves the A-Z keyset walk; the trigram GIN
+-- indexes serve substring (LIKE '%q%') and fuzzy (%) matches.
+-- add_patient_search_indexes.py builds them CONCURRENTLY instead, so they
+-- don't block writes.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_patients_user_name ON patients(user_id, LOWER(name), id);
+CREATE INDEX IF NOT EXISTS idx_patients_name_trgm ON patients USING GIN (LOWER(name) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_id_trgm ON patients USING GIN (LOWER(id) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_email_trgm ON patients USING GIN (LOWER(email) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_phone_trgm ON patients USING GIN (LOWER(phone) gin_trgm_ops);
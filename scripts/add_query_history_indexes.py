@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Add dental_queries indexes for paginated /api/recent-queries and /api/patient-history
+"""
+import os
+import sys
+import psycopg2
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+def get_db_connection():
+    return psycopg2.connect(
+        host=os.getenv("RDS_HOST", "localhost"),
+        port=os.getenv("RDS_PORT", "5432"),
+        database=os.getenv("RDS_DATABASE", "dentalgpt"),
+        user=os.getenv("RDS_USER", "postgres"),
+        password=os.getenv("RDS_PASSWORD", "")
+    )
+
+INDEXES = [
+    ("idx_dental_queries_user_created", "(user_id, created_at DESC, id DESC)"),
+    ("idx_dental_queries_patient_created", "(patient_id, created_at DESC, id DESC)"),
+]
+
+def main():
+    """Build the indexes without blocking writes"""
+    try:
+        conn = get_db_connection()
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        for name, definition in INDEXES:
+            print(f"Building {name}...")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON dental_queries {definition}")
+
+        cur.close()
+        conn.close()
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        print(f"Error running migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
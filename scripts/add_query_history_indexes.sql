@@ -0,0 +1,6 @@
+-- Indexes for keyset pagination of /api/recent-queries and
+-- /api/patient-history (newest first, keyed on created_at, id).
+-- add_query_history_indexes.py builds them CONCURRENTLY instead, so they
+-- don't block query logging.
+CREATE INDEX IF NOT EXISTS idx_dental_queries_user_created ON dental_queries(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_dental_queries_patient_created ON dental_queries(patient_id, created_at DESC, id DESC);
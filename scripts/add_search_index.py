@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Add full-text search columns and GIN indexes for /api/search
+"""
+import os
+import sys
+import psycopg2
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+def get_db_connection():
+    return psycopg2.connect(
+        host=os.getenv("RDS_HOST", "localhost"),
+        port=os.getenv("RDS_PORT", "5432"),
+        database=os.getenv("RDS_DATABASE", "dentalgpt"),
+        user=os.getenv("RDS_USER", "postgres"),
+        password=os.getenv("RDS_PASSWORD", "")
+    )
+
+COLUMNS = [
+    ("chat_messages", "content_tsv",
+     "to_tsvector('english', coalesce(content, ''))"),
+    ("dental_queries", "search_tsv",
+     "setweight(to_tsvector('english', coalesce(query_text, '')), 'A') || "
+     "setweight(to_tsvector('english', coalesce(ai_response, '')), 'B')"),
+]
+
+INDEXES = [
+    ("idx_chat_messages_content_tsv", "chat_messages", "content_tsv"),
+    ("idx_dental_queries_search_tsv", "dental_queries", "search_tsv"),
+]
+
+def main():
+    """Add the tsvector columns, then build the GIN indexes without blocking writes"""
+    try:
+        conn = get_db_connection()
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction
+        conn.autocommit = True
+        cur = conn.cursor()
+
+        for table, column, expression in COLUMNS:
+            cur.execute(
+                """SELECT 1 FROM information_schema.columns
+                   WHERE table_name = %s AND column_name = %s""",
+                (table, column)
+            )
+            if cur.fetchone():
+                print(f"Column '{column}' already exists in {table}")
+                continue
+            print(f"Adding '{column}' to {table} (rewrites the table)...")
+            cur.execute(
+                f"ALTER TABLE {table} ADD COLUMN {column} tsvector "
+                f"GENERATED ALWAYS AS ({expression}) STORED"
+            )
+
+        for name, table, column in INDEXES:
+            print(f"Building {name}...")
+            cur.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} USING GIN ({column})")
+
+        cur.close()
+        conn.close()
+        print("Migration completed successfully!")
+
+    except Exception as e:
+        print(f"Error running migration: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+-- Full-text search for chat history and dental_queries (/api/search).
+-- Adding a STORED generated column rewrites the table, so run this in a
+-- quiet window on large databases. add_search_index.py builds the GIN
+-- indexes CONCURRENTLY instead, so they don't block writes.
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED;
+
+ALTER TABLE dental_queries ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(query_text, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(ai_response, '')), 'B')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_content_tsv ON chat_messages USING GIN (content_tsv);
+CREATE INDEX IF NOT EXISTS idx_dental_queries_search_tsv ON dental_queries USING GIN (search_tsv);
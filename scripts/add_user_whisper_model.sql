@@ -0,0 +1,3 @@
+-- Per-user Whisper model (size or tier such as "dictation"/"clinical");
+-- NULL uses the server default. Safe to run more than once.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS whisper_model VARCHAR(32);
@@ -1,6 +1,9 @@
 -- PostgreSQL database setup for DentalGPT
 -- Run this script to create the necessary tables
 
+-- Trigram indexes for patient search (/api/patients?q=)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Users table for authentication
 CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
@@ -12,6 +15,25 @@ CREATE TABLE IF NOT EXISTS users (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Patients table for clinic patient management
+CREATE TABLE IF NOT EXISTS patients (
+    id VARCHAR(50) PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    name VARCHAR(255) NOT NULL,
+    email VARCHAR(255),
+    phone VARCHAR(50),
+    date_of_birth DATE,
+    gender VARCHAR(20),
+    address TEXT,
+    medical_history TEXT,
+    dental_history TEXT,
+    allergies TEXT,
+    medications TEXT,
+    summary TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Chats table for storing user chat sessions
 CREATE TABLE IF NOT EXISTS chats (
     id SERIAL PRIMARY KEY,
@@ -41,6 +63,7 @@ CREATE TABLE IF NOT EXISTS chat_messages (
     message_type VARCHAR(10) NOT NULL CHECK (message_type IN ('user', 'ai')),
     content TEXT NOT NULL,
     sources JSONB,
+    image TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -65,51 +88,70 @@ BEGIN
     END IF;
 END $$;
 
--- Create indexes for faster queries
-CREATE INDEX IF NOT EXISTS idx_users_google_id ON users(google_id);
-CREATE INDEX IF NOT EXISTS idx_chats_user_id ON chats(user_id);
-CREATE INDEX IF NOT EXISTS idx_chats_patient_id ON chats(patient_id);
-CREATE INDEX IF NOT EXISTS idx_chat_messages_chat_id ON chat_messages(chat_id);
-CREATE INDEX IF NOT EXISTS idx_patient_id ON dental_queries(patient_id);
-CREATE INDEX IF NOT EXISTS idx_created_at ON dental_queries(created_at DESC);
-CREATE INDEX IF NOT EXISTS idx_dental_queries_user_id ON dental_queries(user_id);
-CREATE INDEX IF NOT EXISTS idx_patients_user_id ON patients(user_id);
-CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(name);
-CREATE INDEX IF NOT EXISTS idx_patient_documents_patient_id ON patient_documents(patient_id);
-CREATE INDEX IF NOT EXISTS idx_patient_documents_user_id ON patient_documents(user_id);
-
--- Patients table for clinic patient management
-CREATE TABLE IF NOT EXISTS patients (
-    id VARCHAR(50) PRIMARY KEY,
-    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    name VARCHAR(255) NOT NULL,
-    email VARCHAR(255),
-    phone VARCHAR(50),
-    date_of_birth DATE,
-    gender VARCHAR(20),
-    address TEXT,
-    medical_history TEXT,
-    dental_history TEXT,
-    allergies TEXT,
-    medications TEXT,
-    summary TEXT,
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-
 -- Patient documents table for storing X-rays, reports, etc.
 CREATE TABLE IF NOT EXISTS patient_documents (
     id SERIAL PRIMARY KEY,
-    patient_id VARCHAR(50) NOT NULL REFERENCES patients(id) ON DELETE CASCADE,
+    patient_id VARCHAR(50) REFERENCES patients(id) ON DELETE CASCADE, -- NULL for chat images not filed under a patient
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
     document_type VARCHAR(50) NOT NULL, -- 'xray', 'report', 'document', 'procedure_history'
     file_name VARCHAR(255) NOT NULL,
     file_path TEXT,
     file_size INTEGER,
+    file_data BYTEA,
     description TEXT,
-    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Decoded derivatives of uploaded documents (DICOM previews, vision-ready JPEGs)
+CREATE TABLE IF NOT EXISTS document_derivatives (
+    id SERIAL PRIMARY KEY,
+    document_id INTEGER NOT NULL REFERENCES patient_documents(id) ON DELETE CASCADE,
+    kind VARCHAR(20) NOT NULL, -- 'preview' (PNG), 'vision' (JPEG)
+    content_type VARCHAR(100) NOT NULL,
+    file_size INTEGER,
+    file_data BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (document_id, kind)
 );
 
+-- Technical DICOM tags extracted at upload (no patient identifiers)
+CREATE TABLE IF NOT EXISTS dicom_tags (
+    document_id INTEGER PRIMARY KEY REFERENCES patient_documents(id) ON DELETE CASCADE,
+    modality VARCHAR(16),
+    body_part VARCHAR(64),
+    study_date DATE,
+    width INTEGER,
+    height INTEGER,
+    window_center REAL,
+    window_width REAL,
+    tags JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Columns the API writes that older databases may lack
+-- Whisper model size or tier for the user's transcriptions; NULL uses the server default
+ALTER TABLE users ADD COLUMN IF NOT EXISTS whisper_model VARCHAR(32);
+ALTER TABLE patient_documents ADD COLUMN IF NOT EXISTS file_data BYTEA;
+ALTER TABLE patient_documents ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+-- Uploads are already-compressed images; storing them uncompressed lets
+-- substring() read just the chunks a download range needs
+ALTER TABLE patient_documents ALTER COLUMN file_data SET STORAGE EXTERNAL;
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS image TEXT;
+-- Chat images are stored once in patient_documents and referenced by id;
+-- the base64 image column is only read for older messages
+ALTER TABLE patient_documents ALTER COLUMN patient_id DROP NOT NULL;
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS image_id INTEGER REFERENCES patient_documents(id) ON DELETE SET NULL;
+
+-- Full-text search vectors, maintained by Postgres (see /api/search)
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED;
+ALTER TABLE dental_queries ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(query_text, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(ai_response, '')), 'B')
+    ) STORED;
+
 -- Add patient_id column to chats if it doesn't exist
 DO $$ 
 BEGIN
@@ -120,3 +162,28 @@ BEGIN
         ALTER TABLE chats ADD COLUMN patient_id VARCHAR(50) REFERENCES patients(id) ON DELETE SET NULL;
     END IF;
 END $$;
+
+-- Create indexes for faster queries
+CREATE INDEX IF NOT EXISTS idx_users_google_id ON users(google_id);
+CREATE INDEX IF NOT EXISTS idx_chats_user_id ON chats(user_id);
+CREATE INDEX IF NOT EXISTS idx_chats_patient_id ON chats(patient_id);
+CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats(user_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_chat_id ON chat_messages(chat_id);
+CREATE INDEX IF NOT EXISTS idx_patient_id ON dental_queries(patient_id);
+CREATE INDEX IF NOT EXISTS idx_created_at ON dental_queries(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_dental_queries_user_id ON dental_queries(user_id);
+CREATE INDEX IF NOT EXISTS idx_dental_queries_user_created ON dental_queries(user_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_dental_queries_patient_created ON dental_queries(patient_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_patients_user_id ON patients(user_id);
+CREATE INDEX IF NOT EXISTS idx_patients_name ON patients(name);
+CREATE INDEX IF NOT EXISTS idx_patients_user_name ON patients(user_id, LOWER(name), id);
+CREATE INDEX IF NOT EXISTS idx_patients_user_updated ON patients(user_id, updated_at);
+CREATE INDEX IF NOT EXISTS idx_patients_name_trgm ON patients USING GIN (LOWER(name) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_id_trgm ON patients USING GIN (LOWER(id) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_email_trgm ON patients USING GIN (LOWER(email) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_phone_trgm ON patients USING GIN (LOWER(phone) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patient_documents_patient_id ON patient_documents(patient_id);
+CREATE INDEX IF NOT EXISTS idx_patient_documents_user_id ON patient_documents(user_id);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_image_id ON chat_messages(image_id) WHERE image_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_chat_messages_content_tsv ON chat_messages USING GIN (content_tsv);
+CREATE INDEX IF NOT EXISTS idx_dental_queries_search_tsv ON dental_queries USING GIN (search_tsv);